@@ -0,0 +1,306 @@
+"""Measures the overhead of ShapeGuard relative to reading `tensor.shape`.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--backend numpy --backend torch]
+        [--filter guard] [--output results.json]
+
+Every benchmark is timed with `timeit` (best of --repeat runs), and
+reported in nanoseconds per call together with its ratio to the
+baseline of a raw `tensor.shape` access on the same backend. The JSON
+output is meant to be compared across releases.
+"""
+
+import argparse
+import importlib
+import json
+import platform
+import sys
+import tempfile
+import textwrap
+import timeit
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import shapeguard  # noqa: E402
+from shapeguard import ShapeGuard, sg, tools  # noqa: E402
+from shapeguard.parser import parse, parse_uncached  # noqa: E402
+
+SIMPLE = "B, C, H, W"
+ARITHMETIC = "B, C*(K+1), H2=H/2+P-P, (W-1)*2+2"
+ELLIPSIS = "B, ..., H, W"
+
+
+def make_tensor(backend: str, shape):
+    if backend == "numpy":
+        import numpy as np
+
+        return np.zeros(shape, dtype=np.float32)
+    elif backend == "torch":
+        import torch
+
+        return torch.zeros(shape)
+    raise ValueError(backend)
+
+
+def make_empty(backend: str, shape):
+    if backend == "numpy":
+        import numpy as np
+
+        return np.empty(shape, dtype=np.float32)
+    elif backend == "torch":
+        import torch
+
+        return torch.empty(shape)
+    raise ValueError(backend)
+
+
+def benchmarks(backend: str) -> Dict[str, Callable[[], Any]]:
+    x = make_tensor(backend, (8, 3, 32, 32))
+    arith = make_tensor(backend, (8, 9, 16, 32))
+    xs = [make_tensor(backend, (16, 4)) for _ in range(1000)]
+    known = {"B": 8, "C": 3, "H": 32, "W": 32}
+    spec = parse(SIMPLE)
+    shape = tools.get_shape(x)
+
+    def fresh_guard():
+        return ShapeGuard(dims=dict(known))
+
+    guard = fresh_guard()
+    sg.reset()
+    sg(x, SIMPLE)
+
+    def borrow():
+        with sg.borrow(SIMPLE, backend=backend):
+            pass
+
+    # 64 MiB, above pool.MIN_BYTES: fresh buffers fault in every page
+    # when they are first written
+    LARGE = "4096, 4096"
+
+    def borrow_large_fill():
+        with sg.borrow(LARGE, backend=backend) as buf:
+            buf[:] = 1
+
+    def empty_large_fill():
+        buf = make_empty(backend, (4096, 4096))
+        buf[:] = 1
+
+    def fork_churn():
+        with sg.fork(stride=2):
+            sg(x, "B, C, h, w")
+
+    handle = sg.fork_handle(stride=2)
+
+    def fork_handle():
+        with handle:
+            sg(x, "B, C, h, w")
+
+    def fork_throwaway():
+        with sg.fork():
+            sg(x, "B, C, h, w")
+
+    def sg_call_x100():
+        for _ in range(100):
+            sg(x, SIMPLE)
+
+    def site_cached_x100():
+        for _ in range(100):
+            sg(x, SIMPLE)
+
+    mask = make_tensor(backend, (8, 32))
+    out = make_tensor(backend, (8, 3))
+
+    def bare(x, mask=None):
+        return out
+
+    guarded_fn = sg.guard_fn({"x": "B, C, H, W", "mask": "B, H"}, returns="B, C")(bare)
+
+    def manual_fn(x, mask=None):
+        with sg.fork():
+            sg(x, "B, C, H, W")
+            sg(mask, "B, H")
+            return sg(bare(x, mask), "B, C")
+
+    return {
+        "baseline_shape": lambda: x.shape,
+        "parse_uncached_simple": lambda: parse_uncached(SIMPLE),
+        "parse_uncached_arithmetic": lambda: parse_uncached(ARITHMETIC),
+        "parse_cached": lambda: parse(SIMPLE),
+        "infer_simple": lambda: spec.infer(shape, {}),
+        "infer_arithmetic": lambda: parse(ARITHMETIC).infer(
+            tools.get_shape(arith), {"K": 2}
+        ),
+        "tools_guard_known": lambda: tools.guard(x, SIMPLE, known),
+        "tools_guard_infer": lambda: tools.guard(x, SIMPLE, {}),
+        "shapeguard_guard": lambda: guard.guard(x, SIMPLE),
+        "shapeguard_guard_arithmetic": lambda: ShapeGuard(dims={"K": 2}).guard(
+            arith, ARITHMETIC
+        ),
+        "shapeguard_guard_ellipsis": lambda: guard.guard(x, ELLIPSIS),
+        "shapeguard_guard_x4": lambda: [guard.guard(t, SIMPLE) for t in (x, x, x, x)],
+        "shapeguard_guard_all_x4": lambda: guard.guard_all(
+            [(t, SIMPLE) for t in (x, x, x, x)]
+        ),
+        "sg_call": lambda: sg(x, SIMPLE),
+        "sg_call_x100": sg_call_x100,
+        "sg_call_site_cached_x100": site_cached_x100,
+        "sg_call_list_1000": lambda: sg(xs, ["_N, D"]),
+        "sg_call_list_1000_mixed": lambda: sg(xs, ["L, D", "L, 4"] * 500),
+        "sg_rearrange": lambda: guard.rearrange(x, "B, C, H, W -> B, H*W, C"),
+        "baseline_rearrange": lambda: (
+            x.permute(0, 2, 3, 1).reshape(8, 32 * 32, 3)
+            if backend == "torch"
+            else x.transpose(0, 2, 3, 1).reshape(8, 32 * 32, 3)
+        ),
+        "sg_empty": lambda: sg.empty(SIMPLE, backend=backend),
+        "sg_borrow_pooled": borrow,
+        "baseline_empty": lambda: make_empty(backend, (8, 3, 32, 32)),
+        "sg_borrow_pooled_64mib_fill": borrow_large_fill,
+        "baseline_empty_64mib_fill": empty_large_fill,
+        "sg_fork_churn": fork_churn,
+        "sg_fork_handle": fork_handle,
+        "sg_fork_throwaway": fork_throwaway,
+        "baseline_fn": lambda: bare(x, mask),
+        "sg_guard_fn": lambda: guarded_fn(x, mask),
+        "sg_guard_fn_manual": lambda: manual_fn(x, mask),
+    }
+
+
+STRIP_MODULE = """
+from shapeguard import sg
+
+def guarded(x):
+    sg(x, "B, C, H, W")
+    return x
+
+def unguarded(x):
+    return x
+"""
+
+
+@contextmanager
+def pooled() -> Iterator[None]:
+    sg.enable_pool()
+    try:
+        yield
+    finally:
+        sg.disable_pool()
+
+
+@contextmanager
+def site_cached() -> Iterator[None]:
+    sg.enable_site_cache()
+    try:
+        yield
+    finally:
+        sg.disable_site_cache()
+
+
+# benchmark -> state it runs in, set up outside of the timed region
+CONTEXTS: Dict[str, Callable[[], ContextManager[None]]] = {
+    "sg_call_site_cached_x100": site_cached,
+    "sg_borrow_pooled": pooled,
+    "sg_borrow_pooled_64mib_fill": pooled,
+}
+
+
+def strip_benchmarks(backend: str, tmp_dir: Path) -> Dict[str, Callable[[], Any]]:
+    """Compares a stripped module against unguarded and noop-guarded code."""
+    name = f"sg_bench_strip_{backend}"
+    package = tmp_dir / name
+    package.mkdir(parents=True, exist_ok=True)
+    (package / "__init__.py").write_text("")
+    (package / "stripped.py").write_text(textwrap.dedent(STRIP_MODULE))
+    (package / "plain.py").write_text(textwrap.dedent(STRIP_MODULE))
+    sys.path.insert(0, str(tmp_dir))
+    shapeguard.strip_modules([f"{name}.stripped"])
+    plain = importlib.import_module(f"{name}.plain")
+    stripped = importlib.import_module(f"{name}.stripped")
+
+    x = make_tensor(backend, (8, 3, 32, 32))
+
+    def noop():
+        with sg.noop():
+            for _ in range(100):
+                plain.guarded(x)
+
+    return {
+        "strip_unguarded_x100": lambda: [plain.unguarded(x) for _ in range(100)],
+        "strip_stripped_x100": lambda: [stripped.guarded(x) for _ in range(100)],
+        "strip_noop_x100": noop,
+    }
+
+
+def time_ns(fn: Callable[[], Any], repeat: int, min_time: float) -> float:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(number, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def versions() -> Dict[str, Optional[str]]:
+    result: Dict[str, Optional[str]] = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    for module in ("numpy", "torch"):
+        try:
+            result[module] = __import__(module).__version__
+        except ImportError:
+            result[module] = None
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", action="append", choices=["numpy", "torch"])
+    parser.add_argument(
+        "--filter", default="", help="only run benchmarks containing this"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per run")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in args.backend or ["numpy", "torch"]:
+            try:
+                make_tensor(backend, (1,))
+            except ImportError:
+                print(f"skipping {backend}: not installed", file=sys.stderr)
+                continue
+            benches = benchmarks(backend)
+            benches.update(strip_benchmarks(backend, Path(tmp) / backend))
+            baseline = time_ns(benches["baseline_shape"], args.repeat, args.min_time)
+            for name, fn in benches.items():
+                if args.filter not in name:
+                    continue
+                context = CONTEXTS.get(name)
+                if context is None:
+                    ns = time_ns(fn, args.repeat, args.min_time)
+                else:
+                    with context():
+                        ns = time_ns(fn, args.repeat, args.min_time)
+                results.append(
+                    {
+                        "name": name,
+                        "backend": backend,
+                        "ns_per_call": round(ns, 1),
+                        "relative_to_shape": round(ns / baseline, 2),
+                    }
+                )
+                print(f"{backend:6} {name:32} {ns:12.1f} ns  {ns / baseline:8.1f}x")
+
+    if args.output:
+        Path(args.output).write_text(
+            json.dumps({"versions": versions(), "results": results}, indent=2)
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -15,6 +15,13 @@
 """This python module contains ShapeGuard."""
 
 from . import patch
-from .exception import ShapeError
+from .exception import ReshapeCopyError, ShapeError
 from .guard import ShapeGuard
 from .interface import sg
+from .parser import spec_cache
+from .policy import Always, EveryNth, FirstN, Probability
+from .shims import register_shim
+from .strip import strip_from_environ, strip_modules
+from .tools import set_reshape_copy_hook
+
+strip_from_environ()
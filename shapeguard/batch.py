@@ -0,0 +1,158 @@
+"""Guards long lists of shapes against templates with vectorized comparisons.
+
+For each distinct template, the first shape is guarded as usual, which
+infers all its dims. Every other shape must then be equal to the
+evaluated template (except in wildcard columns and columns of
+underscore dims that are used only once), so the shapes are stacked
+into one integer matrix and compared with it at once. Templates that
+can't be fully evaluated (ellipsis, dynamic dims, other underscore
+dims) and shapes with None entries fall back to guarding one shape at a
+time, as does everything when numpy is not installed.
+"""
+
+from __future__ import annotations
+
+import itertools
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+
+from . import exception, tools
+from .dim_specs import Dynamic, DynamicNamedDim, NamedDim, Wildcard
+from .parser import parse
+from .shape_spec import ShapeType
+
+if TYPE_CHECKING:
+    from .guard import ShapeGuard
+
+# how many offending indices to show in errors
+MAX_REPORTED = 10
+
+
+def guard_list(guard: ShapeGuard, tensors: Sequence, templates: Sequence[str]) -> None:
+    """Guards tensors[i] against templates[i], or all against a single template."""
+    guard_shapes(guard, tools.get_shapes(tensors), templates)
+
+
+def guard_shapes(
+    guard: ShapeGuard, shapes: Sequence[ShapeType], templates: Sequence[str]
+) -> None:
+    """Guards shapes[i] against templates[i], or all against a single template."""
+    if len(templates) == 1:
+        _guard_group(guard, templates[0], shapes, None)
+        return
+
+    groups: Dict[str, List[int]] = {}
+    for i, template in enumerate(templates):
+        groups.setdefault(template, []).append(i)
+    for template, indices in groups.items():
+        _guard_group(guard, template, [shapes[i] for i in indices], indices)
+
+
+def _guard_group(
+    guard: ShapeGuard,
+    template: str,
+    shapes: Sequence[ShapeType],
+    indices: Optional[List[int]],
+) -> None:
+    guard.guard_shape(shapes[0], template)
+    if len(shapes) == 1:
+        return
+
+    expected = _expected_shape(template, guard)
+    if expected is None:
+        _guard_each(guard, template, shapes)
+        return
+
+    try:
+        import numpy as np
+    except ImportError:
+        _guard_each(guard, template, shapes)
+        return
+
+    rank = len(expected)
+    if set(map(len, shapes)) != {rank}:
+        bad_rank = [i for i, s in enumerate(shapes) if len(s) != rank]
+        _raise(
+            "Tensors have the wrong rank", template, expected, shapes, bad_rank, indices
+        )
+
+    try:
+        # much faster than np.array() on a list of tuples
+        flat = itertools.chain.from_iterable(shapes)
+        matrix = np.fromiter(flat, dtype=np.int64, count=len(shapes) * rank)
+    except TypeError:
+        # None entries
+        _guard_each(guard, template, shapes)
+        return
+    matrix = matrix.reshape(len(shapes), rank)
+    columns = [j for j, e in enumerate(expected) if e is not None]
+    mismatches = matrix[:, columns] != np.array([expected[j] for j in columns])
+    bad = np.flatnonzero(mismatches.any(axis=1)).tolist()
+    if bad:
+        _raise("Shape Mismatch", template, expected, shapes, bad, indices)
+
+
+def _expected_shape(template: str, guard: ShapeGuard) -> Optional[List[Optional[int]]]:
+    """The shape all matching tensors must have, None for wildcard entries.
+
+    Returns None if the template can't be fully evaluated with the
+    known dims.
+    """
+    spec = parse(template)
+    if spec.has_ellipsis:
+        return None
+    names = [n for entry in spec.entries for n in entry.iter_names()]
+    expected: List[Optional[int]] = []
+    for entry in spec.entries:
+        if isinstance(entry, Wildcard) or _is_free_comment(entry, names):
+            expected.append(None)
+        elif isinstance(entry, (Dynamic, DynamicNamedDim)):
+            return None
+        else:
+            try:
+                expected.append(entry.evaluate(guard.dims))
+            except exception.UnderspecifiedShapeError:
+                return None
+    return expected
+
+
+def _is_free_comment(entry, names: List[str]) -> bool:
+    """Whether entry is an underscore dim that matches any size."""
+    return (
+        type(entry) is NamedDim
+        and entry.name.startswith("_")
+        and names.count(entry.name) == 1
+    )
+
+
+def _guard_each(guard: ShapeGuard, template: str, shapes: Sequence[ShapeType]) -> None:
+    for shape in shapes[1:]:
+        guard.guard_shape(shape, template)
+
+
+def _raise(
+    message: str,
+    template: str,
+    expected: List[Optional[int]],
+    shapes: Sequence[ShapeType],
+    bad: List[int],
+    indices: Optional[List[int]],
+):
+    positions = bad if indices is None else [indices[i] for i in bad]
+    shown = ", ".join(str(i) for i in positions[:MAX_REPORTED])
+    if len(positions) > MAX_REPORTED:
+        shown += ", ..."
+    expected_repr = ["*" if e is None else e for e in expected]
+    raise exception.ShapeError(
+        "{} for {} of {} elements at indices [{}].\n"
+        "Expected shape: {} (from template {})\n"
+        "  Actual shape: {} (element {})".format(
+            message,
+            len(positions),
+            len(shapes),
+            shown,
+            expected_repr,
+            template,
+            list(shapes[bad[0]]),
+            positions[0],
+        )
+    )
@@ -0,0 +1,118 @@
+"""A small bounded, thread-safe LRU mapping used for ShapeGuard's caches."""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, TypeVar
+
+import attr
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class CacheInfo:
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: Optional[int]
+    currsize: int
+
+
+class LRUCache(Generic[K, V]):
+    """Bounded mapping with least-recently-used eviction.
+
+    `maxsize=None` means unbounded, `maxsize=0` disables caching
+    entirely (every lookup is a miss). Values are expected to be
+    treated as immutable once they are in the cache, since they are
+    shared between all callers.
+    """
+
+    def __init__(self, maxsize: Optional[int] = 128):
+        self._data: OrderedDict[K, V] = OrderedDict()
+        self._lock = threading.Lock()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: K, value: V) -> None:
+        with self._lock:
+            if self.maxsize == 0:
+                return
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._evict()
+
+    def setdefault(self, key: K, value: V) -> V:
+        """Inserts value unless key is present; returns the cached value."""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                return self._data[key]
+            if self.maxsize != 0:
+                self._data[key] = value
+                self._evict()
+            return value
+
+    def get_or_create(self, key: K, factory: Callable[[K], V]) -> V:
+        value = self.get(key)
+        if value is None:
+            # create outside of the lock, so that slow factories don't
+            # serialize unrelated lookups
+            value = factory(key)
+            self.put(key, value)
+        return value
+
+    def pop(self, key: K) -> Optional[V]:
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def resize(self, maxsize: Optional[int]) -> None:
+        with self._lock:
+            self.maxsize = maxsize
+            if maxsize == 0:
+                self._data.clear()
+            self._evict()
+
+    def clear(self) -> None:
+        """Drops all entries and resets the counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                maxsize=self.maxsize,
+                currsize=len(self._data),
+            )
+
+    def _evict(self) -> None:
+        if self.maxsize is None:
+            return
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
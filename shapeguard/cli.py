@@ -0,0 +1,79 @@
+"""The `shapeguard` command.
+
+shapeguard data/train -t "n, H, W, 3"
+shapeguard data/*.npz -t "x: n, H, W, 3" -t "y: n" -j 16
+"""
+
+import argparse
+import sys
+from typing import Dict, List, Optional
+
+from .dataset import DEFAULT, validate_dataset
+
+# how many offending files to list
+MAX_REPORTED = 20
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="shapeguard",
+        description="Checks the shapes of .npy/.npz files against templates, "
+        "reading only their headers.",
+    )
+    parser.add_argument("paths", nargs="+", help="files or directories")
+    parser.add_argument(
+        "-t",
+        "--template",
+        action="append",
+        required=True,
+        help="template for all arrays, or NAME:TEMPLATE for the .npz member NAME",
+    )
+    parser.add_argument(
+        "-j", "--processes", type=int, help="worker processes (0 for none)"
+    )
+    parser.add_argument(
+        "-d", "--dim", action="append", default=[], help="known dim, as NAME=SIZE"
+    )
+    args = parser.parse_args(argv)
+
+    from .guard import ShapeGuard
+
+    guard = ShapeGuard(dims=_pairs(parser, args.dim, "=", int))
+    report = validate_dataset(
+        args.paths,
+        _pairs(parser, args.template, ":", str, DEFAULT),
+        args.processes,
+        guard,
+    )
+
+    for path, error in list(report.errors.items())[:MAX_REPORTED]:
+        print(f"{path}: {error}", file=sys.stderr)
+    if len(report.errors) > MAX_REPORTED:
+        print(f"... and {len(report.errors) - MAX_REPORTED} more", file=sys.stderr)
+    print(
+        f"{report.files} files, {report.arrays} arrays, {len(report.errors)} failed; "
+        f"dims: {report.dims}"
+    )
+    return 0 if report.ok else 1
+
+
+def _pairs(
+    parser: argparse.ArgumentParser,
+    values: List[str],
+    sep: str,
+    kind,
+    default: Optional[str] = None,
+) -> Dict:
+    # templates use ":", since "=" assigns dims in templates, eg. "D=2*K, N"
+    result = {}
+    for value in values:
+        name, found, rest = value.partition(sep)
+        if not found:
+            if default is None:
+                parser.error(f"Expected NAME{sep}VALUE, got {value!r}")
+            name, rest = default, value
+        try:
+            result[name.strip()] = kind(rest.strip())
+        except ValueError:
+            parser.error(f"Invalid value in {value!r}")
+    return result
@@ -0,0 +1,246 @@
+"""Compiles ShapeSpecs into specialized, straight-line guard functions.
+
+`ShapeSpec.infer` and `ShapeSpec.matches` interpret the template on
+every call. Since the order in which names can be inferred only
+depends on which names are already known, we can instead plan the
+inference once per set of known names and generate a Python function
+that checks the rank, constants and known dims, infers the unknown
+ones and verifies all arithmetic in a single pass, without raising
+exceptions on the happy path. The order of the inference steps comes
+from `ShapeSpec.solve_order`.
+"""
+
+from __future__ import annotations
+
+import operator
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    cast,
+)
+
+from . import dim_specs, exception, solver
+
+if TYPE_CHECKING:
+    from .shape_spec import ShapeSpec, ShapeType
+
+GuardFunction = Callable[[Any, Mapping[str, int]], Optional[Dict[str, int]]]
+
+_INFIX = {
+    operator.add: "+",
+    operator.sub: "-",
+    operator.mul: "*",
+    operator.floordiv: "//",
+}
+
+
+class CompiledSpec:
+    """Callable that guards a shape against a ShapeSpec.
+
+    `compiled(shape, known_dims)` returns the newly inferred,
+    non-underscore dims or None if the shape does not match the
+    template. A guard function is generated (and cached) for every
+    distinct set of known names the spec is used with.
+    """
+
+    def __init__(self, spec: ShapeSpec):
+        self.spec = spec
+        self.names = spec.names
+        self._functions: Dict[Tuple[bool, ...], GuardFunction] = {}
+        self._sources: Dict[Tuple[bool, ...], str] = {}
+
+    def __call__(
+        self, shape: ShapeType, known_dims: Mapping[str, int]
+    ) -> Optional[Dict[str, int]]:
+        key = tuple([n in known_dims for n in self.names])
+        try:
+            fn = self._functions[key]
+        except KeyError:
+            fn = self._functions[key] = self._build(key)
+        try:
+            return fn(shape, known_dims)
+        except ZeroDivisionError:
+            # an inversion or a check divided by a zero dim
+            return None
+
+    def source(self, known_dims: Mapping[str, int]) -> str:
+        """Returns the generated source used for the given known dims."""
+        key = tuple([n in known_dims for n in self.names])
+        if key not in self._sources:
+            self._functions[key] = self._build(key)
+        return self._sources[key]
+
+    def interpret(
+        self, shape: ShapeType, known_dims: Mapping[str, int]
+    ) -> Optional[Dict[str, int]]:
+        """Slow path with the same contract as __call__."""
+        if not self.spec.rank_matches(shape):
+            return None
+        try:
+            inferred = self.spec.infer(shape, known_dims)
+            if not self.spec.matches(shape, inferred):
+                return None
+        except exception.ShapeError:
+            return None
+        return {
+            k: v
+            for k, v in inferred.items()
+            if k not in known_dims and not k.startswith("_")
+        }
+
+    def _build(self, key: Tuple[bool, ...]) -> GuardFunction:
+        known = {n for n, k in zip(self.names, key) if k}
+        source, namespace = _Generator(self, known).generate()
+        code = compile(source, f"<shapeguard {self.spec!r}>", "exec")
+        exec(code, namespace)
+        self._sources[key] = source
+        return cast(GuardFunction, namespace["guard"])
+
+
+class _Generator:
+    def __init__(self, compiled: CompiledSpec, known: Set[str]):
+        self.spec = compiled.spec
+        self.initially_known = set(known)
+        self.known = set(known)
+        self.variables = {n: f"_v{i}" for i, n in enumerate(compiled.names)}
+        self.namespace: Dict[str, Any] = {"_interpret": compiled.interpret}
+        self.lines: List[str] = []
+        # name -> index of the entry that determines it directly from the shape
+        self.direct_source: Dict[str, int] = {}
+
+    def generate(self) -> Tuple[str, Dict[str, Any]]:
+        spec = self.spec
+        positions = self._positions()
+        n_entries = len(spec.left_entries) + len(spec.right_entries)
+
+        self.emit("def guard(shape, dims):")
+        if spec.has_ellipsis:
+            self.emit(f"    if len(shape) < {n_entries}:")
+            self.emit("        return None")
+            for i, pos in positions:
+                self.emit(f"    s{i} = shape[{pos}]")
+        else:
+            self.emit(f"    if len(shape) != {n_entries}:")
+            self.emit("        return None")
+            targets = ", ".join(f"s{i}" for i, _ in positions)
+            self.emit(f"    {targets}, = shape")
+
+        for n in sorted(self.initially_known, key=list(self.variables).index):
+            self.emit(f"    {self.variables[n]} = dims[{n!r}]")
+
+        entries = list(enumerate(self._zipped()))
+        self._emit_steps(entries)
+        self._emit_checks(entries)
+
+        inferred = ", ".join(
+            f"{n!r}: {v}"
+            for n, v in self.variables.items()
+            if n in self.known
+            and n not in self.initially_known
+            and not n.startswith("_")
+        )
+        self.emit(f"    return {{{inferred}}}")
+        return "\n".join(self.lines) + "\n", self.namespace
+
+    def emit(self, line: str) -> None:
+        self.lines.append(line)
+
+    def _positions(self) -> List[Tuple[int, int]]:
+        spec = self.spec
+        left = [(i, i) for i in range(len(spec.left_entries))]
+        n_right = len(spec.right_entries)
+        right = [(len(left) + j, j - n_right) for j in range(n_right)]
+        return left + right
+
+    def _zipped(self) -> List[dim_specs.DimSpec]:
+        return list(self.spec.left_entries) + list(self.spec.right_entries)
+
+    def _emit_steps(self, entries) -> None:
+        order = self.spec.solve_order(self.initially_known)
+        for step in order.steps:
+            i, e = entries[step.index]
+            var = self.variables[step.name]
+            if step.kind == solver.DIRECT:
+                self.emit(f"    if s{i} is None:")
+                if isinstance(e, dim_specs.DynamicNamedDim):
+                    self.emit("        return _interpret(shape, dims)")
+                else:
+                    self.emit("        return None")
+                self.emit(f"    {var} = s{i}")
+                self.direct_source[step.name] = i
+            elif step.kind == solver.ASSIGN:
+                self.emit(f"    {var} = {self._expr(e.value)}")
+            else:
+                self.emit(f"    if s{i} is None:")
+                if isinstance(e, dim_specs.AssignDim):
+                    expr = e.value
+                    self.emit("        return None")
+                else:
+                    expr = e
+                    self.emit("        return _interpret(shape, dims)")
+                self.emit(f"    {var} = {self._invert(expr, f's{i}')}")
+            self.known.add(step.name)
+
+    def _emit_checks(self, entries) -> None:
+        for i, e in entries:
+            if isinstance(e, (dim_specs.Wildcard, dim_specs.EllipsisDim)):
+                continue
+            elif isinstance(e, dim_specs.Number):
+                self._emit_mismatch(f"s{i} != {e.value}")
+            elif isinstance(e, dim_specs.Dynamic):
+                self._emit_mismatch(f"s{i} is not None")
+            elif isinstance(e, dim_specs.DynamicNamedDim):
+                if self.direct_source.get(e.name) != i:
+                    var = self.variables[e.name]
+                    self._emit_mismatch(f"s{i} is not None and s{i} != {var}")
+            elif isinstance(e, dim_specs.NamedDim):
+                if e.name in self.known:
+                    if self.direct_source.get(e.name) != i:
+                        self._emit_mismatch(f"s{i} != {self.variables[e.name]}")
+                else:
+                    self._emit_mismatch(f"s{i} is None")
+            elif isinstance(e, dim_specs.OpSpec):
+                if self._evaluable(e):
+                    self._emit_mismatch(f"s{i} is not None and s{i} != {self._expr(e)}")
+            else:
+                raise TypeError(f"Cannot compile dimension {e!r}")
+
+    def _emit_mismatch(self, condition: str) -> None:
+        self.emit(f"    if {condition}:")
+        self.emit("        return None")
+
+    def _evaluable(self, expr: dim_specs.DimSpec) -> bool:
+        return all(n in self.known for n in expr.iter_names())
+
+    def _expr(self, expr: dim_specs.DimSpec) -> str:
+        if isinstance(expr, dim_specs.Number):
+            return repr(expr.value)
+        elif isinstance(expr, dim_specs.NamedDim):
+            return self.variables[expr.name]
+        elif isinstance(expr, dim_specs.OpSpec):
+            return self._apply(expr.op, self._expr(expr.left), self._expr(expr.right))
+        raise TypeError(f"Cannot compile dimension {expr!r}")
+
+    def _invert(self, expr: dim_specs.DimSpec, value: str) -> str:
+        if isinstance(expr, dim_specs.OpSpec):
+            if self._evaluable(expr.left):
+                inner = self._apply(expr.right_op, value, self._expr(expr.left))
+                return self._invert(expr.right, inner)
+            else:
+                inner = self._apply(expr.left_op, value, self._expr(expr.right))
+                return self._invert(expr.left, inner)
+        return value
+
+    def _apply(self, op: Any, left: str, right: str) -> str:
+        if op in _INFIX:
+            return f"({left} {_INFIX[op]} {right})"
+        name = f"_op{len(self.namespace)}"
+        self.namespace[name] = op
+        return f"{name}({left}, {right})"
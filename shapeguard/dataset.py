@@ -0,0 +1,188 @@
+"""Validates directories of .npy/.npz shards against shape templates.
+
+Only the array headers are read (for .npz members too, which are
+decompressed just far enough to reach the header), so the cost per
+file doesn't depend on its size. Headers are read by a process pool;
+the shapes are then guarded in the calling process, in file order,
+against one ShapeGuard. Upper-case dims must therefore agree across
+all files, while lower-case dims are local to each file (as in a fork).
+"""
+
+from __future__ import annotations
+
+import ast
+import os
+import re
+import zipfile
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+
+import attr
+
+from .dims import LayeredDims
+from .exception import ShapeGuardError
+from .guard import ShapeGuard
+
+# the template for arrays without one of their own (and for .npy files)
+DEFAULT = "*"
+
+SUFFIXES = (".npy", ".npz")
+
+_MAGIC = b"\x93NUMPY"
+_SHAPE = re.compile(rb"'shape':\s*\(([^)]*)\)")
+
+# path -> array name -> shape, or the error reading the file
+_Headers = Tuple[str, Union[Dict[str, Tuple[int, ...]], str]]
+
+
+@attr.s(auto_attribs=True)
+class DatasetReport:
+    files: int = 0
+    arrays: int = 0
+    # offending file -> error message
+    errors: Dict[str, str] = attr.Factory(dict)
+    # the upper-case dims, as inferred from the files
+    dims: Dict[str, int] = attr.Factory(dict)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+def validate_dataset(
+    paths: Union[str, os.PathLike, Iterable[Union[str, os.PathLike]]],
+    templates: Union[str, Mapping[str, str]],
+    processes: Optional[int] = None,
+    guard: Optional[ShapeGuard] = None,
+) -> DatasetReport:
+    """Checks every .npy/.npz file under `paths` against `templates`.
+
+    Args:
+      paths: files or directories (searched recursively)
+      templates: a template for all arrays, or a template per .npz
+        member name; DEFAULT ("*") is used for other members and .npy
+        files. Arrays without a template are not checked.
+      processes: size of the process pool; 0 reads the headers in this
+        process. Defaults to the number of CPUs.
+      guard: the ShapeGuard holding dims known in advance
+    """
+    if isinstance(templates, str):
+        templates = {DEFAULT: templates}
+    files = find_files(paths)
+    guard = ShapeGuard() if guard is None else guard
+    report = DatasetReport(files=len(files))
+    for path, headers in _read_all(files, processes):
+        if isinstance(headers, str):
+            report.errors[path] = headers
+            continue
+        error = _guard_file(guard, headers, templates)
+        report.arrays += len(headers)
+        if error is not None:
+            report.errors[path] = error
+    report.dims = dict(guard.dims)
+    return report
+
+
+def find_files(
+    paths: Union[str, os.PathLike, Iterable[Union[str, os.PathLike]]],
+) -> List[str]:
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    files: List[str] = []
+    for path in [os.fspath(p) for p in paths]:
+        if os.path.isdir(path):
+            files.extend(_walk(path))
+        else:
+            files.append(path)
+    return files
+
+
+def _walk(directory: str) -> List[str]:
+    # sorted, so that reports (and which file is blamed for a
+    # disagreement) don't depend on the file system
+    files: List[str] = []
+    with os.scandir(directory) as entries:
+        for entry in sorted(entries, key=lambda e: e.name):
+            if entry.is_dir():
+                files.extend(_walk(entry.path))
+            elif entry.name.endswith(SUFFIXES):
+                files.append(entry.path)
+    return files
+
+
+def _guard_file(
+    guard: ShapeGuard, headers: Dict[str, Tuple[int, ...]], templates: Mapping[str, str]
+) -> Optional[str]:
+    # upper-case dims go to a layer of their own, and only reach the
+    # shared dims if the whole file is valid
+    dims = LayeredDims({}, guard.dims)
+    file_guard = ShapeGuard(dims=dims)
+    for name, shape in headers.items():
+        template = templates.get(name, templates.get(DEFAULT))
+        if template is None:
+            continue
+        try:
+            file_guard.guard_shape(shape, template)
+        except ShapeGuardError as e:
+            return f"{name}: {e}" if name else str(e)
+    guard.dims.update(dims.base)
+    return None
+
+
+def _read_all(files: Sequence[str], processes: Optional[int]) -> Iterable[_Headers]:
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes <= 1 or len(files) < 2 * processes:
+        return _read_chunk(files)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    # large chunks amortize the inter-process overhead, while leaving a
+    # few chunks per worker to balance the load
+    size = max(1, min(1024, len(files) // (processes * 4)))
+    chunks = [files[i : i + size] for i in range(0, len(files), size)]
+    with ProcessPoolExecutor(processes) as executor:
+        return [h for chunk in executor.map(_read_chunk, chunks) for h in chunk]
+
+
+def _read_chunk(files: Sequence[str]) -> List[_Headers]:
+    results: List[_Headers] = []
+    for path in files:
+        try:
+            results.append((path, read_headers(path)))
+        except Exception as e:
+            results.append((path, f"Can't read header: {e}"))
+    return results
+
+
+def read_headers(path: str) -> Dict[str, Tuple[int, ...]]:
+    """The shape of the array in a .npy file, or of each member of a .npz.
+
+    The array in a .npy file is named "".
+    """
+    if path.endswith(".npz"):
+        shapes: Dict[str, Tuple[int, ...]] = {}
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                if member.endswith(".npy"):
+                    with archive.open(member) as f:
+                        shapes[member[: -len(".npy")]] = _read_shape(f)
+        return shapes
+    with open(path, "rb") as f:
+        return {"": _read_shape(f)}
+
+
+def _read_shape(f) -> Tuple[int, ...]:
+    # see numpy.lib.format; parsing the shape out of the header with a
+    # regex is much faster than numpy's literal_eval of the whole dict
+    magic = f.read(8)
+    if len(magic) != 8 or magic[:6] != _MAGIC:
+        raise ValueError("not a .npy file")
+    length_size = 2 if magic[6] == 1 else 4
+    header = f.read(int.from_bytes(f.read(length_size), "little"))
+    match = _SHAPE.search(header)
+    if match is not None:
+        try:
+            return tuple(int(s) for s in match.group(1).split(b",") if s.strip())
+        except ValueError:
+            pass
+    return tuple(ast.literal_eval(header.decode("latin1"))["shape"])
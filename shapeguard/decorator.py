@@ -0,0 +1,244 @@
+"""A decorator that guards the arguments and return value of a function.
+
+All the work that doesn't depend on the arguments is done when the
+function is decorated: the signature is bound to positional indices,
+templates are parsed and the fork handle is created. A call then costs
+one scope for the body and one compiled guard of all the arguments
+jointly (like tools.guard_all_shapes), whose spec is kept per function
+and argument ranks.
+
+While stats, policies, deferred guarding or the site cache are enabled,
+or for tensors with graph guards (and inside torch.compile), every
+argument goes through the same path as `sg()` instead.
+"""
+
+from __future__ import annotations
+
+import functools
+import inspect
+import sys
+from types import FrameType
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+from . import exception, interface, stats, tools
+from .dims import LayeredDims
+from .interface import ForkHandle, Interface, _noop, _scope, leave_scope
+from .parser import parse
+from .shape_spec import ShapeSpec, ShapeType, joint_spec
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# the joint specs of a function are dropped once there are this many
+_MAX_JOINTS = 64
+
+# (parameter name, positional index or None, template)
+_Check = Tuple[str, Optional[int], str]
+# (parameter name, value, template) of a passed argument
+_Arg = Tuple[str, Any, str]
+
+
+def guard_fn(
+    templates: Dict[str, str],
+    *,
+    returns: Optional[str] = None,
+    fork: Optional[Dict[str, Any]] = None,
+) -> Callable[[F], F]:
+    """See `sg.guard_fn`."""
+    handle = ForkHandle(fork or {})
+    # a throwaway scope reads its dims straight from the base
+    throwaway = not fork
+    # the template is kept for error messages
+    return_check = None if returns is None else (returns, parse(returns))
+
+    def decorate(fn: F) -> F:
+        checks = _bind(fn, templates)
+        qualname = getattr(fn, "__qualname__", repr(fn))
+        # ranks of the arguments (-1 if not passed) -> joint spec
+        joints: Dict[Tuple[int, ...], ShapeSpec] = {}
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _noop.get():
+                return fn(*args, **kwargs)
+            n_args = len(args)
+            # the guarded arguments, None where not passed
+            values: List[Any] = []
+            for name, index, _ in checks:
+                if index is not None and index < n_args:
+                    value = args[index]
+                else:
+                    value = kwargs.get(name)
+                values.append(value)
+
+            if not _is_plain(values):
+                # dynamo can't trace sys._getframe
+                frame = None if _is_compiling() else sys._getframe(1)
+                with handle:
+                    for (name, _, template), value in zip(checks, values):
+                        if value is not None:
+                            _check_routed((name, value, template), frame, qualname)
+                    result = fn(*args, **kwargs)
+                    if return_check is not None:
+                        _check_routed(
+                            ("return value", result, return_check[0]),
+                            frame,
+                            qualname,
+                        )
+                return result
+
+            scope = handle.new_scope(_scope.get())
+            dims = scope.guard.dims
+            assert isinstance(dims, LayeredDims)
+            shapes = [None if v is None else tools.get_shape(v) for v in values]
+            key = tuple([-1 if shape is None else len(shape) for shape in shapes])
+            joint = joints.get(key)
+            if joint is None:
+                joint = _joint(checks, shapes)
+                if joint is not None:
+                    if len(joints) >= _MAX_JOINTS:
+                        joints.clear()
+                    joints[key] = joint
+            inferred = None
+            if joint is not None:
+                joint_shape = [
+                    s for shape in shapes if shape is not None for s in shape
+                ]
+                inferred = joint.compiled(joint_shape, dims.base if throwaway else dims)
+            if inferred is None:
+                present = [
+                    (name, value, template)
+                    for (name, _, template), value in zip(checks, values)
+                    if value is not None
+                ]
+                inferred = _check_all(present, dims, qualname)
+            if inferred:
+                dims.assign(inferred)
+
+            token = _scope.set(scope)
+            try:
+                result = fn(*args, **kwargs)
+                if return_check is not None:
+                    template, spec = return_check
+                    inferred = spec.compiled(tools.get_shape(result), dims)
+                    if inferred is None:
+                        inferred = _check_all(
+                            [("return value", result, template)], dims, qualname
+                        )
+                    if inferred:
+                        dims.assign(inferred)
+            finally:
+                _scope.reset(token)
+                leave_scope(scope)
+            return result
+
+        return wrapper  # type: ignore
+
+    return decorate
+
+
+def _bind(fn: Callable, templates: Dict[str, str]) -> List[_Check]:
+    parameters = inspect.signature(fn).parameters
+    unknown = set(templates) - set(parameters)
+    if unknown:
+        raise TypeError(f"{fn} has no parameters {sorted(unknown)}")
+
+    checks: List[_Check] = []
+    for index, (name, parameter) in enumerate(parameters.items()):
+        if name not in templates:
+            continue
+        if parameter.kind in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD):
+            raise TypeError(f"Can't guard variadic parameter {name} of {fn}")
+        positional = parameter.kind in (
+            parameter.POSITIONAL_ONLY,
+            parameter.POSITIONAL_OR_KEYWORD,
+        )
+        template = templates[name]
+        parse(template)
+        checks.append((name, index if positional else None, template))
+    return checks
+
+
+def _joint(
+    checks: Sequence[_Check], shapes: Sequence[Optional[ShapeType]]
+) -> Optional[ShapeSpec]:
+    """The joint spec of the passed arguments, or None if a rank doesn't match."""
+    specs = []
+    ranks = []
+    for (_, _, template), shape in zip(checks, shapes):
+        if shape is not None:
+            spec = parse(template)
+            if not spec.rank_matches(shape):
+                return None
+            specs.append(spec)
+            ranks.append(len(shape))
+    return joint_spec(specs, ranks)
+
+
+def _is_plain(values: Sequence[Any]) -> bool:
+    """Whether the arguments can be guarded jointly, without any of sg()'s hooks."""
+    if (
+        stats.recorder is not None
+        or Interface._sampling
+        or Interface._deferred is not None
+        or Interface._site_cache is not None
+        or _is_compiling()
+    ):
+        return False
+    graph_guards = tools.graph_guards
+    if graph_guards:
+        for value in values:
+            if type(value) in graph_guards:
+                return False
+    return True
+
+
+def _check_all(
+    present: Sequence[_Arg], dims: MutableMapping[str, int], qualname: str
+) -> Dict[str, int]:
+    """Guards the arguments jointly, raising with the name of the offending one."""
+    shapes = [tools.get_shape(value) for _, value, _ in present]
+    templates = [template for _, _, template in present]
+    try:
+        return tools.guard_all_shapes(shapes, templates, dims)
+    except exception.ShapeGuardError as e:
+        # name the first argument that conflicts with the others
+        known = dict(dims)
+        for (name, _, template), shape in zip(present, shapes):
+            try:
+                known.update(tools.guard_shape(shape, template, known))
+            except exception.ShapeGuardError as arg_error:
+                raise _annotated(arg_error, qualname, name) from None
+        raise _annotated(e, qualname, ", ".join(templates)) from None
+
+
+def _is_compiling() -> bool:
+    is_compiling = interface._is_compiling
+    return is_compiling is not None and is_compiling()
+
+
+def _check_routed(arg: _Arg, frame: Optional[FrameType], qualname: str) -> None:
+    name, value, template = arg
+    try:
+        if frame is None:
+            # traced by dynamo, see Interface.__new__
+            Interface(value, template)
+        elif stats.recorder is None:
+            Interface._call(value, template, frame)
+        else:
+            Interface._call_recorded(value, template, frame)
+    except exception.ShapeGuardError as e:
+        raise _annotated(e, qualname, name) from None
+
+
+def _annotated(e: exception.ShapeGuardError, qualname: str, name: str) -> Exception:
+    return type(e)(f"\n\t>>> {qualname}: {name}\n {str(e)}")
@@ -0,0 +1,164 @@
+"""Deferred guarding on a background thread.
+
+With `sg.enable_deferred()`, sg() only captures the shape, template and
+call site and puts them on a bounded queue. A worker thread then does
+the parsing, inference and matching against the dims of the fork that
+was active at the call. Violations are passed to `on_error` if given
+(in the worker thread), otherwise they are raised by the next
+`sg.flush()`.
+"""
+
+from __future__ import annotations
+
+import linecache
+import logging
+import queue
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from .exception import ShapeGuardError
+
+if TYPE_CHECKING:
+    from .guard import ShapeGuard
+    from .shape_spec import ShapeType
+
+logger = logging.getLogger("shapeguard")
+
+ErrorCallback = Callable[[Exception], None]
+
+# sentinel that stops the worker
+_STOP = ("stop",)
+
+
+def log_violation(e: Exception) -> None:
+    """An `on_error` callback that logs violations."""
+    logger.error("Deferred shape guard failed: %s", e)
+
+
+class DeferredChecker:
+    """Bounded queue of guards and the worker thread that checks them.
+
+    Args:
+      maxsize: maximum number of queued guards
+      block: when the queue is full, block the caller (True) or drop
+        the guard and count it in `dropped` (False)
+      on_error: called with every violation; if None, the first
+        violation is kept (and the others counted in `failures`) until
+        `flush()` raises it
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        block: bool = True,
+        on_error: Optional[ErrorCallback] = None,
+    ):
+        self.block = block
+        self.on_error = on_error
+        self.checked = 0
+        self.dropped = 0
+        self.failures = 0
+        self.error: Optional[Exception] = None
+        self.maxsize = maxsize
+        # SimpleQueue is implemented in C and much cheaper to put to than
+        # Queue; the bound is enforced in submit()
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._not_full = threading.Condition()
+        self._waiting = 0
+        self._thread = threading.Thread(
+            target=self._run, name="shapeguard-deferred", daemon=True
+        )
+        self._thread.start()
+
+    def submit(
+        self, guard: ShapeGuard, shape: ShapeType, template: str, frame: Any
+    ) -> None:
+        if self._queue.qsize() >= self.maxsize:
+            if not self.block:
+                self.dropped += 1
+                return
+            self._wait_not_full()
+        self._queue.put(
+            (guard, shape, template, frame.f_code.co_filename, frame.f_lineno)
+        )
+
+    def _wait_not_full(self) -> None:
+        with self._not_full:
+            self._waiting += 1
+            try:
+                # the timeout guards against missing a notification
+                while self._queue.qsize() >= self.maxsize:
+                    self._check_alive()
+                    self._not_full.wait(timeout=0.01)
+            finally:
+                self._waiting -= 1
+
+    def call_soon(self, fn: Callable[[], None]) -> None:
+        """Runs fn on the worker after everything queued so far. Never dropped."""
+        self._queue.put((fn,))
+
+    def flush(self) -> None:
+        """Waits for all queued guards and raises the first violation."""
+        done = threading.Event()
+        self.call_soon(done.set)
+        while not done.wait(timeout=0.1):
+            self._check_alive()
+        error = self.error
+        if error is not None:
+            self.error = None
+            self.failures = 0
+            raise error
+
+    def _check_alive(self) -> None:
+        if not self._thread.is_alive():
+            raise ShapeGuardError("The deferred guard worker has stopped")
+
+    def stop(self) -> None:
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if self._waiting:
+                with self._not_full:
+                    self._not_full.notify()
+            if item is _STOP:
+                return
+            if len(item) == 1:
+                item[0]()
+            else:
+                self._check(*item)
+
+    def _check(
+        self,
+        guard: ShapeGuard,
+        shape: ShapeType,
+        template: str,
+        filename: str,
+        lineno: int,
+    ) -> None:
+        try:
+            guard.guard_shape(shape, template)
+        except Exception as e:
+            error = _annotate(e, linecache.getline(filename, lineno).strip())
+            if self.on_error is None:
+                self.failures += 1
+                if self.error is None:
+                    self.error = error
+            else:
+                self.on_error(error)
+        finally:
+            self.checked += 1
+
+
+def _annotate(e: Exception, offending_line: str) -> Exception:
+    if not offending_line:
+        return e
+    # as in sg(), other exception types are cast to ShapeGuardError
+    # and chained
+    error_type = type(e) if isinstance(e, ShapeGuardError) else ShapeGuardError
+    error = error_type(f"\n\t>>> {offending_line}\n {str(e)}")
+    error.__cause__ = None if isinstance(e, ShapeGuardError) else e
+    error.__suppress_context__ = True
+    return error
@@ -17,7 +17,7 @@
 from __future__ import annotations
 
 import operator
-from typing import Any, Callable, Dict, Generic, Optional, TypeVar, Union
+from typing import Any, Callable, Dict, Generic, Mapping, Optional, TypeVar, Union
 
 from . import exception
 
@@ -42,7 +42,10 @@ BinaryOperator = Union[OperatorType, FunctionProperty[OperatorType]]
 
 
 class DimSpec:
-    """Baseclass for single dimension specification."""
+    """Baseclass for single dimension specification.
+
+    DimSpecs are treated as immutable after construction.
+    """
 
     @classmethod
     def make(cls, children=()):
@@ -52,7 +55,7 @@ class DimSpec:
         super(DimSpec, self).__init__()
 
     def has_conflict(
-        self, shape_entry: Optional[int], known_dims: Dict[str, int]
+        self, shape_entry: Optional[int], known_dims: Mapping[str, int]
     ) -> bool:
         """Determines if this dim spec has a conflict with a given shape_entry.
 
@@ -61,18 +64,18 @@ class DimSpec:
 
         Args:
           shape_entry: int or None. Dim-value of the shape to be checked
-          known_dims: Dict[str, int]. Dictionary of known named dimension sizes
+          known_dims: Mapping[str, int]. Dictionary of known named dimension sizes
 
         Returns:
           True if there is a conflict (with given knowledge), False otherwise
         """
         raise NotImplementedError
 
-    def evaluate(self, known_dims: Dict[str, int]) -> Optional[int]:
+    def evaluate(self, known_dims: Mapping[str, int]) -> Optional[int]:
         """Evaluate the value of this dimension under the given known_dims.
 
         Args:
-          known_dims: Dict[str, int]. Dictionary of known named dimension sizes
+          known_dims: Mapping[str, int]. Dictionary of known named dimension sizes
 
         Returns:
           int or None. The expected size of this dimension.
@@ -84,13 +87,13 @@ class DimSpec:
         raise NotImplementedError
 
     def infer(
-        self, shape_entry: Optional[int], known_dims: Dict[str, int]
+        self, shape_entry: Optional[int], known_dims: Mapping[str, int]
     ) -> Dict[str, int]:
         """Try to infer named-dimension sizes from the given shape_entry.
 
         Args:
           shape_entry: int or None. Dim-value of the shape to be checked
-          known_dims: Dict[str, int]. Dictionary of known named dimension sizes
+          known_dims: Mapping[str, int]. Dictionary of known named dimension sizes
 
         Returns:
           Dict[str, int]: dictionary of inferred named dimension sizes
@@ -101,6 +104,10 @@ class DimSpec:
         """Iterate all multiplicative sub-components of this dimension."""
         yield self
 
+    def iter_names(self):
+        """Iterate all dimension names referenced by this dimension."""
+        return iter(())
+
     def __repr__(self) -> str:
         return "<DimSpec>"
 
@@ -120,28 +127,28 @@ class EllipsisDim(DimSpec):
         return cls.instance
 
     def has_conflict(
-        self, shape_entry: Optional[int], known_dims: Dict[str, int]
+        self, shape_entry: Optional[int], known_dims: Mapping[str, int]
     ) -> bool:
         raise RuntimeError("Should never be called.")
 
     def __repr__(self) -> str:
         return "..."
 
-    def evaluate(self, known_dims: Dict[str, int]) -> Optional[int]:
+    def evaluate(self, known_dims: Mapping[str, int]) -> Optional[int]:
         raise exception.UnderspecifiedShapeError("EllipsisDim cannot be evaluated.")
 
     def __eq__(self, other) -> bool:
         return isinstance(other, EllipsisDim)
 
 
-ellipsis_dim = EllipsisDim.make()
+ellipsis_dim: EllipsisDim = EllipsisDim.make()
 
 
 class Wildcard(DimSpec):
     """Represents a dimension with any size."""
 
     def has_conflict(
-        self, shape_entry: Optional[int], known_dims: Dict[str, int]
+        self, shape_entry: Optional[int], known_dims: Mapping[str, int]
     ) -> bool:
         return False  # by definition never has a conflict
 
@@ -166,14 +173,14 @@ class Number(DimSpec):
         self.value = int(value)
 
     def has_conflict(
-        self, shape_entry: Optional[int], known_dims: Dict[str, int]
+        self, shape_entry: Optional[int], known_dims: Mapping[str, int]
     ) -> bool:
         if shape_entry is None:
             return True
         else:
             return shape_entry != self.value
 
-    def evaluate(self, known_dims: Dict[str, int]) -> Optional[int]:
+    def evaluate(self, known_dims: Mapping[str, int]) -> Optional[int]:
         return self.value
 
     def __repr__(self) -> str:
@@ -190,11 +197,11 @@ class Dynamic(DimSpec):
     """Represents a dynamic dimension (i.e. None entry in shape)."""
 
     def has_conflict(
-        self, shape_entry: Optional[int], known_dims: Dict[str, int]
+        self, shape_entry: Optional[int], known_dims: Mapping[str, int]
     ) -> bool:
         return shape_entry is not None  # only matches None dimensions
 
-    def evaluate(self, known_dims: Dict[str, int]) -> Optional[int]:
+    def evaluate(self, known_dims: Mapping[str, int]) -> Optional[int]:
         return None
 
     def __repr__(self):
@@ -214,7 +221,7 @@ class NamedDim(DimSpec):
         self.name = str(name)
 
     def has_conflict(
-        self, shape_entry: Optional[int], known_dims: Dict[str, int]
+        self, shape_entry: Optional[int], known_dims: Mapping[str, int]
     ) -> bool:
         if shape_entry is None:
             return True
@@ -223,7 +230,7 @@ class NamedDim(DimSpec):
         else:
             return known_dims[self.name] != shape_entry
 
-    def evaluate(self, known_dims: Dict[str, int]) -> Optional[int]:
+    def evaluate(self, known_dims: Mapping[str, int]) -> Optional[int]:
         if self.name in known_dims:
             return known_dims[self.name]
         raise exception.UnderspecifiedShapeError(
@@ -231,13 +238,16 @@ class NamedDim(DimSpec):
         )
 
     def infer(
-        self, shape_entry: Optional[int], known_dims: Dict[str, int]
+        self, shape_entry: Optional[int], known_dims: Mapping[str, int]
     ) -> Dict[str, int]:
         if shape_entry is None or self.name in known_dims:
             return {}
         else:
             return {self.name: shape_entry}
 
+    def iter_names(self):
+        yield self.name
+
     def __repr__(self):
         return self.name
 
@@ -251,12 +261,12 @@ class NamedDim(DimSpec):
 class AssignDim(NamedDim):
     """ Represents an assignment to a new name """
 
-    def __init__(self, name: str, value: Union[NamedDim, OpSpec, Number]):
+    def __init__(self, name: str, value: DimSpec):
         super(AssignDim, self).__init__(name)
         self.value = value
 
     def infer(
-        self, shape_entry: Optional[int], known_dims: Dict[str, int]
+        self, shape_entry: Optional[int], known_dims: Mapping[str, int]
     ) -> Dict[str, int]:
 
         try:
@@ -273,6 +283,13 @@ class AssignDim(NamedDim):
                 )
             return {self.name: val}
 
+    def iter_names(self):
+        yield self.name
+        yield from self.value.iter_names()
+
+    def __repr__(self):
+        return "{}={!r}".format(self.name, self.value)
+
 
 class DynamicNamedDim(NamedDim):
     """Represents a dynamic or named dimension."""
@@ -281,14 +298,14 @@ class DynamicNamedDim(NamedDim):
         super(DynamicNamedDim, self).__init__(name)
 
     def has_conflict(
-        self, shape_entry: Optional[int], known_dims: Dict[str, int]
+        self, shape_entry: Optional[int], known_dims: Mapping[str, int]
     ) -> bool:
         if shape_entry is None or self.name not in known_dims:
             return False
         else:
             return known_dims[self.name] != shape_entry
 
-    def evaluate(self, known_dims: Dict[str, int]) -> Optional[int]:
+    def evaluate(self, known_dims: Mapping[str, int]) -> Optional[int]:
         if self.name in known_dims:
             return known_dims[self.name]
         else:
@@ -304,6 +321,15 @@ class DynamicNamedDim(NamedDim):
             return self.name == other.name
 
 
+# right_op(shape_entry, left): the right operand, given the result
+def _rsub(a, b):
+    return b - a
+
+
+def _rfloordiv(a, b):
+    return b // a
+
+
 class OpSpec(DimSpec):
     """Baseclass for dimension operations."""
 
@@ -317,28 +343,43 @@ class OpSpec(DimSpec):
         self.left: DimSpec = left
         self.right: DimSpec = right
 
-    def evaluate(self, known_dims: Dict[str, int]) -> Optional[int]:
-        return self.op(self.left.evaluate(known_dims), self.right.evaluate(known_dims))
+    def evaluate(self, known_dims: Mapping[str, int]) -> Optional[int]:
+        left_val = self.left.evaluate(known_dims)
+        right_val = self.right.evaluate(known_dims)
+        try:
+            return self.op(left_val, right_val)
+        except ZeroDivisionError:
+            raise exception.ShapeError(f"Division by zero in {self!r}") from None
 
     def infer(
-        self, shape_entry: Optional[int], known_dims: Dict[str, int]
+        self, shape_entry: Optional[int], known_dims: Mapping[str, int]
     ) -> Dict[str, int]:
         try:
             left_val = self.left.evaluate(known_dims)
-            right_val = self.right_op(shape_entry, left_val)
+            right_val = self._solve(self.right_op, shape_entry, left_val)
             return self.right.infer(right_val, known_dims)
         except exception.UnderspecifiedShapeError:
             pass
         try:
             right_val = self.right.evaluate(known_dims)
-            left_val = self.left_op(shape_entry, right_val)
+            left_val = self._solve(self.left_op, shape_entry, right_val)
             return self.left.infer(left_val, known_dims)
         except exception.UnderspecifiedShapeError:
             pass
         return {}
 
+    def _solve(
+        self, op: OperatorType, shape_entry: Optional[int], value: Optional[int]
+    ):
+        try:
+            return op(shape_entry, value)
+        except ZeroDivisionError:
+            raise exception.ShapeError(
+                f"Can't solve {self!r} = {shape_entry}: division by zero"
+            ) from None
+
     def has_conflict(
-        self, shape_entry: Optional[int], known_dims: Dict[str, int]
+        self, shape_entry: Optional[int], known_dims: Mapping[str, int]
     ) -> bool:
         if shape_entry is None:
             return False
@@ -356,6 +397,10 @@ class OpSpec(DimSpec):
     def __repr__(self):
         return "({} {} {})".format(self.left, self.op_str, self.right)
 
+    def iter_names(self):
+        yield from self.left.iter_names()
+        yield from self.right.iter_names()
+
     def flat_iter(self):
         if self.op == operator.mul:
             for c in self.left.flat_iter():
@@ -381,7 +426,7 @@ class SubDims(OpSpec):
     op_str = "-"
     op = operator.sub
     left_op = operator.add
-    right_op = operator.sub
+    right_op = staticmethod(_rsub)
 
 
 class MulDims(OpSpec):
@@ -399,4 +444,4 @@ class DivDims(OpSpec):
     op_str = "/"
     op = operator.floordiv
     left_op = operator.mul
-    right_op = operator.floordiv
+    right_op = staticmethod(_rfloordiv)
@@ -0,0 +1,93 @@
+"""Layered dims used inside forks.
+
+A fork scope looks up dims in its own local layer, then the base dims,
+then the dims saved for the fork from earlier entries, without copying
+any of them. Upper-case dims are written straight to the base;
+lower-case dims and deletions stay local until `save()`.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Iterator, MutableMapping, Optional, Set
+
+# marks a dim that was dropped in the local layer
+_DELETED: Any = object()
+
+
+class LayeredDims(MutableMapping[str, int]):
+    __slots__ = ("local", "base", "saved")
+
+    def __init__(
+        self,
+        base: MutableMapping[str, int],
+        saved: Optional[MutableMapping[str, int]] = None,
+    ):
+        self.local: Dict[str, int] = {}
+        self.base = base
+        self.saved: MutableMapping[str, int] = {} if saved is None else saved
+
+    def __getitem__(self, key: str) -> int:
+        if key in self.local:
+            value = self.local[key]
+            if value is _DELETED:
+                raise KeyError(key)
+            return value
+        if key in self.base:
+            return self.base[key]
+        return self.saved[key]
+
+    def __contains__(self, key: object) -> bool:
+        if key in self.local:
+            return self.local[key] is not _DELETED
+        return key in self.base or key in self.saved
+
+    def __setitem__(self, key: str, value: int) -> None:
+        if key[:1].isupper():
+            self.base[key] = value
+            self.local.pop(key, None)
+        else:
+            self.local[key] = value
+
+    def assign(self, dims: Dict[str, int]) -> None:
+        """Sets several dims, like update() without MutableMapping's overhead."""
+        base = self.base
+        local = self.local
+        for key, value in dims.items():
+            if key[:1].isupper():
+                base[key] = value
+                local.pop(key, None)
+            else:
+                local[key] = value
+
+    def layer(self, key: str) -> MutableMapping[str, int]:
+        """The layer that `key` is written to."""
+        return self.base if key[:1].isupper() else self.local
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self:
+            raise KeyError(key)
+        self.local[key] = _DELETED
+
+    def __iter__(self) -> Iterator[str]:
+        seen: Set[str] = set()
+        for layer in (self.local, self.base, self.saved):
+            # other threads may be writing to the base
+            for key, value in list(layer.items()):
+                if key not in seen:
+                    seen.add(key)
+                    if value is not _DELETED:
+                        yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+    def save(self) -> None:
+        """Applies the local layer to the saved dims."""
+        for key, value in self.local.items():
+            if value is _DELETED:
+                self.saved.pop(key, None)
+            else:
+                self.saved[key] = value
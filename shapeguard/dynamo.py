@@ -0,0 +1,134 @@
+"""Guards inside `torch.compile`d code.
+
+While dynamo traces a function, sg() is routed here instead of the
+usual path (whose frame inspection, dict mutation and exceptions would
+break the graph). The guard runs once, at trace time, on the fake
+tensor and adds nothing to the graph: static sizes are checked right
+away, and dynamic (SymInt) sizes that the template determines are
+passed to `torch._check`, which turns them into guards on the symbolic
+shapes. Names bound only to SymInts are remembered for the rest of the
+trace (not in the dims, but per fork scope like them), so later uses
+are checked against them. `sg.fork()` scopes are also entered and left
+at trace time, on a stack per trace, so that nothing about them is
+traced. A guarded function thus compiles to the same single graph as
+an unguarded one.
+
+Violations are found while tracing, so they are raised by the call of
+the compiled function, wrapped by dynamo: as an InternalTorchDynamoError
+(a RuntimeError) whose message starts with "ShapeError: Shape Mismatch"
+for static sizes, or "RuntimeError: Shape Mismatch" for dynamic ones.
+They are not ShapeErrors, since dynamo wraps whatever is raised while
+tracing.
+"""
+
+from __future__ import annotations
+
+import weakref
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import torch
+from torch._dynamo.comptime import comptime
+from torch._guards import TracingContext
+
+from . import tools
+from .dim_specs import NamedDim
+from .parser import parse
+
+if TYPE_CHECKING:
+    from .guard import ShapeGuard
+    from .interface import _Scope
+
+# ShapeEnv of the trace -> symbolic sizes of names that are only known
+# as SymInts, see tools.graph_symbols
+_symbols: tools.SymbolTables = weakref.WeakKeyDictionary()
+
+# TracingContext -> forks entered in the traced code. Abandoned with the
+# trace if it fails, so a fork left open by an error doesn't leak.
+_scopes: "weakref.WeakKeyDictionary[TracingContext, List[_Scope]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+is_compiling = torch.compiler.is_compiling
+
+
+def guard(arg, template) -> None:
+    if isinstance(template, str):
+        _guard_tensor(arg, template)
+        return
+    templates = list(template)
+    if len(templates) == 1:
+        templates = templates * len(arg)
+    for tensor, t in zip(arg, templates):
+        _guard_tensor(tensor, t)
+
+
+def _guard_tensor(tensor: torch.Tensor, template: str) -> None:
+    # the locals are read at trace time, by name
+    comptime(_trace_time_guard)
+
+
+def enter_fork(params: Dict[str, Any]) -> None:
+    # the locals are read at trace time, by name
+    comptime(_trace_time_enter)
+
+
+def exit_fork() -> None:
+    comptime(_trace_time_exit)
+
+
+def _trace_time_enter(ctx: Any) -> None:
+    from .interface import ForkHandle
+
+    params = ctx.get_local("params").as_python_constant()
+    stack = _scopes.setdefault(TracingContext.get(), [])
+    stack.append(ForkHandle(params).new_scope(stack[-1] if stack else None))
+
+
+def _trace_time_exit(ctx: Any) -> None:
+    from .interface import leave_scope
+
+    leave_scope(_scopes[TracingContext.get()].pop())
+
+
+def current_guard() -> ShapeGuard:
+    """The guard of the innermost fork entered in the traced code, or sg.get()."""
+    from .interface import sg
+
+    context = TracingContext.try_get()
+    stack = None if context is None else _scopes.get(context)
+    return stack[-1].guard if stack else sg.get()
+
+
+def _trace_time_guard(ctx: Any) -> None:
+    fake = ctx.get_local("tensor").as_fake()
+    template = ctx.get_local("template").as_python_constant()
+    check_fake_shape(fake.shape, template, fake.fake_mode.shape_env)
+
+
+def check_fake_shape(sizes, template: str, shape_env: Any) -> None:
+    shape: List[Optional[int]] = [
+        None if isinstance(s, torch.SymInt) else s for s in sizes
+    ]
+    guard = current_guard()
+    inferred, expected = tools.guard_partial_shape(shape, template, guard.dims)
+    if inferred:
+        guard.dims.update(inferred)
+    dynamic = [i for i, s in enumerate(shape) if s is None]
+    entries = parse(template).entries_for_rank(len(shape))
+    for i, size in zip(dynamic, expected):
+        if size is not None:
+            torch._check(sizes[i] == size, lambda: _message(template, i, size))
+            continue
+        entry = entries[i]
+        if type(entry) is not NamedDim or shape_env is None:
+            continue
+        symbols = tools.graph_symbols(_symbols, shape_env, guard.dims, entry.name)
+        symbol = symbols.setdefault(entry.name, sizes[i])
+        if symbol is not sizes[i]:
+            torch._check(sizes[i] == symbol, lambda: _message(template, i, entry.name))
+
+
+def _message(template: str, index: int, expected: Any) -> str:
+    return (
+        f"Shape Mismatch: dim {index} should be {expected} (from template {template})"
+    )
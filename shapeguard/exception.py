@@ -31,3 +31,9 @@ class UnderspecifiedShapeError(ShapeGuardError):
 
 class ShapeGuardShimError(ShapeGuardError):
     pass
+
+
+class ReshapeCopyError(ShapeGuardError):
+    """A strict reshape would have copied the tensor."""
+
+    pass
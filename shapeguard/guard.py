@@ -16,32 +16,91 @@
 
 from __future__ import annotations
 
-from copy import copy
-from typing import Any, Dict, List, Optional
+import sys
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import attr
 
-from . import tools
+from . import rearrange, stats, tools
+from .policy import Policy
+from .shape_spec import ShapeType
 
 
 @attr.s(auto_attribs=True)
 class ShapeGuard:
     params: Dict[str, Any] = attr.ib(factory=dict)
-    dims: Dict[str, int] = attr.ib(factory=dict)
+    dims: MutableMapping[str, int] = attr.ib(factory=dict)
+    # used by sg() when this is the active fork, see sg.set_policy
+    policy: Optional[Policy] = None
 
     def matches(self, tensor, template: str) -> bool:
         return tools.matches(tensor, template, self.dims)
 
     def guard(self, tensor, template: str):
-        inferred_dims = tools.guard(tensor, template, self.dims)
-        self.dims.update(inferred_dims)
+        graph_guard = tools.graph_guards.get(type(tensor))
+        if graph_guard is not None:
+            graph_guard(self, tensor, template)
+            return tensor
+
+        recorder = stats.recorder
+        if recorder is None:
+            self.guard_shape(tools.get_shape(tensor), template)
+            return tensor
+
+        status = None
+        start = stats.clock()
+        try:
+            self.guard_shape(tools.get_shape(tensor), template)
+            status = stats.CHECKED
+        finally:
+            recorder.record(sys._getframe(1), template, stats.clock() - start, status)
         return tensor
 
-    def reshape(self, tensor, template: str):
-        return tools.reshape(tensor, template, self.dims)
+    def guard_shape(self, shape: ShapeType, template: str) -> None:
+        inferred_dims = tools.guard_shape(shape, template, self.dims)
+        self.dims.update(inferred_dims)
+
+    def guard_all(
+        self, tensors: Union[Mapping[Any, str], Iterable[Tuple[Any, str]]]
+    ) -> None:
+        """Guards several tensors jointly, see tools.guard_all_shapes.
+
+        Args:
+          tensors: {tensor: template} (for hashable tensors) or
+            [(tensor, template), ...]
+        """
+        pairs = tensors.items() if isinstance(tensors, Mapping) else tensors
+        shapes = []
+        templates = []
+        for tensor, template in pairs:
+            shapes.append(tools.get_shape(tensor))
+            templates.append(template)
+        inferred_dims = tools.guard_all_shapes(shapes, templates, self.dims)
+        self.dims.update(inferred_dims)
+
+    def reshape(self, tensor, template: str, strict: bool = False):
+        return tools.reshape(tensor, template, self.dims, strict)
+
+    def rearrange(self, tensor, pattern: str, strict: bool = False):
+        """Rearranges axes as in "B, C, H, W -> B, H*W, C", see rearrange.py.
+
+        Guards the tensor against the left side. Returns a view unless a
+        copy is needed, which raises ReshapeCopyError if `strict`.
+        """
+        return rearrange.rearrange(self, tensor, pattern, strict)
 
     def evaluate(self, template: str, **kwargs) -> List[Optional[int]]:
-        local_dims = copy(self.dims)
+        local_dims = dict(self.dims)
         local_dims.update(kwargs)
         return tools.evaluate(template, local_dims)
 
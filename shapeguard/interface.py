@@ -3,15 +3,56 @@ from __future__ import annotations
 import builtins
 import inspect
 import sys
+import threading
 from collections.abc import Sequence
 from contextlib import contextmanager
+from contextvars import ContextVar
 from types import FrameType
-from typing import Any, Dict, Generator, List, Optional, Set, Tuple, Union
-
-from lark import LarkError
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Set, Tuple, Union
 
+from . import batch, pool, stats, tools
+from .cache import LRUCache
+from .deferred import DeferredChecker, ErrorCallback
+from .dims import LayeredDims
 from .exception import ShapeGuardError
 from .guard import ShapeGuard
+from .parser import is_syntax_error, parse
+from .policy import Policy
+from .pool import BufferPool, PoolStats
+from .shape_spec import ShapeType
+from .stats import StatsReport
+
+
+class _Scope:
+    """One entry into a fork, private to the thread/task that entered it."""
+
+    __slots__ = ("guard", "fork", "parent")
+
+    def __init__(
+        self, guard: ShapeGuard, fork: Optional[ShapeGuard], parent: Optional[_Scope]
+    ):
+        # holds the dims while inside the fork, in a LayeredDims
+        self.guard = guard
+        # the registered fork, whose dims are saved on exit; None for throwaways
+        self.fork = fork
+        # the scope that was active when this one was entered
+        self.parent = parent
+
+
+# The active scope (None means the base) and noop state are
+# context-local, so threads and asyncio tasks each have their own fork
+# stack (linked through _Scope.parent). The base and registered forks
+# are shared: upper-case dims are written straight to the base, and
+# fork dims are saved under _lock.
+_scope: ContextVar[Optional[_Scope]] = ContextVar("shapeguard_scope", default=None)
+_noop: ContextVar[bool] = ContextVar("shapeguard_noop", default=False)
+_lock = threading.RLock()
+
+# Set by patch.patch_dynamo once torch._dynamo is imported, see
+# Interface.__new__ and ForkHandle.__enter__
+_compile_guard: Optional[Callable[[Any, Any], None]] = None
+_compile_fork: Any = None
+_is_compiling: Optional[Callable[[], bool]] = None
 
 
 class InterfaceMeta(type):
@@ -20,32 +61,233 @@ class InterfaceMeta(type):
     - We implement __call__ on this metaclass, so that `Interface()`
       is not a constructor but invokes this method instead.
 
-    - We also track the current ShapeGuard and forks as instance
+    - We also track the base ShapeGuard and forks as instance
       attributes ie. on the Instance class. -> mainly because
-      `__call__` needs to refer to `get()`
+      `__call__` needs to refer to `get()`. The active fork is
+      context-local, see `_scope`.
+
+    - Forks are kept in `forks`, an LRUCache keyed by the frozenset of
+      their params. Evicted forks lose their saved (lower-case) dims;
+      use `sg.forks.resize(n)` and `sg.forks.info()` to tune it.
     """
 
-    _current: Optional[ShapeGuard] = None
-    _all: Dict[Optional[HashableDict], ShapeGuard] = {}
-    _noop = False
+    _base: Optional[ShapeGuard] = None
+    forks: LRUCache[FrozenSet[Tuple[str, Any]], ShapeGuard] = LRUCache(maxsize=1024)
+    _fork_policies: Dict[FrozenSet[Tuple[str, Any]], Policy] = {}
+    _site_cache: Optional[_SiteCache] = None
+    _policy: Optional[Policy] = None
+    _template_policies: Dict[str, Policy] = {}
+    _sampling = False
+    _call_counts: Dict[Tuple[Any, ...], int] = {}
+    # (fork params or None for the base, dim) -> value, see shims.jax.mark_static
+    _static_dims: Dict[Tuple[Optional[FrozenSet[Tuple[str, Any]]], str], int] = {}
+    _deferred: Optional[DeferredChecker] = None
+    _pool: Optional[BufferPool] = None
 
     @contextmanager
     def noop(self):
-        self._noop = True
-        yield
-        self._noop = False
+        token = _noop.set(True)
+        try:
+            yield
+        finally:
+            _noop.reset(token)
+
+    def enable_site_cache(self, maxsize: int = 4096):
+        """Skips guards whose call site saw the same shape and dims last time.
+
+        For every (call site, template) we remember the last shape and
+        the values of the dims the template refers to. If neither
+        changed (in whichever fork is active), the guard would succeed
+        without inferring anything new, so we only compare tuples. The
+        cache is emptied once it holds `maxsize` entries.
+        """
+        self._site_cache = _SiteCache(maxsize)
+
+    def disable_site_cache(self):
+        self._site_cache = None
+
+    def set_policy(
+        self,
+        policy: Optional[Policy],
+        template: Optional[str] = None,
+        fork: Optional[Dict[str, Any]] = None,
+    ):
+        """Sets the policy that decides which sg() calls are checked.
+
+        Without `template` or `fork`, sets the global policy. Template
+        policies take precedence over fork policies, which take
+        precedence over the global one. Pass None to remove a policy.
+        Calls are counted per call site, separately for each template
+        or fork with a policy. Throwaway forks (`fork={}`) can't have a
+        policy.
+        """
+        if template is not None:
+            if policy is None:
+                self._template_policies.pop(template, None)
+            else:
+                self._template_policies[template] = policy
+        elif fork is not None:
+            if not fork:
+                raise ValueError(
+                    "Throwaway forks can't have a policy, pass the params of a fork"
+                )
+            # kept separately from the fork, so that it survives eviction
+            key = frozenset(fork.items())
+            if policy is None:
+                self._fork_policies.pop(key, None)
+            else:
+                self._fork_policies[key] = policy
+            self._get(fork).policy = policy
+        else:
+            self._policy = policy
+        self._sampling = (
+            self._policy is not None
+            or bool(self._template_policies)
+            or bool(self._fork_policies)
+        )
+
+    def enable_stats(self):
+        """Records call counts, latencies and failures of all guards."""
+        stats.enable()
+
+    def disable_stats(self):
+        stats.disable()
+
+    def stats(self) -> StatsReport:
+        if stats.recorder is None:
+            raise RuntimeError("Stats are not enabled, see sg.enable_stats()")
+        return stats.recorder.report()
+
+    def enable_deferred(
+        self,
+        maxsize: int = 1024,
+        block: bool = True,
+        on_error: Optional[ErrorCallback] = None,
+    ):
+        """Checks sg() guards on a background thread, see shapeguard.deferred.
+
+        Args:
+          maxsize: bound of the queue of pending guards
+          block: when the queue is full, block (True) or drop the guard
+          on_error: called with each violation (in the worker thread);
+            if None, violations are raised by `sg.flush()`
+        """
+        self.disable_deferred()
+        self._deferred = DeferredChecker(maxsize, block, on_error)
+
+    def disable_deferred(self):
+        """Checks pending guards, stops the worker and raises any violation."""
+        deferred = self._deferred
+        if deferred is not None:
+            self._deferred = None
+            try:
+                deferred.flush()
+            finally:
+                deferred.stop()
+
+    def flush(self):
+        """Waits for pending deferred guards and raises the first violation."""
+        if self._deferred is not None:
+            self._deferred.flush()
+
+    def enable_pool(self, max_bytes: int = 1 << 30, min_bytes: int = pool.MIN_BYTES):
+        """Reuses buffers of sg.empty() and sg.zeros() given back to sg.release().
+
+        Free buffers are kept per (shape, dtype, backend, device) and
+        evicted least recently used first once they hold more than
+        `max_bytes`. Buffers smaller than `min_bytes` are allocated
+        directly, since pooling them is slower, see pool.BufferPool.
+        """
+        self._pool = BufferPool(max_bytes, min_bytes)
+
+    def disable_pool(self):
+        self._pool = None
+
+    def pool_stats(self) -> PoolStats:
+        if self._pool is None:
+            raise RuntimeError("The buffer pool is not enabled, see sg.enable_pool()")
+        return self._pool.stats()
+
+    def empty(
+        self, template: str, dtype: Any = "float32", backend: str = "numpy", device=None
+    ):
+        """An uninitialized buffer of the template's shape, with the current dims."""
+        return self._allocate(template, dtype, backend, device, False)
+
+    def zeros(
+        self, template: str, dtype: Any = "float32", backend: str = "numpy", device=None
+    ):
+        return self._allocate(template, dtype, backend, device, True)
+
+    def release(self, buf) -> None:
+        """Returns a buffer of sg.empty()/sg.zeros() to the pool, if enabled.
+
+        The buffer must not be used afterwards.
+        """
+        if self._pool is not None:
+            self._pool.release(buf)
+
+    @contextmanager
+    def borrow(
+        self,
+        template: str,
+        dtype: Any = "float32",
+        backend: str = "numpy",
+        device=None,
+        zero: bool = False,
+    ):
+        """sg.empty() (or sg.zeros()) released at the end of the `with` block."""
+        buf = self._allocate(template, dtype, backend, device, zero)
+        try:
+            yield buf
+        finally:
+            self.release(buf)
+
+    def _allocate(self, template: str, dtype: Any, backend: str, device, zero: bool):
+        shape = pool.full_shape(tools.evaluate(template, self.get().dims), template)
+        if self._pool is None:
+            return pool.allocate(shape, dtype, backend, device, zero)
+        return self._pool.acquire(shape, dtype, backend, device, zero)
 
     def reset(self):
-        self._current = None
-        self._all = {}
+        if self._deferred is not None:
+            self._deferred.stop()
+            self._deferred = None
+        self._pool = None
+        _scope.set(None)
+        self._base = None
+        self.forks.clear()
+        self._fork_policies = {}
+        if self._site_cache is not None:
+            self._site_cache.clear()
+        self._policy = None
+        self._template_policies = {}
+        self._sampling = False
+        self._call_counts = {}
+        self._static_dims = {}
 
     def get(self) -> ShapeGuard:
-        if self._current is None:
-            self._current = self.get_base()
-        return self._current
+        scope = _scope.get()
+        if scope is None:
+            return self.get_base()
+        return scope.guard
+
+    def reshape(self, tensor, template: str, strict: bool = False):
+        """Reshapes to the template with the current dims, see tools.reshape."""
+        return self.get().reshape(tensor, template, strict)
+
+    def rearrange(self, tensor, pattern: str, strict: bool = False):
+        """Rearranges axes with the current dims, see ShapeGuard.rearrange."""
+        return self.get().rearrange(tensor, pattern, strict)
 
     def get_base(self) -> ShapeGuard:
-        return self._get(None)
+        base = self._base
+        if base is None:
+            with _lock:
+                if self._base is None:
+                    self._base = ShapeGuard()
+                base = self._base
+        return base
 
     def get_throwaway(self) -> ShapeGuard:
         return self._get({})
@@ -56,53 +298,243 @@ class InterfaceMeta(type):
             return ShapeGuard()
         elif params is None:
             # base
-            if None not in self._all:
-                self._all[None] = ShapeGuard()
-            return self._all[None]
+            return self.get_base()
         else:
             # fork
-            params = HashableDict(params)
-            if params not in self._all:
-                self._all[params] = ShapeGuard(params=params)
-            return self._all[params]
-
-    def __call__(self, arg, template: Union[str, List[str], Set[str], Tuple[str, ...]]):  # type: ignore[override]
-        if self._noop:
+            return self._get_fork(frozenset(params.items()))
+
+    def _get_fork(self, key: FrozenSet[Tuple[str, Any]]) -> ShapeGuard:
+        fork_sg = self.forks.get(key)
+        if fork_sg is None:
+            new_fork = ShapeGuard(params=dict(key), policy=self._fork_policies.get(key))
+            fork_sg = self.forks.setdefault(key, new_fork)
+        return fork_sg
+
+    def guard_fn(
+        self,
+        templates: Dict[str, str],
+        *,
+        returns: Optional[str] = None,
+        fork: Optional[Dict[str, Any]] = None,
+    ):
+        """Decorator that guards a function's arguments and return value.
+
+        `@sg.guard_fn({"x": "B,T,D", "mask": "B,T"}, returns="B,T,D")`
+        checks the arguments jointly and then runs the function inside a
+        throwaway fork, or in `sg.fork(**fork)` if given. Arguments that
+        are None or not passed are not checked.
+        """
+        from .decorator import guard_fn
+
+        return guard_fn(templates, returns=returns, fork=fork)
+
+    def fork_handle(self, **params) -> ForkHandle:
+        """Returns a reusable context manager for `sg.fork(**params)`.
+
+        The registry key is computed (and hashed) once, so entering the
+        handle costs a constant-time lookup.
+        """
+        return ForkHandle(params)
+
+    def __call__(self, arg, template: Union[str, List[str], Set[str], Tuple[str, ...]]):
+        if _noop.get():
             return arg
 
+        frame = sys._getframe(1)
         try:
-            if _is_listy(template):
-                assert _is_listy(
-                    arg
-                ), f"Found sequence template {template}, but non-sequence tensor {type(arg)}"
-
-                assert (
-                    len(arg) >= 1
-                ), f"Found sequence template {template}, but empty sequence tensor"
-
-                if len(template) == 1:
-                    template = list(template) * len(arg)
-
-                assert len(template) == len(
-                    arg
-                ), f"Found {len(template)} templates, but {len(arg)} args"
-
-                for t, m in zip(arg, template):
-                    sg(t, m)
+            cache = self._site_cache
+            if cache is not None and self._site_cache_hit(cache, arg, template, frame):
+                return arg
+            if stats.recorder is None:
+                self._call(arg, template, frame)
             else:
-                assert isinstance(template, str)
-                self.get().guard(arg, template)
-        except (ShapeGuardError, LarkError) as e:
-            _annotate_and_raise(e, inspect.currentframe())
+                self._call_recorded(arg, template, frame)
+        except Exception as e:
+            if isinstance(e, ShapeGuardError) or is_syntax_error(e):
+                _annotate_and_raise(e, frame)
+            raise
 
         return arg
 
+    def _call(self, arg, template, frame: FrameType) -> str:
+        if self._sampling and not self._should_check(template, frame):
+            return stats.SKIPPED
+        return self._guard(arg, template, frame)
+
+    def _guard(self, arg, template, frame: FrameType) -> str:
+        if isinstance(template, str):
+            graph_guard = tools.graph_guards.get(type(arg))
+            if graph_guard is not None:
+                # at trace time, and never deferred: assertions must be
+                # added to the graph
+                graph_guard(self.get(), arg, template)
+                return stats.CHECKED
+            if self._deferred is not None:
+                self._deferred.submit(self.get(), tools.get_shape(arg), template, frame)
+                return stats.DEFERRED
+            if self._site_cache is not None:
+                return self._guard_site_cached(arg, template, frame)
+            self.get().guard_shape(tools.get_shape(arg), template)
+        else:
+            assert _is_listy(template), f"Invalid template {template}"
+            assert _is_listy(
+                arg
+            ), f"Found sequence template {template}, but non-sequence tensor {type(arg)}"
+
+            assert (
+                len(arg) >= 1
+            ), f"Found sequence template {template}, but empty sequence tensor"
+
+            assert len(template) == 1 or len(template) == len(
+                arg
+            ), f"Found {len(template)} templates, but {len(arg)} args"
+
+            if (
+                self._deferred is None
+                and type(arg[0]) not in tools.graph_guards
+                and all([isinstance(t, str) for t in template])
+            ):
+                batch.guard_list(self.get(), arg, list(template))
+                return stats.CHECKED
+
+            if len(template) == 1:
+                template = list(template) * len(arg)
+
+            for t, m in zip(arg, template):
+                self._guard(t, m, frame)
+        return stats.CHECKED
+
+    def _call_recorded(self, arg, template, frame: FrameType) -> None:
+        recorder = stats.recorder
+        assert recorder is not None
+        status = None
+        start = stats.clock()
+        try:
+            status = self._call(arg, template, frame)
+        finally:
+            recorder.record(frame, template, stats.clock() - start, status)
+
+    def _should_check(self, template, frame: FrameType) -> bool:
+        # calls are counted per call site and per template or fork that
+        # the policy belongs to
+        key: Tuple[Any, ...] = (frame.f_code, frame.f_lasti)
+        policy = None
+        if isinstance(template, str):
+            policy = self._template_policies.get(template)
+            if policy is not None:
+                key += (template,)
+        if policy is None:
+            scope = _scope.get()
+            if scope is not None and scope.fork is not None:
+                policy = scope.fork.policy
+                if policy is not None:
+                    key += (frozenset(scope.fork.params.items()),)
+        if policy is None:
+            policy = self._policy
+        if policy is None:
+            return True
+        count = self._call_counts.get(key, 0)
+        self._call_counts[key] = count + 1
+        return policy.should_check(count)
+
+    def _site_cache_hit(
+        self, cache: _SiteCache, arg, template, frame: FrameType
+    ) -> bool:
+        """The hit path of the site cache, ahead of the policy and fork lookups.
+
+        Only taken without stats, policies, deferred guarding and graph
+        guards, which all need to see every call; `_guard_site_cached`
+        handles the rest.
+        """
+        if (
+            stats.recorder is not None
+            or self._sampling
+            or self._deferred is not None
+            or type(template) is not str
+            or type(arg) in tools.graph_guards
+        ):
+            return False
+        entry = cache.get((frame.f_code, frame.f_lasti, template))
+        if entry is None:
+            return False
+        scope = _scope.get()
+        guard = self._base if scope is None else scope.guard
+        if guard is None or not _entry_matches(entry, arg, guard.dims):
+            return False
+        cache.hits += 1
+        return True
+
+    def _guard_site_cached(self, arg, template: str, frame: FrameType) -> str:
+        cache = self._site_cache
+        assert cache is not None
+        key = (frame.f_code, frame.f_lasti, template)
+        guard = self.get()
+        dims = guard.dims
+        entry = cache.get(key)
+        if entry is not None and _entry_matches(entry, arg, dims):
+            cache.hits += 1
+            return stats.CACHE_HIT
+
+        cache.misses += 1
+        cls = type(arg)
+        read_shapes = tools.shapes_reader(cls)
+        raw_shape = read_shapes((arg,))[0]
+        guard.guard_shape(raw_shape, template)
+        names = [n for n in parse(template).names if not n.startswith("_")]
+        if len(cache) >= cache.maxsize:
+            cache.clear()
+        cache[key] = (
+            cls,
+            read_shapes,
+            raw_shape,
+            tuple([(n, dims.get(n)) for n in names]),
+        )
+        return stats.CHECKED
+
+
+def _entry_matches(entry: _SiteEntry, arg, dims) -> bool:
+    """Whether arg has the cached shape and the dims haven't changed since."""
+    cls, read_shapes, raw_shape, known = entry
+    if type(arg) is not cls or read_shapes((arg,))[0] != raw_shape:
+        return False
+    for name, value in known:
+        if dims.get(name) != value:
+            return False
+    return True
+
+
+# (tensor type, its shim's shapes reader, shape as read, (name, dim value) pairs)
+_SiteEntry = Tuple[
+    type,
+    Callable[[Sequence], Sequence[ShapeType]],
+    ShapeType,
+    Tuple[Tuple[str, Optional[int]], ...],
+]
+
+
+class _SiteCache(Dict[Tuple[Any, int, str], _SiteEntry]):
+    """(code, instruction, template) -> _SiteEntry"""
+
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
 
 def _is_listy(a) -> bool:
     return isinstance(a, Sequence) and not isinstance(a, (str, bytes, bytearray))
 
 
 class Interface(metaclass=InterfaceMeta):
+    def __new__(cls, arg, template: Union[str, List[str], Set[str], Tuple[str, ...]]):
+        # Only reached while dynamo traces sg(): it calls __new__ and
+        # __init__ itself instead of InterfaceMeta.__call__. Returning
+        # arg (not an Interface) skips __init__.
+        if not _noop.get() and _compile_guard is not None:
+            _compile_guard(arg, template)
+        return arg
+
     def __init__(self, arg, template: Union[str, List[str], Set[str], Tuple[str, ...]]):
         # This only exists to persuade mypy that Interface() has this
         # type -- since its implementation is actually in
@@ -110,32 +542,17 @@ class Interface(metaclass=InterfaceMeta):
         assert False, "Should not be called"
 
     @classmethod
-    @contextmanager
-    def fork(cls, **kwargs) -> Generator[ShapeGuard, None, None]:
-        prev = cls._current
-        fork_sg = cls._get(params=kwargs)
-        cls._switch_fork(fork_sg)
-        yield fork_sg
-        cls._switch_fork(prev)
-
-    @classmethod
-    def _switch_fork(cls, nxt: Optional[ShapeGuard]):
-        if cls._current:
-            cls._checkin_fork(cls._current)
-        if nxt:
-            cls._checkout_fork(nxt)
-        cls._current = nxt
-
-    @classmethod
-    def _checkout_fork(cls, fork_sg: ShapeGuard) -> None:
-        if fork_sg is not cls.get_base():
-            fork_sg.dims.update(cls.get_base().dims)
-
-    @classmethod
-    def _checkin_fork(cls, fork_sg: ShapeGuard):
-        if fork_sg is not cls.get_base():
-            transferred_dims = {k: v for k, v in fork_sg.dims.items() if k[0].isupper()}
-            cls.get_base().dims.update(transferred_dims)
+    def fork(cls, **kwargs) -> ForkHandle:
+        """Enters a fork of the dims, see README.
+
+        Every entry gets its own scope in the current thread/task,
+        layered over the base dims and the dims saved for this fork (see
+        LayeredDims), so entering and leaving don't copy any dims.
+        Upper-case dims are written straight to the base; lower-case
+        dims are saved for the fork on exit. Concurrent entries of the
+        same fork therefore don't see each other's lower-case dims.
+        """
+        return ForkHandle(kwargs)
 
     @classmethod
     def install(cls, sg="sg"):
@@ -146,22 +563,71 @@ class Interface(metaclass=InterfaceMeta):
         delattr(builtins, sg)
 
 
-# https://stackoverflow.com/a/16162138/14044156
-class HashableDict(dict):
-    def __hash__(self):
-        return hash((frozenset(self), frozenset(self.values())))
+class ForkHandle:
+    """Context manager that enters a fork, see `sg.fork_handle`.
+
+    Handles can be entered repeatedly, nested and from several
+    threads/tasks at once.
+    """
+
+    __slots__ = ("params", "_key")
+
+    def __init__(self, params: Dict[str, Any]):
+        self.params = params
+        self._key = frozenset(params.items()) if params else None
+        # frozensets cache their hash
+        hash(self._key)
+
+    def __enter__(self) -> Optional[ShapeGuard]:
+        if _is_compiling is not None and _is_compiling():
+            # traced by dynamo: the scope is entered at trace time
+            _compile_fork.enter_fork(self.params)
+            return None
+        scope = self.new_scope(_scope.get())
+        _scope.set(scope)
+        return scope.guard
+
+    def __exit__(self, *exc_info) -> None:
+        if _is_compiling is not None and _is_compiling():
+            _compile_fork.exit_fork()
+            return
+        scope = _scope.get()
+        assert scope is not None, "Fork exited without being entered"
+        _scope.set(scope.parent)
+        leave_scope(scope)
+
+    def new_scope(self, parent: Optional[_Scope]) -> _Scope:
+        fork_sg = None if self._key is None else Interface._get_fork(self._key)
+        dims = LayeredDims(
+            Interface.get_base().dims, None if fork_sg is None else fork_sg.dims
+        )
+        return _Scope(ShapeGuard(params=self.params, dims=dims), fork_sg, parent)
+
+
+def leave_scope(scope: _Scope) -> None:
+    """Saves the lower-case dims of a registered fork."""
+    dims = scope.guard.dims
+    assert isinstance(dims, LayeredDims)
+    if scope.fork is not None:
+        deferred = Interface._deferred
+        if deferred is None:
+            _save(dims)
+        else:
+            # the worker may still infer dims in this scope
+            deferred.call_soon(lambda: _save(dims))
+
+
+def _save(dims: LayeredDims) -> None:
+    if dims.local:
+        with _lock:
+            dims.save()
 
 
-def _annotate_and_raise(
-    e: Union[ShapeGuardError, LarkError], current_frame: Optional[FrameType]
-):
+def _annotate_and_raise(e: Exception, offending_frame: FrameType):
     """Adds information about the template to the exception"""
-    assert current_frame is not None
-    offending_frame = current_frame.f_back
-    if offending_frame is None or offending_frame.f_code is current_frame.f_code:
-        # if we didn't find a frame (weird!) or for a recursive
-        # call (list templates), we simply pass it up for the
-        # "terminal" sg() call to handle
+    if offending_frame.f_globals.get("__name__") == __name__:
+        # for a recursive call (list templates), we simply pass it up
+        # for the "terminal" sg() call to handle
         raise
     else:
         code_context = inspect.getframeinfo(offending_frame).code_context
@@ -11,35 +11,164 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Defines the transformation from a shape template parse tree to ShapeSpec."""
+"""Parses shape templates into ShapeSpecs.
 
+This is a hand-written tokenizer and recursive descent parser for the
+grammar in `shape_spec.lark`. Lark is only imported when a template
+fails to parse, to produce its error messages.
+"""
 
-from pathlib import Path
-from typing import Callable
+import re
+import sys
+from typing import List, Tuple
 
-import lark
+from shapeguard import dim_specs, exception, shape_spec
 
-from shapeguard import dim_specs, shape_spec
+from .cache import LRUCache
 
-GRAMMAR_FILE = Path(__file__).parent / "shape_spec.lark"
+_NUMBER = r"(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?"
+_CNAME = r"[A-Za-z_][A-Za-z0-9_]*"
+_TOKEN_RE = re.compile(
+    r"[ \t\f\r\n]*(?:({})|({})|(\.\.\.|[,=?*/+\-()]))".format(_NUMBER, _CNAME)
+)
+_WS_RE = re.compile(r"[ \t\f\r\n]*\Z")
 
+NUMBER = "NUMBER"
+CNAME = "CNAME"
+Token = Tuple[str, str]
 
-class TreeToSpec(lark.Transformer):
-    start = shape_spec.ShapeSpec
-    wildcard = dim_specs.Wildcard.make
-    ellipsis = dim_specs.EllipsisDim.make
-    dynamic = dim_specs.Dynamic.make
-    name = dim_specs.NamedDim.make
-    assign = dim_specs.AssignDim.make
-    dynamic_name = dim_specs.DynamicNamedDim.make
-    number = dim_specs.Number.make
-    add = dim_specs.AddDims.make
-    sub = dim_specs.SubDims.make
-    mul = dim_specs.MulDims.make
-    div = dim_specs.DivDims.make
+_BINARY_OPS = {
+    "+": dim_specs.AddDims,
+    "-": dim_specs.SubDims,
+    "*": dim_specs.MulDims,
+    "/": dim_specs.DivDims,
+}
 
 
-parser = lark.Lark(
-    grammar=GRAMMAR_FILE.read_text(), transformer=TreeToSpec(), parser="lalr"
-)
-parse: Callable[[str], shape_spec.ShapeSpec] = parser.parse  # type: ignore
+class _SyntaxError(Exception):
+    """Raised by the fast parser, which then defers to lark."""
+
+
+def tokenize(template: str) -> List[Token]:
+    tokens: List[Token] = []
+    pos = 0
+    match = _TOKEN_RE.match
+    while True:
+        m = match(template, pos)
+        if m is None:
+            if _WS_RE.match(template, pos) is None:
+                raise _SyntaxError(pos)
+            return tokens
+        number, name, op = m.groups()
+        if number is not None:
+            tokens.append((NUMBER, number))
+        elif name is not None:
+            tokens.append((CNAME, name))
+        else:
+            tokens.append((op, op))
+        pos = m.end()
+
+
+class _Parser:
+    def __init__(self, template: str):
+        self.tokens = tokenize(template)
+        self.tokens.append(("", ""))  # end marker
+        self.pos = 0
+
+    def peek(self, offset: int = 0) -> str:
+        return self.tokens[min(self.pos + offset, len(self.tokens) - 1)][0]
+
+    def next(self) -> Token:
+        token = self.tokens[self.pos]
+        if not token[0]:
+            raise _SyntaxError(self.pos)
+        self.pos += 1
+        return token
+
+    def expect(self, kind: str) -> Token:
+        token = self.next()
+        if token[0] != kind:
+            raise _SyntaxError(self.pos)
+        return token
+
+    def parse(self) -> shape_spec.ShapeSpec:
+        entries = [self.dim()]
+        while self.peek() == ",":
+            self.next()
+            entries.append(self.dim())
+        if self.peek():
+            raise _SyntaxError(self.pos)
+        return shape_spec.ShapeSpec(entries)
+
+    def dim(self) -> dim_specs.DimSpec:
+        kind = self.peek()
+        if kind == "*":
+            self.next()
+            return dim_specs.Wildcard()
+        elif kind == "...":
+            self.next()
+            return dim_specs.ellipsis_dim
+        elif kind == "?":
+            self.next()
+            return dim_specs.Dynamic()
+        elif kind == CNAME and self.peek(1) == "=":
+            name = self.next()[1]
+            self.next()
+            return dim_specs.AssignDim(name, self.sum())
+        elif kind == CNAME and self.peek(1) == "?":
+            name = self.next()[1]
+            self.next()
+            return dim_specs.DynamicNamedDim(name)
+        return self.sum()
+
+    def sum(self) -> dim_specs.DimSpec:
+        left = self.product()
+        while self.peek() in ("+", "-"):
+            op = _BINARY_OPS[self.next()[0]]
+            left = op(left, self.product())
+        return left
+
+    def product(self) -> dim_specs.DimSpec:
+        left = self.concrete()
+        while self.peek() in ("*", "/"):
+            op = _BINARY_OPS[self.next()[0]]
+            left = op(left, self.concrete())
+        return left
+
+    def concrete(self) -> dim_specs.DimSpec:
+        kind, value = self.next()
+        if kind == NUMBER:
+            return dim_specs.Number(float(value))
+        elif kind == CNAME:
+            return dim_specs.NamedDim(value)
+        elif kind == "(":
+            inner = self.sum()
+            self.expect(")")
+            return inner
+        raise _SyntaxError(self.pos)
+
+
+def parse_uncached(template: str) -> shape_spec.ShapeSpec:
+    try:
+        return _Parser(template).parse()
+    except (_SyntaxError, exception.ShapeError):
+        from . import lark_parser
+
+        # raises lark's (more informative) errors for invalid templates,
+        # in the same order as before
+        return lark_parser.parse(template)
+
+
+def is_syntax_error(e: BaseException) -> bool:
+    """Whether e is a lark error about an invalid template."""
+    lark = sys.modules.get("lark")
+    return lark is not None and isinstance(e, lark.LarkError)
+
+
+# Parsed ShapeSpecs are immutable, so they can be shared between all
+# callers that use the same template string.
+spec_cache: LRUCache[str, shape_spec.ShapeSpec] = LRUCache(maxsize=1024)
+
+
+def parse(template: str) -> shape_spec.ShapeSpec:
+    return spec_cache.get_or_create(template, parse_uncached)
@@ -1,9 +1,95 @@
+import importlib.abc
+import importlib.util
+import sys
+from types import ModuleType
+from typing import Callable
+
+from . import interface, tools
 from .interface import sg
 
-try:
-    import torch
 
+def patch_torch(torch: ModuleType) -> None:
     # But this will give type errors since Tensor doesn't have an `sg`
     torch.Tensor.sg = sg
-except ImportError:
-    pass
+
+
+def patch_dynamo(_dynamo: ModuleType) -> None:
+    # torch.compile imports dynamo lazily, and so do we: the import is
+    # slow, and can't be traced
+    from . import dynamo
+
+    interface._compile_guard = dynamo.guard
+    interface._compile_fork = dynamo
+    interface._is_compiling = dynamo.is_compiling
+
+
+class _PatchingLoader(importlib.abc.Loader):
+    def __init__(self, loader, callback: Callable[[ModuleType], None]):
+        self.loader = loader
+        self.callback = callback
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module: ModuleType) -> None:
+        self.loader.exec_module(module)
+        self.callback(module)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+class _PostImportFinder(importlib.abc.MetaPathFinder):
+    """Runs a callback once a module has been imported, without importing it."""
+
+    def __init__(self, name: str, callback: Callable[[ModuleType], None]):
+        self.name = name
+        self.callback = callback
+        self._finding = False
+
+    def find_spec(self, fullname, path, target=None):
+        # find_spec() may only be probing for the module (without
+        # importing it), so we stay installed until it is executed
+        if fullname != self.name or self._finding:
+            return None
+        self._finding = True
+        try:
+            spec = importlib.util.find_spec(fullname)
+        finally:
+            self._finding = False
+        if spec is not None and spec.loader is not None:
+            spec.loader = _PatchingLoader(spec.loader, self._patch)
+        return spec
+
+    def _patch(self, module: ModuleType) -> None:
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+            self.callback(module)
+
+
+def when_imported(name: str, callback: Callable[[ModuleType], None]) -> None:
+    if name in sys.modules:
+        callback(sys.modules[name])
+    else:
+        sys.meta_path.insert(0, _PostImportFinder(name, callback))
+
+
+def patch_tf(_tf: ModuleType) -> None:
+    from .shims import tf
+
+    tools.graph_guards[tf.GraphTensor] = tf.guard_graph_tensor
+
+    try:
+        from tensorflow.python.autograph.core import config
+    except ImportError:  # pragma: no cover
+        return
+    # guards only run at trace time, so autograph needn't convert them
+    # (and can't convert the compiled ones, which have no source)
+    config.CONVERSION_RULES = (config.DoNotConvert("shapeguard"),) + tuple(
+        config.CONVERSION_RULES
+    )
+
+
+when_imported("torch", patch_torch)
+when_imported("tensorflow", patch_tf)
+when_imported("torch._dynamo", patch_dynamo)
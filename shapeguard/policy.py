@@ -0,0 +1,77 @@
+"""Policies that decide which calls to sg() are actually checked.
+
+Policies see how many times the call site has been reached before
+(`count`, starting at 0) and return whether this call should be
+checked. They can be set globally, per fork and per template with
+`sg.set_policy`.
+"""
+
+from __future__ import annotations
+
+import random
+from typing import Optional
+
+import attr
+
+from .exception import ShapeGuardError
+
+
+class Policy:
+    def should_check(self, count: int) -> bool:
+        raise NotImplementedError
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class Always(Policy):
+    """Checks every call."""
+
+    def should_check(self, count: int) -> bool:
+        return True
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class FirstN(Policy):
+    """Checks only the first n calls per call site (warm-up)."""
+
+    n: int
+
+    def __attrs_post_init__(self):
+        _check_positive(self)
+
+    def should_check(self, count: int) -> bool:
+        return count < self.n
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class EveryNth(Policy):
+    """Checks the first and then every n-th call per call site."""
+
+    n: int
+
+    def __attrs_post_init__(self):
+        _check_positive(self)
+
+    def should_check(self, count: int) -> bool:
+        return count % self.n == 0
+
+
+@attr.s(auto_attribs=True)
+class Probability(Policy):
+    """Checks each call with probability p."""
+
+    p: float
+    seed: Optional[int] = None
+    _rng: random.Random = attr.ib(init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        if not 0 <= self.p <= 1:
+            raise ShapeGuardError(f"Probability p must be in [0, 1], got {self.p}")
+        self._rng = random.Random(self.seed)
+
+    def should_check(self, count: int) -> bool:
+        return self._rng.random() < self.p
+
+
+def _check_positive(policy) -> None:
+    if policy.n < 1:
+        raise ShapeGuardError(f"{type(policy).__name__} needs n >= 1, got {policy.n}")
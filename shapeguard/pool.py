@@ -0,0 +1,261 @@
+"""Allocation of numpy and torch buffers from shape templates, and a pool to reuse them.
+
+`sg.empty()` and `sg.zeros()` evaluate a template against the current
+dims. With `sg.enable_pool()`, buffers returned with `sg.release()` (or
+by leaving `sg.borrow()`) are kept in a BufferPool, keyed by (shape,
+dtype, backend, device), and handed out again by the next allocation
+with the same key. Free buffers are evicted least recently used first
+when they exceed `max_bytes`.
+
+Pooling only pays off for large buffers: smaller ones are served from
+the allocator's own free lists about as fast as from the pool (glibc
+keeps up to 32 MiB in its heap, torch's CUDA allocator caches all
+sizes). Above that, fresh buffers come from the OS and every first
+write to a page faults: on Linux, allocating and filling 64 MiB took
+~13 ms (numpy) and ~29 ms (torch, CPU) fresh against ~10 ms and ~4 ms
+pooled (the *_64mib_fill benchmarks). So buffers below `min_bytes`
+(32 MiB by default) bypass the pool.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import attr
+
+from .cache import LRUCache
+from .exception import ShapeGuardError, UnderspecifiedShapeError
+
+NUMPY = "numpy"
+TORCH = "torch"
+
+# buffers smaller than this are allocated directly, see the module docstring
+MIN_BYTES = 32 << 20
+
+# (shape, dtype, backend, device), with the dtype and device as
+# numpy/torch objects
+_Key = Tuple[Tuple[int, ...], Any, str, Any]
+
+# (shape, dtype, backend, device) as passed to acquire() -> _Key
+key_cache: LRUCache[Tuple[Tuple[int, ...], Any, str, Any], _Key] = LRUCache(
+    maxsize=1024
+)
+
+
+@attr.s(auto_attribs=True)
+class PoolStats:
+    hits: int = 0
+    misses: int = 0
+    releases: int = 0
+    evictions: int = 0
+    # allocations below min_bytes, which bypass the pool
+    unpooled: int = 0
+    # bytes held by free buffers
+    free_bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = attr.asdict(self)
+        d.update(hit_rate=self.hit_rate)
+        return d
+
+
+class BufferPool:
+    """Free buffers per key, evicted LRU once they hold more than max_bytes.
+
+    Only buffers allocated by the pool are accepted back; a released
+    buffer must not be used any more, since the next `acquire()` of the
+    same key may hand it out again. Buffers smaller than min_bytes are
+    allocated directly, and releasing them does nothing.
+    """
+
+    def __init__(self, max_bytes: int = 1 << 30, min_bytes: int = MIN_BYTES):
+        self.max_bytes = max_bytes
+        self.min_bytes = min_bytes
+        self._free: OrderedDict[_Key, List[Any]] = OrderedDict()
+        # id -> buffer, for the buffers handed out and not yet released
+        self._outstanding: weakref.WeakValueDictionary[int, Any] = (
+            weakref.WeakValueDictionary()
+        )
+        self._lock = threading.Lock()
+        self._stats = PoolStats()
+
+    def acquire(
+        self,
+        shape: Sequence[int],
+        dtype: Any = "float32",
+        backend: str = NUMPY,
+        device: Any = None,
+        zero: bool = False,
+    ):
+        key = key_cache.get_or_create((tuple(shape), dtype, backend, device), _make_key)
+        if math.prod(key[0]) * key[1].itemsize < self.min_bytes:
+            with self._lock:
+                self._stats.unpooled += 1
+            return allocate(shape, dtype, backend, device, zero)
+        with self._lock:
+            free = self._free.get(key)
+            buf = free.pop() if free else None
+            if buf is not None:
+                self._stats.hits += 1
+                self._stats.free_bytes -= _nbytes(buf, backend)
+                if not free:
+                    del self._free[key]
+            else:
+                self._stats.misses += 1
+
+        if buf is None:
+            buf = allocate(shape, dtype, backend, device, zero)
+        elif zero:
+            _zero(buf, backend)
+        with self._lock:
+            self._outstanding[id(buf)] = buf
+        return buf
+
+    def release(self, buf) -> None:
+        backend = _backend(buf)
+        nbytes = _nbytes(buf, backend)
+        if nbytes < self.min_bytes:
+            # never pooled
+            return
+        with self._lock:
+            if self._outstanding.get(id(buf)) is not buf:
+                raise ShapeGuardError(
+                    "Can't release a buffer that wasn't acquired from the pool"
+                )
+            del self._outstanding[id(buf)]
+            self._stats.releases += 1
+            if nbytes > self.max_bytes:
+                self._stats.evictions += 1
+                return
+
+            key = _buffer_key(buf, backend)
+            self._free.setdefault(key, []).append(buf)
+            self._free.move_to_end(key)
+            self._stats.free_bytes += nbytes
+            self._evict(self.max_bytes)
+
+    def stats(self) -> PoolStats:
+        with self._lock:
+            return attr.evolve(self._stats)
+
+    def clear(self) -> None:
+        """Drops all free buffers; outstanding ones may still be released."""
+        with self._lock:
+            self._free.clear()
+            self._stats.free_bytes = 0
+
+    def _evict(self, max_bytes: int) -> None:
+        while self._stats.free_bytes > max_bytes:
+            key, free = next(iter(self._free.items()))
+            # the oldest buffer of the least recently used key
+            buf = free.pop(0)
+            if not free:
+                del self._free[key]
+            self._stats.free_bytes -= _nbytes(buf, key[2])
+            self._stats.evictions += 1
+
+
+def full_shape(shape: List[Optional[int]], template: str) -> Tuple[int, ...]:
+    """Checks that an evaluated template has no unknown or wildcard dims."""
+    sizes = []
+    for size in shape:
+        if size is None or size < 0:
+            raise UnderspecifiedShapeError(
+                f"Can't allocate template {template}: evaluates to {shape}"
+            )
+        sizes.append(size)
+    return tuple(sizes)
+
+
+def allocate(
+    shape: Sequence[int],
+    dtype: Any = "float32",
+    backend: str = NUMPY,
+    device: Any = None,
+    zero: bool = False,
+):
+    if backend == NUMPY:
+        import numpy as np
+
+        if device is not None:
+            raise ShapeGuardError(f"numpy buffers have no device, got {device}")
+        return (np.zeros if zero else np.empty)(tuple(shape), dtype=dtype)
+    if backend == TORCH:
+        import torch
+
+        alloc = torch.zeros if zero else torch.empty
+        return alloc(tuple(shape), dtype=_torch_dtype(dtype), device=device)
+    raise ShapeGuardError(
+        f'Unknown backend "{backend}", expected "{NUMPY}" or "{TORCH}"'
+    )
+
+
+def _make_key(args: Tuple[Tuple[int, ...], Any, str, Any]) -> _Key:
+    # normalized, so that keys compare equal to those of the buffers
+    shape, dtype, backend, device = args
+    if backend == NUMPY:
+        import numpy as np
+
+        return (shape, np.dtype(dtype), backend, None)
+    if backend == TORCH:
+        import torch
+
+        device = torch.device("cpu" if device is None else device)
+        if device.type == "cuda" and device.index is None:
+            device = torch.device("cuda", torch.cuda.current_device())
+        return (shape, _torch_dtype(dtype), backend, device)
+    raise ShapeGuardError(
+        f'Unknown backend "{backend}", expected "{NUMPY}" or "{TORCH}"'
+    )
+
+
+def _buffer_key(buf, backend: str) -> _Key:
+    if backend == TORCH:
+        return (tuple(buf.shape), buf.dtype, TORCH, buf.device)
+    return (buf.shape, buf.dtype, NUMPY, None)
+
+
+def _backend(buf) -> str:
+    return TORCH if type(buf).__module__.startswith(TORCH) else NUMPY
+
+
+def _torch_dtype(dtype: Any):
+    """The torch dtype for a torch dtype, its name or a numpy dtype."""
+    import torch
+
+    if isinstance(dtype, torch.dtype):
+        return dtype
+    name = dtype
+    if not isinstance(dtype, str):
+        import numpy as np
+
+        try:
+            name = np.dtype(dtype).name
+        except TypeError:
+            name = None
+    torch_dtype = getattr(torch, name, None) if name else None
+    if not isinstance(torch_dtype, torch.dtype):
+        raise ShapeGuardError(f"No torch dtype for {dtype!r}")
+    return torch_dtype
+
+
+def _nbytes(buf, backend: str) -> int:
+    if backend == TORCH:
+        return int(buf.element_size() * buf.nelement())
+    return int(buf.nbytes)
+
+
+def _zero(buf, backend: str) -> None:
+    if backend == TORCH:
+        buf.zero_()
+    else:
+        buf.fill(0)
@@ -0,0 +1,184 @@
+"""einops-style rearrangement with shape templates: "B, C, H, W -> B, H*W, C".
+
+Both sides are templates. Products split (on the left) or merge (on
+the right) axes, 1 removes or adds an axis, and an ellipsis stands for
+the same axes on both sides. A pattern is compiled once per input rank
+into a Plan of at most three steps:
+
+1. a reshape that splits the input into one axis per name (a view),
+2. a permutation into the order of the names on the right (a view),
+3. a reshape that merges them into the output axes, which copies only
+   if the permuted strides require it (see tools.reshape_to).
+
+Steps that would do nothing are left out of the plan.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
+
+import attr
+
+from . import dim_specs, exception, tools
+from .cache import LRUCache
+from .parser import parse
+from .shape_spec import ShapeSpec
+from .shims import get_shim_factory
+
+if TYPE_CHECKING:
+    from .guard import ShapeGuard
+
+# a name, or the position of an axis matched by the ellipsis
+_Label = Union[str, Tuple[str, int]]
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class Plan:
+    # the left side, used to guard the input
+    template: str
+    spec: ShapeSpec
+    # for each elementary axis, the input axis it is (int), or the name
+    # of its size in the dims if it is split from an input axis
+    sources: Tuple[Union[int, str], ...]
+    # whether step 1 is needed
+    split: bool
+    # step 2, None for the identity
+    permutation: Optional[Tuple[int, ...]]
+    # for each output axis, the elementary axes (after permuting) that
+    # are merged into it; () for a new axis. None if step 3 isn't needed
+    groups: Optional[Tuple[Tuple[int, ...], ...]]
+
+
+# (pattern, input rank) -> Plan
+plan_cache: LRUCache[Tuple[str, int], Plan] = LRUCache(maxsize=256)
+
+
+def rearrange(guard: ShapeGuard, tensor, pattern: str, strict: bool = False):
+    """See ShapeGuard.rearrange."""
+    shim_factory = get_shim_factory(type(tensor))
+    shape = shim_factory(tensor).get_shape()
+    plan = plan_cache.get_or_create((pattern, len(shape)), _compile_key)
+    inferred = plan.spec.compiled(shape, guard.dims)
+    if inferred is None:
+        # raises with the usual message
+        guard.guard_shape(shape, plan.template)
+    elif inferred:
+        guard.dims.update(inferred)
+
+    sizes: List[int] = []
+    for source in plan.sources:
+        if isinstance(source, int):
+            size = shape[source]
+            if size is None:
+                raise exception.UnderspecifiedShapeError(
+                    f"Dimension {source} of the tensor is unknown in {pattern}"
+                )
+            sizes.append(size)
+        elif source in guard.dims:
+            sizes.append(guard.dims[source])
+        else:
+            raise exception.UnderspecifiedShapeError(
+                'Unknown dimension "{}" in {}\nKnown dimensions: {}'.format(
+                    source, pattern, dict(guard.dims)
+                )
+            )
+
+    # numpy and torch keep the type of the tensor in every step
+    if plan.split:
+        tensor = tools.reshape_to(tensor, sizes, strict, pattern, shim_factory(tensor))
+    if plan.permutation is not None:
+        tensor = shim_factory(tensor).permute(plan.permutation)
+        sizes = [sizes[i] for i in plan.permutation]
+    if plan.groups is not None:
+        new_shape = []
+        for group in plan.groups:
+            size = 1
+            for i in group:
+                size *= sizes[i]
+            new_shape.append(size)
+        tensor = tools.reshape_to(
+            tensor, new_shape, strict, pattern, shim_factory(tensor)
+        )
+    return tensor
+
+
+def _compile_key(key: Tuple[str, int]) -> Plan:
+    return compile_pattern(*key)
+
+
+def compile_pattern(pattern: str, rank: int) -> Plan:
+    left, arrow, right = pattern.partition("->")
+    if not arrow:
+        raise exception.ShapeGuardError(f'Expected "->" in rearrange pattern {pattern}')
+    left_spec = parse(left.strip())
+    if not left_spec.rank_matches([None] * rank):
+        raise exception.ShapeError(
+            f"Rank {rank} doesn't match the left side of rearrange pattern {pattern}"
+        )
+
+    right_spec = parse(right.strip())
+    if right_spec.has_ellipsis and not left_spec.has_ellipsis:
+        raise exception.ShapeGuardError(
+            f"Ellipsis on only the right side of rearrange pattern {pattern}"
+        )
+    # the ellipsis stands for the same axes on both sides
+    n_ellipsis = rank - len(left_spec.left_entries) - len(left_spec.right_entries)
+
+    labels: List[_Label] = []
+    sources: List[Union[int, str]] = []
+    split = False
+    for axis, group in enumerate(_groups(left_spec, n_ellipsis, pattern)):
+        if len(group) != 1:
+            split = True
+        for label in group:
+            labels.append(label)
+            sources.append(axis if len(group) == 1 else label)  # type: ignore[arg-type]
+
+    right_groups = _groups(right_spec, n_ellipsis, pattern)
+    order = [label for group in right_groups for label in group]
+    if sorted(map(str, order)) != sorted(map(str, labels)) or len(set(order)) != len(
+        order
+    ):
+        raise exception.ShapeGuardError(
+            f"The sides of rearrange pattern {pattern} must have the same names"
+        )
+
+    permutation = tuple(labels.index(label) for label in order)
+    groups: List[Tuple[int, ...]] = []
+    position = 0
+    for group in right_groups:
+        groups.append(tuple(range(position, position + len(group))))
+        position += len(group)
+    return Plan(
+        template=left.strip(),
+        spec=left_spec,
+        sources=tuple(sources),
+        split=split,
+        permutation=None if permutation == tuple(range(len(labels))) else permutation,
+        groups=None if all(len(g) == 1 for g in groups) else tuple(groups),
+    )
+
+
+def _groups(spec: ShapeSpec, n_ellipsis: int, pattern: str) -> List[List[_Label]]:
+    """The labels of the factors of each axis; 1s are left out."""
+    entries: List[Optional[dim_specs.DimSpec]] = list(spec.left_entries)
+    if spec.has_ellipsis:
+        entries += [None] * n_ellipsis + list(spec.right_entries)
+
+    groups: List[List[_Label]] = []
+    for i, entry in enumerate(entries):
+        if entry is None:
+            groups.append([("...", i - len(spec.left_entries))])
+            continue
+        group: List[_Label] = []
+        for factor in entry.flat_iter():
+            if isinstance(factor, dim_specs.Number) and factor.value == 1:
+                continue
+            if type(factor) not in (dim_specs.NamedDim, dim_specs.DynamicNamedDim):
+                raise exception.ShapeGuardError(
+                    f"Can't rearrange {factor!r} in {pattern}: "
+                    "only names, products of names and 1 are allowed"
+                )
+            group.append(factor.name)
+        groups.append(group)
+    return groups
@@ -14,20 +14,29 @@
 
 """Defines the ShapeSpec object which represents a parsed shape template."""
 
-from typing import Dict, List, Optional, Tuple, Union
-
-import lark
+from typing import Collection, Dict, List, Mapping, Optional, Sequence, Tuple, Union
 
 from . import dim_specs, exception
+from .compiler import CompiledSpec
+from .solver import SolveOrder, solve
 
-EntriesType = List[Union[lark.Token, dim_specs.DimSpec]]
-ShapeType = Union[Tuple[int], List[int]]
+EntriesType = Sequence[dim_specs.DimSpec]
+# None for dims that are only known at runtime (tf graphs, jax shape
+# polymorphism)
+ShapeType = Sequence[Optional[int]]
 
 
 class ShapeSpec:
+    """A parsed shape template.
+
+    ShapeSpecs (and the DimSpecs they contain) are shared between all
+    users of a template via the parser cache, so they must not be
+    modified after construction.
+    """
+
     def __init__(self, entries: EntriesType):
         super().__init__()
-        self.entries = [x for x in entries if not isinstance(x, lark.Token)]
+        self.entries = tuple(x for x in entries if isinstance(x, dim_specs.DimSpec))
         if dim_specs.ellipsis_dim in self.entries:
             idx = self.entries.index(dim_specs.ellipsis_dim)
             self.left_entries = self.entries[:idx]
@@ -35,11 +44,19 @@ class ShapeSpec:
             self.has_ellipsis = True
         else:
             self.left_entries = self.entries
-            self.right_entries = []
+            self.right_entries = ()
             self.has_ellipsis = False
+        names: Dict[str, None] = {}
+        for e in self.entries:
+            names.update(dict.fromkeys(e.iter_names()))
+        self.names: Tuple[str, ...] = tuple(names)
+        self._solve_orders: Dict[
+            Tuple[Tuple[bool, ...], Tuple[int, ...]], SolveOrder
+        ] = {}
+        self.compiled = CompiledSpec(self)
 
     def evaluate(
-        self, known_dims: Optional[Dict[str, int]] = None
+        self, known_dims: Optional[Mapping[str, int]] = None
     ) -> List[Optional[int]]:
         known_dims = known_dims or {}
 
@@ -51,7 +68,7 @@ class ShapeSpec:
             return [x.evaluate(known_dims) for x in self.entries]
 
     def partial_evaluate(
-        self, known_dims: Optional[Dict[str, int]] = None
+        self, known_dims: Optional[Mapping[str, int]] = None
     ) -> List[Union[int, str, None]]:
         known_dims = known_dims or {}
         eval_shape: List[Union[int, str, None]] = []
@@ -71,7 +88,7 @@ class ShapeSpec:
                 return False
         return True
 
-    def matches(self, shape, known_dims: Optional[Dict[str, int]] = None) -> bool:
+    def matches(self, shape, known_dims: Optional[Mapping[str, int]] = None) -> bool:
         known_dims = known_dims or {}
         rank_matches = self.rank_matches(shape)
         conflicts = any(
@@ -80,6 +97,20 @@ class ShapeSpec:
 
         return rank_matches and not conflicts
 
+    def entries_for_rank(self, rank: int) -> List[dim_specs.DimSpec]:
+        """The entry for each dim of a shape of this (matching) rank.
+
+        The ellipsis is expanded into wildcards.
+        """
+        if not self.has_ellipsis:
+            return list(self.entries)
+        n_wildcards = rank - len(self.left_entries) - len(self.right_entries)
+        return (
+            list(self.left_entries)
+            + [dim_specs.Wildcard() for _ in range(n_wildcards)]
+            + list(self.right_entries)
+        )
+
     def zip_iter(self, shape: ShapeType):
         for s, e in zip(shape, self.left_entries):
             yield s, e
@@ -87,22 +118,62 @@ class ShapeSpec:
             for s, e in zip(shape[-len(self.right_entries) :], self.right_entries):
                 yield s, e
 
+    def solve_order(
+        self, known_dims: Collection[str], dynamic: Tuple[int, ...] = ()
+    ) -> SolveOrder:
+        """Returns the order in which the unknown dims will be inferred.
+
+        The order only depends on which of the names in this spec are
+        already known and on which entries are `dynamic` (None in the
+        shape), and is computed once for each combination.
+        """
+        key = (tuple([n in known_dims for n in self.names]), dynamic)
+        try:
+            return self._solve_orders[key]
+        except KeyError:
+            known = {n for n, k in zip(self.names, key[0]) if k}
+            entries = list(self.left_entries) + list(self.right_entries)
+            order = self._solve_orders[key] = solve(entries, known, frozenset(dynamic))
+            return order
+
     def infer(
-        self, shape: ShapeType, known_dims: Optional[Dict[str, int]] = None
+        self, shape: ShapeType, known_dims: Optional[Mapping[str, int]] = None
     ) -> Dict[str, int]:
-        current_known = {}
+        current_known: Dict[str, int] = {}
         if known_dims:
             current_known.update(known_dims)
-        inferred = {"Start": True}
-        while inferred:
-            inferred = {}
-            for s, x in self.zip_iter(shape):
-                inferred.update(x.infer(s, current_known))
-            current_known.update(inferred)
+        zipped = list(self.zip_iter(shape))
+        # nothing can be learned from a dynamic dimension, so the plan
+        # takes the names they would determine from other entries
+        dynamic = tuple([i for i, (s, _) in enumerate(zipped) if s is None])
+        for step in self.solve_order(current_known, dynamic).steps:
+            if step.index >= len(zipped):
+                continue
+            s, x = zipped[step.index]
+            current_known.update(x.infer(s, current_known))
         return current_known
 
     def __repr__(self) -> str:
-        return "<{}>".format(self.entries)
+        return "<{}>".format(list(self.entries))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ShapeSpec) and self.entries == other.entries
+
+    def __hash__(self) -> int:
+        # DimSpecs aren't hashable, but equal specs have the same names
+        return hash((len(self.entries), self.names))
 
     def __len__(self) -> int:
         return len(self.entries)
+
+
+def joint_spec(specs: Sequence[ShapeSpec], ranks: Sequence[int]) -> ShapeSpec:
+    """Concatenates specs into one spec for the concatenated shapes.
+
+    Ellipses are expanded into wildcards for the given ranks, which
+    must match the specs.
+    """
+    entries: List[dim_specs.DimSpec] = []
+    for spec, rank in zip(specs, ranks):
+        entries.extend(spec.entries_for_rank(rank))
+    return ShapeSpec(entries)
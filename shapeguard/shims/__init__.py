@@ -1 +1 @@
-from .shim import get_shim
+from .shim import get_shim, get_shim_factory, register_shim
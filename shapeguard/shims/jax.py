@@ -0,0 +1,65 @@
+from typing import List, Optional, Sequence
+
+import jax
+
+from ..exception import ShapeError
+from .shim import TensorShim
+
+
+class JaxArrayShim(TensorShim[jax.Array]):
+    """Shim for concrete arrays and for tracers inside `jax.jit`.
+
+    Tracers have the static shape of the compiled computation, so guards
+    inside a jitted function run once per trace and not on every step.
+    Symbolic dims (from shape polymorphism) are returned as None.
+    """
+
+    def get_shape(self) -> List[Optional[int]]:
+        return _as_list(self.tensor.shape)
+
+    @classmethod
+    def get_shapes(cls, tensors: Sequence[jax.Array]) -> List[Sequence[Optional[int]]]:
+        return [_as_list(t.shape) for t in tensors]
+
+    def reshape(self, new_shape: Sequence[Optional[int]]) -> jax.Array:
+        return self.tensor.reshape([-1 if d is None else d for d in new_shape])
+
+    def permute(self, axes: Sequence[int]) -> jax.Array:
+        return self.tensor.transpose(axes)
+
+
+def _as_list(shape) -> List[Optional[int]]:
+    return [d if isinstance(d, int) else None for d in shape]
+
+
+def mark_static(*names: str) -> None:
+    """Requires that dims keep their current values in later traces.
+
+    Call inside a jitted function, after the guards that infer the dims.
+    jax retraces when a shape changes; if a dim marked static changed,
+    this raises instead, at trace time. Values are kept per fork params
+    (throwaway forks share theirs) until `sg.reset()`.
+    """
+    from ..interface import _scope, sg
+
+    scope = _scope.get()
+    fork = None if scope is None else frozenset(scope.guard.params.items())
+    dims = scope.guard.dims if scope is not None else sg.get_base().dims
+    for name in names:
+        if name not in dims:
+            raise ShapeError(
+                f"Can't mark unknown dim {name} static\nKnown dimensions: {dict(dims)}"
+            )
+        value = dims[name]
+        previous = sg._static_dims.setdefault((fork, name), value)
+        if previous != value:
+            raise ShapeError(
+                f"Static dim {name} changed from {previous} to {value}, which retraces"
+            )
+
+
+def clear_static() -> None:
+    """Forgets the values of the dims marked static."""
+    from ..interface import sg
+
+    sg._static_dims.clear()
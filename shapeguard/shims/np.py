@@ -1,10 +1,31 @@
-from typing import List
+from typing import List, Optional, Sequence, Tuple
 
 import numpy as np
 
-from .shim import TensorShim
+from .shim import TensorShim, fill_shape
 
 
 class NpTensorShim(TensorShim[np.ndarray]):
     def get_shape(self) -> List[int]:
         return list(self.tensor.shape)
+
+    @classmethod
+    def get_shapes(cls, tensors: Sequence[np.ndarray]) -> List[Tuple[int, ...]]:
+        return [t.shape for t in tensors]
+
+    def reshape(self, new_shape: Sequence[Optional[int]]) -> np.ndarray:
+        return self.tensor.reshape(fill_shape(new_shape, self.tensor.size))
+
+    def permute(self, axes: Sequence[int]) -> np.ndarray:
+        return self.tensor.transpose(axes)
+
+    def reshape_view(self, new_shape: Sequence[Optional[int]]) -> Optional[np.ndarray]:
+        shape = fill_shape(new_shape, self.tensor.size)
+        # assigning the shape of a view never copies (unlike reshape),
+        # it fails if the strides don't allow it
+        view = self.tensor.view()
+        try:
+            view.shape = shape
+        except AttributeError:
+            return None
+        return view
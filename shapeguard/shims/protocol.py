@@ -0,0 +1,36 @@
+import math
+import operator
+from typing import Any, List, Optional
+
+from ..exception import ShapeGuardShimError
+from .shim import TensorShim
+
+
+class ShapeProtocolShim(TensorShim[Any]):
+    """Fallback shim for any object with a `.shape` or `__array_interface__`.
+
+    Only the shape is read, never the data, so memory-mapped, on-disk
+    (h5py, zarr) and lazy (dask) arrays are guarded in constant time.
+    Unknown sizes (None, or NaN as in dask) are returned as None.
+    """
+
+    def __init__(self, tensor: Any):
+        shape = getattr(tensor, "shape", None)
+        if shape is None:
+            interface = getattr(tensor, "__array_interface__", None)
+            shape = None if interface is None else interface.get("shape")
+        if shape is None:
+            raise ShapeGuardShimError(
+                "Unknown tensor/shape {} of type: {}".format(tensor, type(tensor))
+            )
+        self.tensor = tensor
+        self.shape = shape
+
+    def get_shape(self) -> List[Optional[int]]:
+        return [_size(s) for s in self.shape]
+
+
+def _size(size: Any) -> Optional[int]:
+    if size is None or (isinstance(size, float) and math.isnan(size)):
+        return None
+    return operator.index(size)
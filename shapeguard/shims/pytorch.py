@@ -1,10 +1,30 @@
-from typing import List
+from typing import List, Optional, Sequence
 
 import torch
 
-from .shim import TensorShim
+from .shim import TensorShim, fill_shape
 
 
 class TorchTensorShim(TensorShim[torch.Tensor]):
     def get_shape(self) -> List[int]:
         return list(self.tensor.shape)
+
+    @classmethod
+    def get_shapes(cls, tensors: Sequence[torch.Tensor]) -> List[torch.Size]:
+        return [t.shape for t in tensors]
+
+    def reshape(self, new_shape: Sequence[Optional[int]]) -> torch.Tensor:
+        return self.tensor.reshape(fill_shape(new_shape, self.tensor.numel()))
+
+    def permute(self, axes: Sequence[int]) -> torch.Tensor:
+        return self.tensor.permute(tuple(axes))
+
+    def reshape_view(
+        self, new_shape: Sequence[Optional[int]]
+    ) -> Optional[torch.Tensor]:
+        shape = fill_shape(new_shape, self.tensor.numel())
+        try:
+            # unlike reshape, view never copies
+            return self.tensor.view(shape)
+        except RuntimeError:
+            return None
@@ -1,6 +1,17 @@
-from typing import Any, Generic, List, Optional, TypeVar
-
-from ..exception import ShapeGuardShimError
+import importlib
+import math
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Optional,
+    Sequence,
+    TypeVar,
+    Union,
+)
+
+from ..exception import ShapeError
 
 T = TypeVar("T")
 
@@ -9,80 +20,120 @@ class TensorShim(Generic[T]):
     def __init__(self, tensor: T):
         self.tensor = tensor
 
-    def get_shape(self) -> List[int]:
-        raise NotImplementedError
-
-    def reshape(self, new_shape: List[Optional[int]]) -> T:
+    def get_shape(self) -> Sequence[Optional[int]]:
         raise NotImplementedError
 
+    @classmethod
+    def get_shapes(cls, tensors: Sequence[T]) -> Sequence[Sequence[Optional[int]]]:
+        """Shapes of many tensors of this type; override to avoid creating shims."""
+        return [cls(t).get_shape() for t in tensors]
 
-try:
-    from numpy import ndarray as _ndarray
-except ImportError:
-    ndarray = None
-else:
-    ndarray = _ndarray
-
-try:
-    from tensorflow import Tensor as _TfTensor
-    from tensorflow import TensorShape as _TfTensorShape
-except ImportError:
-    TfTensor, TfTensorShape = None, None
-else:
-    TfTensor, TfTensorShape = _TfTensor, _TfTensorShape
-
-try:
-    import tensorflow_probability.distributions.Distribution as _TfpDistribution
-except ImportError:
-    TfpDistribution = None
-else:
-    TfpDistribution = _TfpDistribution
-
-try:
-    from torch import Tensor as _TorchTensor
-except ImportError:
-    TorchTensor = None
-else:
-    TorchTensor = _TorchTensor
-
-
-def get_shim(tensor: Any) -> TensorShim:
-    if isinstance(tensor, (list, tuple)):
-        from .list import ListTensorShim
-
-        return ListTensorShim(tensor)
+    def reshape(self, new_shape: Sequence[Optional[int]]) -> T:
+        raise NotImplementedError
 
-    elif TfTensor is not None and isinstance(tensor, TfTensor):
+    def permute(self, axes: Sequence[int]) -> T:
+        raise NotImplementedError
 
-        from .tf import TfTensorShim
+    def reshape_view(self, new_shape: Sequence[Optional[int]]) -> Optional[T]:
+        """Reshapes without copying, or returns None if that's impossible."""
+        return self.reshape(new_shape)
 
-        return TfTensorShim(tensor)
 
-    elif TfTensorShape is not None and isinstance(tensor, TfTensorShape):
+def fill_shape(new_shape: Sequence[Optional[int]], size: int) -> Sequence[int]:
+    """new_shape with the (at most one) unknown size as -1; checks that size fits.
 
-        from .tf import TfTensorShapeShim
+    Unknown sizes are None (dynamic dims) or -1 (wildcards).
+    """
+    if None not in new_shape and -1 not in new_shape:
+        if math.prod(new_shape) != size:  # type: ignore[arg-type]
+            raise ShapeError(
+                f"Cannot reshape tensor of size {size} into shape {new_shape}"
+            )
+        return new_shape  # type: ignore[return-value]
 
-        return TfTensorShapeShim(tensor)
+    shape = [-1 if d is None else d for d in new_shape]
+    known = -math.prod(shape)
+    if shape.count(-1) > 1 or known == 0 or size % known:
+        raise ShapeError(f"Cannot reshape tensor of size {size} into shape {new_shape}")
+    return shape
 
-        return tensor.as_list()
-    elif ndarray is not None and isinstance(tensor, ndarray):
 
-        from .np import NpTensorShim
+ShimFactory = Callable[[Any], TensorShim]
 
-        return NpTensorShim(tensor)
+# fully-qualified type name -> shim, or "module:attribute" of a shim
+# that has not been imported yet
+_registry: Dict[str, Union[str, ShimFactory]] = {}
 
-    elif TfpDistribution is not None and isinstance(tensor, TfpDistribution):
+# type(tensor) -> resolved shim
+_dispatch: Dict[type, ShimFactory] = {}
 
-        from .tfp import TfpDistributionShim
 
-        return TfpDistributionShim(tensor)
+def register_shim(type_name: str, shim: Union[str, ShimFactory]) -> None:
+    """Registers the shim to use for a tensor type and its subclasses.
 
-    elif TorchTensor is not None and isinstance(tensor, TorchTensor):
+    Args:
+      type_name: fully-qualified name of the type, eg. "numpy.ndarray"
+      shim: a TensorShim subclass (or any callable that takes the tensor
+        and returns a TensorShim), or a "module:attribute" string pointing
+        to one. Strings are only imported when a tensor of a matching
+        type is first seen, so registering a shim never imports the
+        framework.
+    """
+    _registry[type_name] = shim
+    _dispatch.clear()
 
-        from .pytorch import TorchTensorShim
 
-        return TorchTensorShim(tensor)
-    else:
-        raise ShapeGuardShimError(
-            "Unknown tensor/shape {} of type: {}".format(tensor, type(tensor))
-        )
+def get_shim(tensor: Any) -> TensorShim:
+    return get_shim_factory(type(tensor))(tensor)
+
+
+def get_shim_factory(cls: type) -> ShimFactory:
+    try:
+        return _dispatch[cls]
+    except KeyError:
+        factory = _dispatch[cls] = _resolve(cls)
+        return factory
+
+
+def _resolve(cls: type) -> ShimFactory:
+    for klass in cls.__mro__:
+        type_name = f"{klass.__module__}.{klass.__qualname__}"
+        shim = _registry.get(type_name)
+        if shim is None:
+            continue
+        if isinstance(shim, str):
+            module_name, attribute = shim.split(":")
+            shim = getattr(importlib.import_module(module_name), attribute)
+            _registry[type_name] = shim
+        return shim
+    # any object with a shape, see ShapeProtocolShim
+    from .protocol import ShapeProtocolShim
+
+    return ShapeProtocolShim
+
+
+register_shim("builtins.list", "shapeguard.shims.list:ListTensorShim")
+register_shim("builtins.tuple", "shapeguard.shims.list:ListTensorShim")
+register_shim("numpy.ndarray", "shapeguard.shims.np:NpTensorShim")
+register_shim("torch.Tensor", "shapeguard.shims.pytorch:TorchTensorShim")
+# tf.Tensor moved from framework.ops to framework.tensor in TF 2.13
+register_shim(
+    "tensorflow.python.framework.ops.Tensor", "shapeguard.shims.tf:TfTensorShim"
+)
+register_shim(
+    "tensorflow.python.framework.tensor.Tensor", "shapeguard.shims.tf:TfTensorShim"
+)
+register_shim(
+    "tensorflow.python.framework.tensor_shape.TensorShape",
+    "shapeguard.shims.tf:TfTensorShapeShim",
+)
+# concrete arrays moved from jaxlib.xla_extension to jaxlib._jax in 0.6;
+# tracers (inside jax.jit etc.) all subclass jax._src.core.Tracer
+register_shim("jaxlib.xla_extension.ArrayImpl", "shapeguard.shims.jax:JaxArrayShim")
+register_shim("jaxlib._jax.ArrayImpl", "shapeguard.shims.jax:JaxArrayShim")
+register_shim("jax._src.array.ArrayImpl", "shapeguard.shims.jax:JaxArrayShim")
+register_shim("jax._src.core.Tracer", "shapeguard.shims.jax:JaxArrayShim")
+register_shim(
+    "tensorflow_probability.python.distributions.distribution.Distribution",
+    "shapeguard.shims.tfp:TfpDistributionShim",
+)
@@ -1,17 +1,29 @@
-from typing import List, Optional
+from __future__ import annotations
+
+import weakref
+from typing import TYPE_CHECKING, Any, List, Optional, Sequence
 
 import tensorflow as tf
 
+from .. import tools
+from ..dim_specs import NamedDim
+from ..parser import parse
 from .shim import TensorShim
 
+if TYPE_CHECKING:
+    from ..guard import ShapeGuard
+
 
 class TfTensorShim(TensorShim[tf.Tensor]):
     def get_shape(self) -> List[int]:
         return self.tensor.get_shape().as_list()  # type: ignore
 
-    def reshape(self, new_shape: List[Optional[int]]) -> tf.Tensor:
+    def reshape(self, new_shape: Sequence[Optional[int]]) -> tf.Tensor:
         return tf.reshape(self.tensor, new_shape)
 
+    def permute(self, axes: Sequence[int]) -> tf.Tensor:
+        return tf.transpose(self.tensor, axes)
+
 
 class TfTensorShapeShim(TensorShim[tf.TensorShape]):
     def __init__(self, tensor: tf.TensorShape):
@@ -19,3 +31,54 @@ class TfTensorShapeShim(TensorShim[tf.TensorShape]):
 
     def get_shape(self) -> List[int]:
         return self.tensor.as_list()  # type: ignore
+
+
+try:
+    # graph tensors have their own type since TF 2.13
+    from tensorflow.python.framework.ops import SymbolicTensor as GraphTensor
+except ImportError:  # pragma: no cover
+    from tensorflow.python.framework.ops import Tensor as GraphTensor
+
+# FuncGraph -> tf.shape() entries of names that are only known in the
+# graph, see tools.graph_symbols
+_symbols: tools.SymbolTables = weakref.WeakKeyDictionary()
+
+
+def guard_graph_tensor(guard: ShapeGuard, tensor: Any, template: str) -> None:
+    """Guards a tensor while its tf.function is traced.
+
+    The static shape is checked (and dims inferred from it) once, at
+    trace time. Dims that are None in the static shape become in-graph
+    assertions: against the known size of their template entry, or for
+    names that are only known in the graph (remembered per graph and
+    fork scope, not in the dims), against their first occurrence.
+    """
+    static_shape = tensor.shape
+    if static_shape.rank is None:
+        return
+    shape = static_shape.as_list()
+    inferred, expected = tools.guard_partial_shape(shape, template, guard.dims)
+    if inferred:
+        guard.dims.update(inferred)
+    if not expected:
+        return
+
+    dynamic = [i for i, s in enumerate(shape) if s is None]
+    entries = parse(template).entries_for_rank(len(shape))
+    sizes = tf.shape(tensor)
+    for i, size in zip(dynamic, expected):
+        entry = entries[i]
+        if size is None:
+            if type(entry) is not NamedDim:
+                continue
+            symbols = tools.graph_symbols(
+                _symbols, tensor.graph, guard.dims, entry.name
+            )
+            if entry.name not in symbols:
+                symbols[entry.name] = sizes[i]
+                continue
+            size = symbols[entry.name]
+        message = (
+            f"Shape Mismatch: dim {i} should be {entry!r} (from template {template})"
+        )
+        tf.debugging.assert_equal(sizes[i], tf.cast(size, sizes.dtype), message=message)
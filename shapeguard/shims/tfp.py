@@ -5,6 +5,6 @@ import tensorflow_probability as tfp
 from .shim import TensorShim
 
 
-class TfpDistributionShim(TensorShim[tfp.distribution.Distribution]):
+class TfpDistributionShim(TensorShim[tfp.distributions.Distribution]):
     def get_shape(self) -> List[int]:
         return self.tensor.batch_shape.as_list() + self.tensor.event_shape.as_list()  # type: ignore
@@ -0,0 +1,128 @@
+"""Plans in which order the dims of a ShapeSpec can be inferred.
+
+Which entry can determine which name only depends on which names are
+already known, not on the actual sizes. So instead of iterating
+`DimSpec.infer` over all entries until nothing new is learned, we
+solve the dependencies once per set of known names and then infer in
+a single linear pass.
+"""
+
+from __future__ import annotations
+
+from typing import AbstractSet, Dict, List, Optional, Sequence, Set, Tuple
+
+import attr
+
+from . import dim_specs
+
+DIRECT = "direct"  # NamedDim entry takes the size from the shape
+ASSIGN = "assign"  # AssignDim entry evaluates its value expression
+INVERT = "invert"  # arithmetic entry is solved for its one unknown name
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class SolveStep:
+    index: int
+    name: str
+    kind: str
+    entry: dim_specs.DimSpec
+
+    def __str__(self) -> str:
+        return f"{self.name} <- {self.kind} entry {self.index} ({self.entry!r})"
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class SolveOrder:
+    known: AbstractSet[str]
+    steps: Tuple[SolveStep, ...]
+    # name -> indices of the entries that mention it
+    unresolved: Dict[str, Tuple[int, ...]]
+
+    def explain(self) -> str:
+        lines = [f"known: {sorted(self.known)}"]
+        lines += [f"  {i + 1}. {step}" for i, step in enumerate(self.steps)]
+        for name, indices in self.unresolved.items():
+            lines.append(
+                f"  {name} cannot be inferred: entries {list(indices)} "
+                "depend on more than one unknown dim"
+            )
+        return "\n".join(lines)
+
+
+def solve(
+    entries: Sequence[dim_specs.DimSpec],
+    known: AbstractSet[str],
+    dynamic: AbstractSet[int] = frozenset(),
+) -> SolveOrder:
+    """Orders the inference steps for `entries` given the `known` names.
+
+    `entries` are the entries that are zipped with the shape (ie.
+    without the ellipsis). Names are determined by the first entry that
+    can determine them, preferring entries that read a named dim
+    directly from the shape over inverting arithmetic. The entries at
+    the `dynamic` indices (where the shape is None) can't determine
+    anything from the shape, so another entry is used if there is one.
+    """
+    solver = _Solver(known)
+    for i, e in enumerate(entries):
+        if (
+            isinstance(e, dim_specs.NamedDim)
+            and not isinstance(e, dim_specs.AssignDim)
+            and i not in dynamic
+        ):
+            solver.add(i, e.name, DIRECT, e)
+
+    changed = True
+    while changed:
+        changed = False
+        for i, e in enumerate(entries):
+            if isinstance(e, dim_specs.AssignDim):
+                if solver.evaluable(e.value):
+                    changed |= solver.add(i, e.name, ASSIGN, e)
+                    continue
+                target = solver.inversion_target(e.value)
+            elif isinstance(e, dim_specs.OpSpec):
+                target = solver.inversion_target(e)
+            else:
+                continue
+            if target is not None and i not in dynamic:
+                changed |= solver.add(i, target, INVERT, e)
+
+    unresolved: Dict[str, List[int]] = {}
+    for i, e in enumerate(entries):
+        for n in e.iter_names():
+            if n not in solver.known and i not in unresolved.setdefault(n, []):
+                unresolved[n].append(i)
+    return SolveOrder(
+        known=frozenset(known),
+        steps=tuple(solver.steps),
+        unresolved={n: tuple(idx) for n, idx in unresolved.items()},
+    )
+
+
+class _Solver:
+    def __init__(self, known: AbstractSet[str]):
+        self.known: Set[str] = set(known)
+        self.steps: List[SolveStep] = []
+
+    def add(self, index: int, name: str, kind: str, entry: dim_specs.DimSpec) -> bool:
+        if name in self.known:
+            return False
+        self.known.add(name)
+        self.steps.append(SolveStep(index, name, kind, entry))
+        return True
+
+    def evaluable(self, expr: dim_specs.DimSpec) -> bool:
+        return all(n in self.known for n in expr.iter_names())
+
+    def inversion_target(self, expr: dim_specs.DimSpec) -> Optional[str]:
+        """Mirrors the choices made by OpSpec.infer and NamedDim.infer."""
+        if isinstance(expr, dim_specs.OpSpec):
+            if self.evaluable(expr.left):
+                return self.inversion_target(expr.right)
+            elif self.evaluable(expr.right):
+                return self.inversion_target(expr.left)
+            return None
+        elif isinstance(expr, dim_specs.NamedDim):
+            return None if expr.name in self.known else expr.name
+        return None
@@ -0,0 +1,137 @@
+"""Opt-in timing and counting of guards per call site and per template.
+
+Enabled with `sg.enable_stats()`; while disabled, sg() and
+ShapeGuard.guard only check a single global.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from types import FrameType
+from typing import Any, Dict, Optional, Tuple
+
+import attr
+
+from .parser import spec_cache
+
+CHECKED = "checked"
+CACHE_HIT = "cache_hit"
+SKIPPED = "skipped"
+DEFERRED = "deferred"
+
+SiteKey = Tuple[str, int]
+
+
+@attr.s(auto_attribs=True)
+class GuardStats:
+    calls: int = 0
+    failures: int = 0
+    cache_hits: int = 0
+    skipped: int = 0
+    deferred: int = 0
+    total_ns: int = 0
+    max_ns: int = 0
+
+    @property
+    def mean_ns(self) -> float:
+        return self.total_ns / self.calls if self.calls else 0.0
+
+    @property
+    def cache_hit_rate(self) -> float:
+        return self.cache_hits / self.calls if self.calls else 0.0
+
+    def add(self, elapsed_ns: int, status: Optional[str]) -> None:
+        self.calls += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        if status is None:
+            self.failures += 1
+        elif status == CACHE_HIT:
+            self.cache_hits += 1
+        elif status == SKIPPED:
+            self.skipped += 1
+        elif status == DEFERRED:
+            self.deferred += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = attr.asdict(self)
+        d.update(mean_ns=self.mean_ns, cache_hit_rate=self.cache_hit_rate)
+        return d
+
+
+@attr.s(auto_attribs=True)
+class StatsReport:
+    sites: Dict[str, GuardStats]
+    templates: Dict[str, GuardStats]
+    spec_cache: Dict[str, Any]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "sites": {k: v.to_dict() for k, v in self.sites.items()},
+            "templates": {k: v.to_dict() for k, v in self.templates.items()},
+            "spec_cache": self.spec_cache,
+        }
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def dump(self, path: str) -> None:
+        with open(path, "w") as f:
+            f.write(self.to_json(indent=2))
+
+
+class StatsRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sites: Dict[SiteKey, GuardStats] = {}
+        self.templates: Dict[str, GuardStats] = {}
+
+    def record(
+        self,
+        frame: FrameType,
+        template: Any,
+        elapsed_ns: int,
+        status: Optional[str],
+    ) -> None:
+        """Records one guard. `status` is None for failed guards."""
+        site = (frame.f_code.co_filename, frame.f_lineno)
+        template = template if isinstance(template, str) else repr(template)
+        with self._lock:
+            if site not in self.sites:
+                self.sites[site] = GuardStats()
+            if template not in self.templates:
+                self.templates[template] = GuardStats()
+            self.sites[site].add(elapsed_ns, status)
+            self.templates[template].add(elapsed_ns, status)
+
+    def report(self) -> StatsReport:
+        with self._lock:
+            return StatsReport(
+                sites={
+                    f"{f}:{line}": copy_stats(s) for (f, line), s in self.sites.items()
+                },
+                templates={t: copy_stats(s) for t, s in self.templates.items()},
+                spec_cache=attr.asdict(spec_cache.info()),
+            )
+
+
+def copy_stats(stats: GuardStats) -> GuardStats:
+    return attr.evolve(stats)
+
+
+recorder: Optional[StatsRecorder] = None
+clock = time.perf_counter_ns
+
+
+def enable() -> None:
+    global recorder
+    if recorder is None:
+        recorder = StatsRecorder()
+
+
+def disable() -> None:
+    global recorder
+    recorder = None
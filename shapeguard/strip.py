@@ -0,0 +1,252 @@
+"""Strips guards from modules when they are imported.
+
+Even `sg.noop()` leaves the cost of calling `sg()`. For builds where
+guards should cost nothing at all, `strip_modules()` installs an import
+hook that rewrites the AST of the given modules before compilation:
+
+- `sg(expr, template)` becomes `expr`
+- `<guard>.guard(expr, template)` becomes `expr`
+
+and statements that are left with only a name (eg. `sg(x, "B,C")` on
+its own line) are removed, so the stripped code compiles to the same
+bytecode as code that was never guarded.
+
+Only calls that are known to be guards are stripped: `sg` must be
+imported from shapeguard (or be a builtin installed with `sg.install()`,
+ie. not bound in the module), and `<guard>` must be `ShapeGuard(...)`,
+`sg.get()` or a name that is only ever assigned one of these.
+
+Only modules imported after `strip_modules()` is called are affected.
+Setting the environment variable `SHAPEGUARD_STRIP` to a comma
+separated list of module names strips them as soon as shapeguard is
+imported.
+"""
+
+from __future__ import annotations
+
+import ast
+import importlib.abc
+import importlib.machinery
+import os
+import sys
+from typing import Iterable, Set, cast
+
+ENV_VAR = "SHAPEGUARD_STRIP"
+
+
+class GuardStripper(ast.NodeTransformer):
+    def __init__(self, names: Iterable[str] = ("sg",)):
+        # names under which sg may be installed as a builtin
+        self.names = set(names)
+        self._bindings = _Bindings()
+
+    def visit_Call(self, node: ast.Call) -> ast.AST:
+        self.generic_visit(node)
+        func = node.func
+        if node.keywords or len(node.args) != 2:
+            return node
+        if self._bindings.is_sg(func):
+            return node.args[0]
+        if (
+            isinstance(func, ast.Attribute)
+            and func.attr == "guard"
+            and self._bindings.is_guard(func.value)
+        ):
+            return node.args[0]
+        return node
+
+    def visit_Expr(self, node: ast.Expr):
+        value = node.value
+        node = self.generic_visit(node)  # type: ignore
+        if node.value is not value and _is_pure(node.value):
+            return None
+        return node
+
+    def generic_visit(self, node: ast.AST) -> ast.AST:
+        # statement lists that must not be empty; an emptied `orelse` is
+        # simply left out
+        nonempty = [f for f in ("body", "finalbody") if getattr(node, f, None)]
+        node = super().generic_visit(node)
+        for field in nonempty:
+            if not getattr(node, field):
+                setattr(node, field, [ast.copy_location(ast.Pass(), node)])
+        return node
+
+    def strip(self, tree: ast.Module) -> ast.Module:
+        self._bindings = _Bindings.of(tree, self.names)
+        try:
+            return ast.fix_missing_locations(cast(ast.Module, self.visit(tree)))
+        finally:
+            self._bindings = _Bindings()
+
+
+class _Bindings:
+    """What the names of a module refer to, as far as guards are concerned.
+
+    This is flow-insensitive: a name that is bound to anything else
+    anywhere in the module is never considered a guard.
+    """
+
+    def __init__(self):
+        self.modules: Set[str] = set()  # shapeguard
+        self.sg: Set[str] = set()  # shapeguard.sg
+        self.classes: Set[str] = set()  # shapeguard.ShapeGuard
+        self.guards: Set[str] = set()  # ShapeGuard instances
+
+    @classmethod
+    def of(cls, tree: ast.AST, builtin_names: Iterable[str]) -> _Bindings:
+        self = cls()
+        other: Set[str] = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    bound = alias.asname or alias.name.partition(".")[0]
+                    if alias.name.partition(".")[0] == "shapeguard" and (
+                        alias.asname is None or alias.name == "shapeguard"
+                    ):
+                        self.modules.add(bound)
+                    else:
+                        other.add(bound)
+            elif isinstance(node, ast.ImportFrom):
+                for alias in node.names:
+                    bound = alias.asname or alias.name
+                    origin = (node.module, alias.name)
+                    if node.level == 0 and origin in _SG:
+                        self.sg.add(bound)
+                    elif node.level == 0 and origin in _CLASSES:
+                        self.classes.add(bound)
+                    else:
+                        other.add(bound)
+            elif isinstance(
+                node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+            ):
+                other.add(node.name)
+            elif isinstance(node, ast.arg):
+                other.add(node.arg)
+            elif isinstance(node, ast.ExceptHandler) and node.name:
+                other.add(node.name)
+            elif isinstance(node, (ast.Global, ast.Nonlocal)):
+                other.update(node.names)
+
+        stores = [
+            node
+            for node in ast.walk(tree)
+            if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load)
+        ]
+        # names that are bound to anything else are not trusted at all
+        other.update(node.id for node in stores)
+        self.modules -= other
+        self.sg -= other
+        self.classes -= other
+        # sg installed as a builtin with sg.install()
+        self.sg.update(n for n in builtin_names if n not in other)
+
+        guard_targets = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Assign):
+                targets = node.targets
+            elif isinstance(node, ast.AnnAssign) and node.value is not None:
+                targets = [node.target]
+            else:
+                continue
+            value = node.value
+            if len(targets) == 1 and self.is_guard(value):  # type: ignore[arg-type]
+                guard_targets.add(targets[0])
+        candidates = {node.id for node in stores if node in guard_targets}
+        others = {node.id for node in stores if node not in guard_targets}
+        # other bindings of the candidates, eg. function arguments
+        others |= other - {node.id for node in stores}
+        self.guards = candidates - others
+        return self
+
+    def is_sg(self, node: ast.AST) -> bool:
+        if isinstance(node, ast.Name):
+            return node.id in self.sg
+        return self._is_module_attr(node, "sg")
+
+    def is_guard(self, node: ast.AST) -> bool:
+        if isinstance(node, ast.Name):
+            return node.id in self.guards
+        if not isinstance(node, ast.Call):
+            return False
+        func = node.func
+        if isinstance(func, ast.Name):
+            return func.id in self.classes
+        if self._is_module_attr(func, "ShapeGuard"):
+            return True
+        return (
+            isinstance(func, ast.Attribute)
+            and func.attr in ("get", "get_base", "get_throwaway")
+            and self.is_sg(func.value)
+        )
+
+    def _is_module_attr(self, node: ast.AST, attr: str) -> bool:
+        return (
+            isinstance(node, ast.Attribute)
+            and node.attr == attr
+            and isinstance(node.value, ast.Name)
+            and node.value.id in self.modules
+        )
+
+
+_SG = {("shapeguard", "sg"), ("shapeguard.interface", "sg")}
+_CLASSES = {("shapeguard", "ShapeGuard"), ("shapeguard.guard", "ShapeGuard")}
+
+
+def _is_pure(node: ast.AST) -> bool:
+    if isinstance(node, (ast.Name, ast.Constant)):
+        return True
+    return isinstance(node, ast.Attribute) and _is_pure(node.value)
+
+
+class _StrippingLoader(importlib.machinery.SourceFileLoader):
+    stripper: GuardStripper
+
+    def get_code(self, fullname):
+        # Bypasses the bytecode cache, which would otherwise mix stripped
+        # and unstripped code
+        path = self.get_filename(fullname)
+        tree = ast.parse(self.get_data(path), filename=path)
+        return compile(self.stripper.strip(tree), path, "exec", dont_inherit=True)
+
+
+class _StrippingFinder(importlib.abc.MetaPathFinder):
+    def __init__(self):
+        self.modules: Set[str] = set()
+        self.stripper = GuardStripper()
+
+    def find_spec(self, fullname, path, target=None):
+        if not any(fullname == m or fullname.startswith(m + ".") for m in self.modules):
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path)
+        if spec is None or not isinstance(
+            spec.loader, importlib.machinery.SourceFileLoader
+        ):
+            return spec
+        loader = _StrippingLoader(spec.loader.name, spec.loader.path)
+        loader.stripper = self.stripper
+        spec.loader = loader
+        return spec
+
+
+_finder = _StrippingFinder()
+
+
+def strip_modules(modules: Iterable[str], names: Iterable[str] = ("sg",)) -> None:
+    """Strips guards from the given modules (and their submodules).
+
+    Args:
+      modules: names of the modules/packages to strip
+      names: names under which `sg` is installed as a builtin (see
+        `sg.install()`), in modules that don't import or bind them
+    """
+    _finder.modules.update(modules)
+    _finder.stripper.names.update(names)
+    if _finder not in sys.meta_path:
+        sys.meta_path.insert(0, _finder)
+
+
+def strip_from_environ() -> None:
+    modules = [m.strip() for m in os.environ.get(ENV_VAR, "").split(",") if m.strip()]
+    if modules:
+        strip_modules(modules)
@@ -14,37 +14,129 @@
 
 """Contains the main ShapeGuard class."""
 
-from copy import copy
-from typing import Any, Dict, List, Optional
+import weakref
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    NoReturn,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
 
-from shapeguard import exception
+from shapeguard import dim_specs, exception
 
+from .cache import LRUCache
+from .dims import LayeredDims
 from .parser import parse
-from .shims import get_shim
+from .shape_spec import ShapeSpec, ShapeType, joint_spec
+from .shims import get_shim, get_shim_factory
+from .shims.shim import TensorShim
 
 Tensor = Any
 
+# Type of tensors in a graph being traced -> function that guards them
+# at trace time, see shims.tf. Registered by patch.py
+graph_guards: Dict[type, Callable[[Any, Any, str], None]] = {}
 
-def matches(tensor: Tensor, template: str, dims: Dict[str, int]) -> bool:
+# graph -> id(dims layer) -> (dims layer, {name: symbolic size}), see
+# graph_symbols
+SymbolTables = weakref.WeakKeyDictionary
+
+# see set_reshape_copy_hook
+reshape_copy_hook: Optional[Callable[[Tensor, str], None]] = None
+
+# (template, rank, positions of unknown dims) -> ShapeSpec, see
+# guard_partial_shape
+partial_cache: LRUCache[Tuple[str, int, Tuple[int, ...]], ShapeSpec] = LRUCache(
+    maxsize=256
+)
+
+# (templates, ranks) -> joint ShapeSpec, see guard_all_shapes
+joint_cache: LRUCache[Tuple[Tuple[str, ...], Tuple[int, ...]], ShapeSpec] = LRUCache(
+    maxsize=256
+)
+
+
+def matches(tensor: Tensor, template: str, dims: Mapping[str, int]) -> bool:
     shape = get_shape(tensor)
     spec = parse(template)
     return spec.matches(shape, dims)
 
 
-def reshape(tensor: Tensor, template: str, dims: Dict[str, int]) -> Tensor:
+def reshape(
+    tensor: Tensor, template: str, dims: Mapping[str, int], strict: bool = False
+) -> Tensor:
+    """Reshapes to the evaluated template, returning a view if possible.
+
+    If the strides don't allow a view, the tensor is copied, unless
+    `strict`, which raises ReshapeCopyError instead. The copy is also
+    reported to the hook set with `set_reshape_copy_hook()`.
+    """
     spec = parse(template)
-    new_shape = spec.evaluate(dims)
-    shim = get_shim(tensor)
+    return reshape_to(tensor, spec.evaluate(dims), strict, template)
+
+
+def reshape_to(
+    tensor: Tensor,
+    new_shape: Sequence[Optional[int]],
+    strict: bool = False,
+    template: str = "",
+    shim: Optional[TensorShim] = None,
+) -> Tensor:
+    """Reshapes to new_shape, see reshape(); template is for messages."""
+    if shim is None:
+        shim = get_shim(tensor)
+    view = shim.reshape_view(new_shape)
+    if view is not None:
+        return view
+
+    if strict or reshape_copy_hook is not None:
+        message = "Reshaping {} to {} (from template {}) copies it".format(
+            get_shape(tensor), new_shape, template
+        )
+        if strict:
+            raise exception.ReshapeCopyError(message)
+        reshape_copy_hook(tensor, message)  # type: ignore[misc]
     return shim.reshape(new_shape)
 
 
-def evaluate(template: str, dims: Dict[str, int]) -> List[Optional[int]]:
+def set_reshape_copy_hook(hook: Optional[Callable[[Tensor, str], None]]) -> None:
+    """Calls hook(tensor, message) whenever reshape() has to copy."""
+    global reshape_copy_hook
+    reshape_copy_hook = hook
+
+
+def evaluate(template: str, dims: Mapping[str, int]) -> List[Optional[int]]:
     dim_spec = parse(template)
     return dim_spec.evaluate(dims)
 
 
-def guard(tensor: Tensor, template: str, dims: Dict[str, int]):
-    shape = get_shape(tensor)
+def guard(tensor: Tensor, template: str, dims: Mapping[str, int]) -> Dict[str, int]:
+    """Checks tensor against template and returns the newly inferred dims.
+
+    Dims starting with '_' are not returned.
+    """
+    return guard_shape(get_shape(tensor), template, dims)
+
+
+def guard_shape(
+    shape: ShapeType, template: str, dims: Mapping[str, int]
+) -> Dict[str, int]:
+    spec = parse(template)
+    inferred_dims = spec.compiled(shape, dims)
+    if inferred_dims is not None:
+        return inferred_dims
+    _raise_mismatch(shape, template, dims)
+
+
+def _raise_mismatch(
+    shape: ShapeType, template: str, dims: Mapping[str, int]
+) -> NoReturn:
     spec = parse(template)
     # compare rank
     if not spec.rank_matches(shape):
@@ -55,22 +147,150 @@ def guard(tensor: Tensor, template: str, dims: Dict[str, int]):
                 len(shape), len(spec), spec.partial_evaluate(dims), template, shape
             )
         )
-    # infer dimensions
-    inferred_dims = spec.infer(shape, dims)
-    known_dims = copy(dims)
-    known_dims.update(inferred_dims)
-    # check if dimensions match
-    if not spec.matches(shape, known_dims):
-        raise exception.ShapeError(
-            "Shape Mismatch\n"
-            "Expected shape: {} (from template {})\n"
-            "  Actual shape: {}".format(spec.partial_evaluate(dims), template, shape)
+    raise exception.ShapeError(
+        "Shape Mismatch\n"
+        "Expected shape: {} (from template {})\n"
+        "  Actual shape: {}".format(spec.partial_evaluate(dims), template, shape)
+    )
+
+
+def graph_symbols(
+    tables: SymbolTables, graph: Any, dims: Mapping[str, int], name: str
+) -> Dict[str, Any]:
+    """The symbolic sizes of names that are only known in `graph`.
+
+    They are kept like the dims would be: in a fork, lower-case names
+    are local to the scope and upper-case names are shared with the
+    base (see LayeredDims).
+    """
+    layer = dims.layer(name) if isinstance(dims, LayeredDims) else dims
+    by_layer = tables.setdefault(graph, {})
+    entry: Optional[Tuple[Any, Dict[str, Any]]] = by_layer.get(id(layer))
+    if entry is None:
+        # the layer is kept alive with the graph, so its id isn't reused
+        entry = by_layer[id(layer)] = (layer, {})
+    return entry[1]
+
+
+def guard_partial_shape(
+    shape: Sequence[Optional[int]], template: str, dims: Mapping[str, int]
+) -> Tuple[Dict[str, int], List[Optional[int]]]:
+    """Checks the known dims of a partially known shape.
+
+    Used while tracing graphs, where some dims (None in `shape`) are
+    only known when the graph runs. These match any template entry and
+    nothing is inferred from them.
+
+    Returns:
+      the newly inferred dims, and for each unknown dim its expected
+      size (None if the template doesn't determine it), to be checked
+      in the graph.
+    """
+    unknown = tuple([i for i, s in enumerate(shape) if s is None])
+    if not unknown:
+        return guard_shape(shape, template, dims), []
+
+    spec = parse(template)
+    if not spec.rank_matches(shape):
+        _raise_mismatch(shape, template, dims)
+    entries = spec.entries_for_rank(len(shape))
+    key = (template, len(shape), unknown)
+    masked = partial_cache.get(key)
+    if masked is None:
+        masked = ShapeSpec(
+            [dim_specs.Wildcard() if i in unknown else e for i, e in enumerate(entries)]
         )
+        partial_cache.put(key, masked)
+
+    inferred_dims = masked.compiled(shape, dims)
+    if inferred_dims is None:
+        _raise_mismatch(shape, template, dims)
 
-    # return the inferred dims unless they start with '_'
-    return {k: v for k, v in inferred_dims.items() if not k.startswith("_")}
+    known_dims = dict(dims)
+    known_dims.update(inferred_dims)
+    expected: List[Optional[int]] = []
+    for i in unknown:
+        try:
+            value = entries[i].evaluate(known_dims)
+        except exception.UnderspecifiedShapeError:
+            value = None
+        if isinstance(entries[i], (dim_specs.Wildcard, dim_specs.Dynamic)):
+            value = None
+        expected.append(value)
+    return inferred_dims, expected
 
 
-def get_shape(tensor: Tensor) -> List[int]:
+def guard_all_shapes(
+    shapes: Sequence[ShapeType], templates: Sequence[str], dims: Mapping[str, int]
+) -> Dict[str, int]:
+    """Checks shapes[i] against templates[i] jointly; returns the newly inferred dims.
+
+    All templates are solved together, so dims that can only be
+    inferred from several shapes (eg. "B,N*K" and "B,K") don't depend on
+    the order of the shapes. Underscore dims are shared between the
+    templates.
+    """
+    ranks = tuple([len(s) for s in shapes])
+    key = (tuple(templates), ranks)
+    joint = joint_cache.get(key)
+    if joint is None:
+        # only specs with matching ranks are cached, so this is checked once
+        specs = [parse(t) for t in templates]
+        for shape, spec, template in zip(shapes, specs, templates):
+            if not spec.rank_matches(shape):
+                guard_shape(shape, template, dims)  # raises
+        joint = joint_spec(specs, ranks)
+        joint_cache.put(key, joint)
+
+    joint_shape = [s for shape in shapes for s in shape]
+    inferred_dims = joint.compiled(joint_shape, dims)
+    if inferred_dims is not None:
+        return inferred_dims
+
+    # report the first shape that conflicts with what could be inferred
+    known_dims = dict(dims)
+    try:
+        known_dims.update(joint.infer(joint_shape, dims))
+    except exception.ShapeGuardError:
+        pass
+    for shape, template in zip(shapes, templates):
+        guard_shape(shape, template, known_dims)
+    raise exception.ShapeError(
+        "Shape Mismatch\n"
+        "Expected shapes: {} (from templates {})\n"
+        "  Actual shapes: {}".format(
+            [parse(t).partial_evaluate(known_dims) for t in templates],
+            list(templates),
+            list(shapes),
+        )
+    )
+
+
+def get_shape(tensor: Tensor) -> ShapeType:
     shim = get_shim(tensor)
     return shim.get_shape()
+
+
+def shapes_reader(cls: type) -> Callable[[Sequence[Tensor]], Sequence[ShapeType]]:
+    """Reads the shapes of tensors of type `cls` with its shim.
+
+    The shapes are as the shim returns them (tuples, torch.Size,
+    lists), so they should only be compared with shapes from the same
+    reader.
+    """
+    factory = get_shim_factory(cls)
+    get_many = getattr(factory, "get_shapes", None)
+    if get_many is not None:
+        return cast(Callable[[Sequence[Tensor]], Sequence[ShapeType]], get_many)
+    return lambda tensors: [factory(t).get_shape() for t in tensors]
+
+
+def get_shapes(tensors: Sequence[Tensor]) -> List[ShapeType]:
+    """Returns the shapes of many tensors, resolving the shim once per type."""
+    types = set(map(type, tensors))
+    if len(types) == 1:
+        factory = get_shim_factory(types.pop())
+        get_many = getattr(factory, "get_shapes", None)
+        if get_many is not None:
+            return cast(List[ShapeType], get_many(tensors))
+    return [get_shape(t) for t in tensors]
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from shapeguard import ShapeError, sg
+
+
+@pytest.fixture(autouse=True)
+def reset_singletons():
+    sg.reset()
+
+
+def arrays(*shapes):
+    return [np.zeros(s) for s in shapes]
+
+
+def test_broadcast_template():
+    sg(arrays(*[(3, 4)] * 100), ["N, D"])
+    assert sg.get().dims == {"N": 3, "D": 4}
+
+
+def test_mismatch_reports_indices():
+    shapes = [(3, 4)] * 10
+    shapes[2] = shapes[7] = (3, 5)
+    with pytest.raises(ShapeError, match=r"2 of 10 elements at indices \[2, 7\]"):
+        sg(arrays(*shapes), ["N, D"])
+
+
+def test_rank_mismatch_reports_indices():
+    with pytest.raises(
+        ShapeError, match=r"wrong rank for 1 of 3 elements at indices \[1\]"
+    ):
+        sg(arrays((3, 4), (3, 4, 1), (3, 4)), ["N, D"])
+
+
+def test_templates_are_grouped():
+    shapes = [(3, 4), (3, 8), (3, 4), (3, 9)]
+    with pytest.raises(ShapeError, match=r"indices \[3\]"):
+        sg(arrays(*shapes), ["N, D", "N, 2*D", "N, D", "N, 2*D"])
+
+
+def test_free_underscore_dims():
+    sg(arrays((1, 4), (2, 4), (3, 4)), ["_n, D"])
+    sg(arrays((1, 1), (2, 2)), ["_n, _n"])
+    with pytest.raises(ShapeError):
+        sg(arrays((1, 1), (2, 3)), ["_n, _n"])
+
+
+def test_fallback_for_ellipsis():
+    sg(arrays((1, 2, 4), (2, 4)), ["..., D"])
+    with pytest.raises(ShapeError):
+        sg(arrays((1, 2, 4), (2, 5)), ["..., D"])
@@ -0,0 +1,36 @@
+import pytest
+from shapeguard.parser import parse
+
+
+@pytest.mark.parametrize(
+    "template, shape, known",
+    [
+        ("A, B, C", [1, 2, 3], {}),
+        ("A, B*2, A+C", [1, 2, 3], {}),
+        ("A, D=B*2, A+C", [1, 2, 3], {}),
+        ("A, B, A+C*2+1", [1, 2, 8], {}),
+        ("A, B, A+C*2+1", [1, 2, 8], {"C": 4}),
+        ("A, B, B", [1, 2, 3], {}),
+        ("*, *, 3", [1, 2, 3], {}),
+        ("_A, _b, 3", [1, 2, 3], {}),
+        ("?, B, A", [None, 2, 3], {}),
+        ("C?, B, A", [None, 2, 3], {"C": 1}),
+        ("A, B, ..., C", [1, 2, 3, 4, 5], {"A": 1}),
+        ("1, 2, ..., 4, 5", [1, 2, 3, 4, 5], {}),
+        ("1, E=D/2, 3", [1, 2, 3], {"D": 2}),
+        ("(A+B)*2, A", [6, 1], {}),
+    ],
+)
+def test_compiled_matches_interpreter(template, shape, known):
+    compiled = parse(template).compiled
+    assert compiled(shape, known) == compiled.interpret(shape, known)
+
+
+def test_compiled_is_specialized_on_known_dims():
+    compiled = parse("A, B*2").compiled
+    assert "dims['B']" not in compiled.source({})
+    assert "dims['B']" in compiled.source({"B": 2})
+    assert compiled([1, 4], {}) == {"A": 1, "B": 2}
+    assert compiled([1, 4], {"B": 2}) == {"A": 1}
+    assert compiled([1, 4], {"B": 3}) is None
+    assert compiled([1, 4, 1], {}) is None
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from shapeguard.cli import main
+from shapeguard.dataset import validate_dataset
+
+
+@pytest.fixture
+def shards(tmp_path):
+    for i, n in enumerate([5, 7, 9]):
+        np.save(tmp_path / f"img-{i}.npy", np.zeros((n, 4, 6, 3), dtype=np.uint8))
+    np.save(tmp_path / "img-bad.npy", np.zeros((2, 4, 5, 3), dtype=np.uint8))
+    sub = tmp_path / "pairs"
+    sub.mkdir()
+    np.savez_compressed(sub / "a.npz", x=np.zeros((3, 4, 6, 3)), y=np.zeros(3))
+    np.savez(sub / "b.npz", x=np.zeros((3, 4, 6, 3)), y=np.zeros(2))
+    return tmp_path
+
+
+@pytest.mark.parametrize("processes", [0, 2])
+def test_validate_dataset(shards, processes):
+    report = validate_dataset(
+        shards, {"*": "n, H, W, 3", "y": "n"}, processes=processes
+    )
+    assert report.files == 6
+    assert report.arrays == 8
+    assert report.dims == {"H": 4, "W": 6}
+    assert sorted(report.errors) == [
+        str(shards / "img-bad.npy"),
+        str(shards / "pairs" / "b.npz"),
+    ]
+    assert report.errors[str(shards / "pairs" / "b.npz")].startswith("y: ")
+
+
+def test_invalid_file_doesnt_set_dims(tmp_path):
+    # sorted first, so it would set C=2 before the valid file is read
+    np.savez(tmp_path / "a-bad.npz", x=np.zeros((2, 5)), y=np.zeros(3))
+    np.savez(tmp_path / "b.npz", x=np.zeros((4, 5)), y=np.zeros(4))
+    report = validate_dataset(tmp_path, {"x": "C, 5", "y": "C"}, processes=0)
+    assert report.dims == {"C": 4}
+    assert list(report.errors) == [str(tmp_path / "a-bad.npz")]
+
+
+def test_reads_only_headers(tmp_path):
+    path = tmp_path / "huge.npy"
+    # a header for 30 GB, without any data
+    array = np.lib.format.open_memmap(
+        path, mode="w+", dtype=np.float32, shape=(10**9, 8)
+    )
+    del array
+    with open(path, "r+b") as f:
+        f.truncate(128)
+    (tmp_path / "broken.npy").write_bytes(b"not an array")
+    report = validate_dataset(tmp_path, "N, 8", processes=0)
+    assert report.dims == {"N": 10**9}
+    assert list(report.errors) == [str(tmp_path / "broken.npy")]
+
+
+def test_cli(shards, capsys):
+    assert (
+        main([str(shards / "pairs"), "-t", "x: n, H, W, 3", "-t", "y: n", "-j", "0"])
+        == 1
+    )
+    captured = capsys.readouterr()
+    assert "b.npz: y: " in captured.err
+    assert "2 files, 4 arrays, 1 failed" in captured.out
+    assert main([str(shards / "img-0.npy"), "-t", "n, H, W, C", "-d", "C=3"]) == 0
+
+
+def test_cli_template_with_assignment(shards, capsys):
+    # "=" assigns a dim, it doesn't name a member
+    assert main([str(shards / "img-0.npy"), "-t", "N=n, H, W, C=H-1", "-j", "0"]) == 0
+    assert "'N': 5" in capsys.readouterr().out
+    assert main([str(shards / "img-0.npy"), "-t", "N=n, H, W, C=H", "-j", "0"]) == 1
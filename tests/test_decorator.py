@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from shapeguard import ShapeError, policy, sg
+
+
+@pytest.fixture(autouse=True)
+def reset_singletons():
+    sg.reset()
+
+
+@sg.guard_fn({"x": "B,t,D", "mask": "B,t"}, returns="B,D")
+def pool(x, mask=None, *, scale=1.0):
+    sg(x, "B,t,D")
+    return x.sum(axis=1) * scale
+
+
+def test_guards_arguments_and_return_value():
+    pool(np.zeros((2, 3, 4)), np.zeros((2, 3)))
+    pool(np.zeros((2, 5, 4)), mask=np.zeros((2, 5)))
+    pool(np.zeros((2, 5, 4)))
+    # lower-case dims stay in the throwaway fork
+    assert sg.get().dims == {"B": 2, "D": 4}
+
+    with pytest.raises(ShapeError, match="pool: mask"):
+        pool(np.zeros((2, 3, 4)), np.zeros((2, 4)))
+
+
+def test_return_value():
+    @sg.guard_fn({"x": "N"}, returns="N")
+    def tail(x):
+        return x[1:]
+
+    with pytest.raises(ShapeError, match="return value"):
+        tail(np.zeros(3))
+
+
+def test_named_fork():
+    @sg.guard_fn({"x": "n"}, fork={"stride": 2})
+    def f(x):
+        return x
+
+    f(np.zeros(3))
+    with pytest.raises(ShapeError):
+        f(np.zeros(4))
+
+
+def test_unknown_parameter():
+    with pytest.raises(TypeError):
+        sg.guard_fn({"y": "N"})(lambda x: x)
+
+
+def test_joint_arguments():
+    # K can only be inferred from y, which comes after x
+    @sg.guard_fn({"x": "N*K", "y": "K"})
+    def f(x, y):
+        return sg.get().dims["N"]
+
+    assert f(np.zeros(6), np.zeros(2)) == 3
+    with pytest.raises(ShapeError, match="f: x"):
+        f(np.zeros(7), np.zeros(2))
+
+
+def test_parameters_named_like_options():
+    @sg.guard_fn({"returns": "N", "fork": "N"}, returns="N")
+    def f(returns, fork):
+        return returns
+
+    f(np.zeros(3), np.zeros(3))
+    with pytest.raises(ShapeError, match="f: fork"):
+        f(np.zeros(3), np.zeros(4))
+
+
+def test_hooks():
+    @sg.guard_fn({"x": "N"})
+    def f(x):
+        return x
+
+    sg.enable_stats()
+    sg.set_policy(policy.FirstN(1))
+    for n in (3, 4):
+        f(np.zeros(n))  # the second call isn't checked
+    report = sg.stats()
+    sg.disable_stats()
+    assert report.templates["N"].calls == 2
+    assert report.templates["N"].skipped == 1
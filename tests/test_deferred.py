@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+from shapeguard import ShapeError, sg
+from shapeguard.exception import ShapeGuardError
+
+
+@pytest.fixture(autouse=True)
+def reset_singletons():
+    sg.reset()
+    yield
+    sg.reset()
+
+
+def test_violation_is_raised_at_flush():
+    sg.enable_deferred()
+    sg([1, 2], "A,B")
+    sg([1, 3], "A,B")
+    with pytest.raises(ShapeError, match=r'sg\(\[1, 3\], "A,B"\)'):
+        sg.flush()
+    assert sg.get().dims == {"A": 1, "B": 2}
+    # errors are only raised once
+    sg.flush()
+
+
+def test_on_error_callback():
+    errors = []
+    sg.enable_deferred(on_error=errors.append)
+    sg([1, 2], "A,B")
+    sg([1, 3], "A,B")
+    sg.flush()
+    assert len(errors) == 1 and isinstance(errors[0], ShapeError)
+
+
+def test_drop_when_full():
+    sg.enable_deferred(maxsize=2, block=False)
+    deferred = sg._deferred
+    release = threading.Event()
+    deferred.call_soon(release.wait)
+    for _ in range(5):
+        sg([1, 2], "A,B")
+    release.set()
+    sg.flush()
+    # the worker may or may not have taken the blocking call off the
+    # queue before the guards were submitted
+    assert deferred.dropped in (3, 4)
+    assert deferred.checked == 5 - deferred.dropped
+
+
+def test_fork_dims_are_saved_after_deferred_guards():
+    sg.enable_deferred()
+    with sg.fork(stride=2):
+        sg([1, 2], "a,B")
+    sg.disable_deferred()
+    with sg.fork(stride=2):
+        assert sg.get().dims == {"a": 1, "B": 2}
+
+
+def test_disable_stops_the_worker_on_violation():
+    sg.enable_deferred()
+    thread = sg._deferred._thread
+    sg([1, 2], "A,B")
+    sg([1, 3], "A,B")
+    with pytest.raises(ShapeError):
+        sg.disable_deferred()
+    assert sg._deferred is None
+    assert not thread.is_alive()
+
+
+def test_only_the_first_violation_is_kept():
+    sg.enable_deferred()
+    sg([1, 2], "A,B")
+    for i in range(3, 10):
+        sg([1, i], "A,B")
+    deferred = sg._deferred
+    done = threading.Event()
+    deferred.call_soon(done.set)
+    done.wait()
+    assert deferred.failures == 7
+    with pytest.raises(ShapeError, match=r"\[1, 3\]"):
+        sg.flush()
+    assert deferred.failures == 0 and deferred.error is None
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_flush_fails_if_the_worker_died():
+    sg.enable_deferred()
+    deferred = sg._deferred
+    deferred.call_soon(lambda: 1 / 0)
+    deferred._thread.join()
+    with pytest.raises(ShapeGuardError, match="worker has stopped"):
+        sg.flush()
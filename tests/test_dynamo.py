@@ -0,0 +1,118 @@
+import pytest
+from shapeguard import sg
+
+torch = pytest.importorskip("torch")
+testing = pytest.importorskip("torch._dynamo.testing")
+
+
+@pytest.fixture(autouse=True)
+def reset_singletons():
+    torch._dynamo.reset()
+    sg.reset()
+
+
+def matmul(x, y):
+    return (x @ y).relu()
+
+
+def guarded_matmul(x, y):
+    sg(x, "N, D")
+    sg([y], ["D, M"])
+    return sg(matmul(x, y), "N, M")
+
+
+def compile_counted(fn, **kwargs):
+    counter = testing.CompileCounter()
+    return torch.compile(fn, backend=counter, **kwargs), counter
+
+
+def test_same_graph_as_unguarded():
+    x, y = torch.ones(3, 4), torch.ones(4, 5)
+    plain, plain_counter = compile_counted(matmul)
+    guarded, counter = compile_counted(guarded_matmul)
+    plain(x, y)
+    guarded(x, y)
+    assert counter.frame_count == 1
+    assert counter.op_count == plain_counter.op_count
+    # static dims are inferred at trace time
+    assert sg.get().dims == {"N": 3, "D": 4, "M": 5}
+
+
+def test_static_mismatch_at_trace_time():
+    guarded = torch.compile(guarded_matmul, backend="eager")
+    with pytest.raises(Exception, match="Shape Mismatch"):
+        guarded(torch.ones(3, 4), torch.ones(5, 5))
+
+
+def test_dynamic_dims_are_checked():
+    guarded, counter = compile_counted(guarded_matmul, dynamic=True)
+    guarded(torch.ones(3, 4), torch.ones(4, 5))
+    guarded(torch.ones(7, 8), torch.ones(8, 2))
+    assert counter.frame_count == 1
+    with pytest.raises(Exception, match="Shape Mismatch"):
+        guarded(torch.ones(3, 4), torch.ones(6, 5))
+
+
+def test_noop():
+    guarded, counter = compile_counted(guarded_matmul)
+    with sg.noop():
+        guarded(torch.ones(3, 4), torch.ones(4, 5))
+    assert counter.frame_count == 1
+    assert sg.get().dims == {}
+
+
+def test_inductor():
+    guarded = torch.compile(guarded_matmul, backend="inductor", fullgraph=True)
+    assert guarded(torch.ones(3, 4), torch.ones(4, 5)).shape == (3, 5)
+
+
+def forked(x, y):
+    with sg.fork():
+        sg(x, "n")
+    with sg.fork():
+        sg(y, "n")
+    with sg.fork(stride=2):
+        sg(x, "k")
+    sg(x, "N")
+    with sg.fork():
+        sg(y, "N")
+    return x + 1
+
+
+def test_forks_are_entered_at_trace_time():
+    guarded, counter = compile_counted(forked, fullgraph=True)
+    guarded(torch.ones(3), torch.ones(3))
+    assert counter.frame_count == 1
+    assert sg.get().dims == {"N": 3}
+    assert sg.forks.get(frozenset({("stride", 2)})).dims == {"k": 3}
+
+    torch._dynamo.reset()
+    sg.reset()
+    with pytest.raises(Exception, match="Shape Mismatch"):
+        guarded(torch.ones(3), torch.ones(5))
+    # the fork left open by the error is dropped with the trace
+    assert sg.get() is sg.get_base()
+
+
+def test_dynamic_names_are_local_to_forks():
+    guarded, counter = compile_counted(forked, fullgraph=True, dynamic=True)
+    guarded(torch.ones(3), torch.ones(3))
+    guarded(torch.ones(4), torch.ones(4))
+    assert counter.frame_count == 1
+    # mismatches surface wrapped by dynamo, not as ShapeError
+    with pytest.raises(RuntimeError, match="Shape Mismatch: dim 0 should be N"):
+        guarded(torch.ones(3), torch.ones(5))
+
+
+def test_guard_fn():
+    @sg.guard_fn({"x": "N, D", "y": "D, m"}, returns="N, m")
+    def guarded(x, y):
+        return sg(matmul(x, y), "N, m")
+
+    compiled, counter = compile_counted(guarded, fullgraph=True)
+    compiled(torch.ones(3, 4), torch.ones(4, 5))
+    assert counter.frame_count == 1
+    # m stays in the throwaway fork
+    assert sg.get().dims == {"N": 3, "D": 4}
+    with pytest.raises(Exception, match="Shape Mismatch"):
+        compiled(torch.ones(3, 4), torch.ones(6, 5))
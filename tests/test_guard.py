@@ -117,3 +117,67 @@ def test_guard_ellipsis_infer_dims():
     a = tf.ones([1, 2, 3, 4, 5])
     sg.guard(a, "A, B, ..., C")
     assert sg.dims == {"A": 1, "B": 2, "C": 5}
+
+
+def test_guard_all_solves_jointly():
+    sg = ShapeGuard()
+    x = tf.ones([2, 12])
+    y = tf.ones([2, 4])
+    # N is only inferable once K is known from y
+    sg.guard_all([(x, "B, N*K"), (y, "B, K")])
+    assert sg.dims == {"B": 2, "K": 4, "N": 3}
+
+
+def test_guard_all_ellipsis_and_mapping():
+    sg = ShapeGuard()
+    sg.guard_all({(1, 2, 3, 4): "A, ..., C", (2, 4): "A+1, C"})
+    assert sg.dims == {"A": 1, "C": 4}
+
+
+def test_guard_all_raises():
+    sg = ShapeGuard()
+    with pytest.raises(ShapeError, match="wrong rank"):
+        sg.guard_all([([2, 12], "B, N*K"), ([2], "B, K")])
+    with pytest.raises(ShapeError, match="Actual shape: \\[3, 4\\]"):
+        sg.guard_all([([2, 12], "B, N*K"), ([3, 4], "B, K")])
+    assert sg.dims == {}
+
+
+def test_reshape_views():
+    import numpy as np
+    import torch
+
+    sg = ShapeGuard(dims={"B": 2, "H": 3, "W": 4})
+    for tensor in [np.zeros((2, 3, 4)), torch.zeros(2, 3, 4)]:
+        flat = sg.reshape(tensor, "B, H*W", strict=True)
+        assert tuple(flat.shape) == (2, 12)
+        assert tuple(sg.reshape(tensor, "*, W", strict=True).shape) == (6, 4)
+        # shares memory with tensor
+        flat[0, 0] = 1
+        assert tensor[0, 0, 0] == 1
+
+
+def test_reshape_copies():
+    import numpy as np
+    import torch
+
+    from shapeguard import ReshapeCopyError, set_reshape_copy_hook
+
+    sg = ShapeGuard(dims={"B": 2, "H": 3, "W": 4})
+    copies = []
+    set_reshape_copy_hook(lambda tensor, message: copies.append(message))
+    try:
+        # H and W can't be merged without a copy
+        tensors = [
+            np.zeros((2, 4, 3)).transpose(0, 2, 1),
+            torch.zeros(2, 4, 3).transpose(1, 2),
+        ]
+        for tensor in tensors:
+            with pytest.raises(ReshapeCopyError):
+                sg.reshape(tensor, "B, H*W", strict=True)
+            assert tuple(sg.reshape(tensor, "B, H*W").shape) == (2, 12)
+    finally:
+        set_reshape_copy_hook(None)
+    assert len(copies) == 2 and "copies it" in copies[0]
+    with pytest.raises(ShapeError):
+        sg.reshape(np.zeros((2, 3, 4)), "B, H")
@@ -1,5 +1,10 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
-from shapeguard import sg
+from shapeguard import Always, EveryNth, FirstN, Probability, ShapeError, sg
+from shapeguard.exception import ShapeGuardError
 
 
 @pytest.fixture(autouse=True)
@@ -43,3 +48,204 @@ def test_noop():
     with sg.noop():
         sg([1, 2], "A,B")
         assert sg.get().dims == {}
+
+
+def test_site_cache():
+    sg.enable_site_cache()
+    try:
+        for _ in range(3):
+            sg([1, 2], "A,B")
+        assert sg._site_cache.hits == 2
+        assert sg.get().dims == {"A": 1, "B": 2}
+
+        sg.get().dims["B"] = 3
+        with pytest.raises(ShapeError):
+            for _ in range(2):
+                sg([1, 2], "A,B")
+    finally:
+        sg.disable_site_cache()
+
+
+def test_site_cache_rechecks_changed_shape():
+    sg.enable_site_cache()
+    try:
+        for shape in ([1, 2], [1, 2], [1, 3]):
+            if shape[1] == 3:
+                with pytest.raises(ShapeError):
+                    sg(shape, "A,B")
+            else:
+                sg(shape, "A,B")
+    finally:
+        sg.disable_site_cache()
+
+
+def test_site_cache_respects_forks_and_policies():
+    def guard(template):
+        sg([1, 2], template)
+
+    sg.enable_site_cache()
+    try:
+        with sg.fork(stride=2):
+            guard("A,b")
+            guard("A,b")
+        assert sg._site_cache.hits == 1
+        with sg.fork(stride=3):
+            sg.get().dims["b"] = 3
+            # same site and shape, but b differs in this fork
+            with pytest.raises(ShapeError):
+                guard("A,b")
+
+        sg.set_policy(FirstN(1))
+        for _ in range(3):
+            guard("A,B")
+        # checked once, then skipped by the policy instead of hitting
+        assert sg._site_cache.hits == 1
+    finally:
+        sg.disable_site_cache()
+
+
+def _guard_bad_shapes(n):
+    failures = 0
+    for _ in range(n):
+        try:
+            sg([1, 2], "A,3")
+        except ShapeError:
+            failures += 1
+    return failures
+
+
+def test_policy_first_n():
+    sg.set_policy(FirstN(2))
+    assert _guard_bad_shapes(5) == 2
+
+
+def test_policy_every_nth():
+    sg.set_policy(EveryNth(2))
+    assert _guard_bad_shapes(5) == 3
+
+
+def test_policy_per_template_and_fork():
+    sg.set_policy(FirstN(1))
+    sg.set_policy(Always(), template="A,3")
+    assert _guard_bad_shapes(3) == 3
+
+    sg.set_policy(None, template="A,3")
+    # the template policy counted its calls separately
+    assert _guard_bad_shapes(3) == 1
+    sg.set_policy(FirstN(2), fork={"stride": 2})
+    with sg.fork(stride=2):
+        # and so does the fork policy, so its first calls are checked
+        assert _guard_bad_shapes(3) == 2
+    with sg.fork(stride=3):
+        # no policy of its own: the global count, already past its first call
+        assert _guard_bad_shapes(3) == 0
+
+
+@pytest.mark.parametrize(
+    "make", [lambda: FirstN(0), lambda: EveryNth(0), lambda: Probability(1.5)]
+)
+def test_invalid_policies(make):
+    with pytest.raises(ShapeGuardError):
+        make()
+
+
+def test_policy_throwaway_fork():
+    with pytest.raises(ValueError):
+        sg.set_policy(FirstN(1), fork={})
+    assert not sg._sampling
+
+
+def test_policy_probability():
+    sg.set_policy(Probability(0.5, seed=0))
+    assert 0 < _guard_bad_shapes(100) < 100
+
+
+def test_fork_is_local_to_threads():
+    n_threads = 8
+    barrier = threading.Barrier(n_threads)
+
+    def work(i):
+        with sg.fork(stride=2):
+            sg([i + 1, 5], "n,W")
+            barrier.wait()
+            # other threads have inferred their own `n` in the same fork
+            sg([i + 1], "n")
+            return sg.get().dims["n"]
+
+    with ThreadPoolExecutor(n_threads) as pool:
+        assert list(pool.map(work, range(n_threads))) == list(range(1, n_threads + 1))
+    assert sg.get().dims == {"W": 5}
+
+
+def test_fork_is_local_to_tasks():
+    async def work(i):
+        with sg.fork(stride=2):
+            sg([i], "n")
+            await asyncio.sleep(0)
+            sg([i], "n")
+        with sg.noop():
+            await asyncio.sleep(0)
+            sg([i + 1], "A")
+        sg([3], "A")
+
+    async def main():
+        await asyncio.gather(*(work(i) for i in range(4)))
+
+    asyncio.run(main())
+    assert sg.get().dims == {"A": 3}
+
+
+def test_fork_reuses_saved_dims():
+    with sg.fork(foo=1):
+        sg([1, 2], "a,B")
+    sg([2], "B")
+    with sg.fork(foo=1):
+        assert sg.get().dims == {"a": 1, "B": 2}
+        sg.get().drop("a", "B")
+        assert sg.get().dims == {}
+    assert sg.get().dims == {"B": 2}
+    with sg.fork(foo=1):
+        assert sg.get().dims == {"B": 2}
+
+
+def test_nested_forks():
+    with sg.fork(foo=1):
+        sg([1], "a")
+        with sg.fork(foo=2):
+            sg([2, 3], "a,C")
+            assert sg.get().dims == {"a": 2, "C": 3}
+        assert sg.get().dims == {"a": 1, "C": 3}
+    assert sg.get().dims == {"C": 3}
+
+
+def test_fork_registry_is_bounded():
+    sg.forks.resize(2)
+    try:
+        for length in range(4):
+            with sg.fork(length=length):
+                sg([length], "n")
+        info = sg.forks.info()
+        assert (info.currsize, info.evictions, info.misses) == (2, 2, 4)
+
+        with sg.fork(length=3):
+            assert sg.get().dims == {"n": 3}
+        with sg.fork(length=0):
+            # evicted, so its dims are gone
+            assert sg.get().dims == {}
+    finally:
+        sg.forks.resize(1024)
+
+
+def test_fork_handle():
+    handle = sg.fork_handle(stride=2)
+    with handle as fork_sg:
+        sg([1], "n")
+        assert fork_sg.params == {"stride": 2}
+        with handle:
+            assert sg.get().dims == {}
+            sg([2, 5], "n,W")
+        assert sg.get().dims == {"n": 1, "W": 5}
+    with sg.fork(stride=2):
+        # the outer entry was saved last
+        assert sg.get().dims == {"n": 1, "W": 5}
+    assert sg.forks.info().currsize == 1
@@ -0,0 +1,76 @@
+import pytest
+from shapeguard import ShapeError, sg
+
+jax = pytest.importorskip("jax")
+jnp = pytest.importorskip("jax.numpy")
+from shapeguard.shims.jax import clear_static, mark_static  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def reset_singletons():
+    sg.reset()
+    clear_static()
+
+
+def test_concrete_arrays():
+    sg(jnp.zeros((2, 3)), "B, D")
+    assert sg.get().dims == {"B": 2, "D": 3}
+    assert sg.get().reshape(jnp.zeros((2, 3)), "B*D").shape == (6,)
+
+
+def test_guards_run_once_per_trace():
+    traces = []
+
+    @jax.jit
+    def f(x):
+        traces.append(1)
+        with sg.fork():
+            sg(x, "b, D")
+        return x * 2
+
+    f(jnp.zeros((2, 3)))
+    f(jnp.ones((2, 3)))
+    f(jnp.ones((4, 3)))
+    assert len(traces) == 2
+    with pytest.raises(ShapeError):
+        f(jnp.ones((4, 5)))
+
+
+def test_mark_static():
+    @jax.jit
+    def f(x):
+        with sg.fork():
+            sg(x, "b, d")
+            mark_static("d")
+        return x
+
+    f(jnp.zeros((2, 3)))
+    f(jnp.zeros((4, 3)))
+    with pytest.raises(ShapeError, match="Static dim d changed from 3 to 5"):
+        f(jnp.zeros((4, 5)))
+
+
+def test_static_dims_per_fork_and_reset():
+    @jax.jit
+    def f(x):
+        with sg.fork():
+            sg(x, "b, d")
+            mark_static("d")
+        return x
+
+    @jax.jit
+    def g(x):
+        with sg.fork(stride=2):
+            sg(x, "b, d")
+            mark_static("d")
+        return x
+
+    f(jnp.zeros((2, 3)))
+    # another fork has its own static dims
+    g(jnp.zeros((2, 5)))
+    with pytest.raises(ShapeError, match="Static dim d changed from 3 to 5"):
+        f(jnp.zeros((2, 5)))
+
+    # the failed trace isn't cached, so this traces again
+    sg.reset()
+    f(jnp.zeros((2, 5)))
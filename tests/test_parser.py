@@ -0,0 +1,100 @@
+import random
+
+import pytest
+from shapeguard import parser
+from shapeguard.exception import ShapeGuardError
+from shapeguard.cache import LRUCache
+
+
+@pytest.fixture(autouse=True)
+def clear_spec_cache():
+    parser.spec_cache.clear()
+    yield
+    parser.spec_cache.resize(1024)
+
+
+def test_parse_is_cached():
+    spec = parser.parse("B, C, H, W")
+    assert parser.parse("B, C, H, W") is spec
+    info = parser.spec_cache.info()
+    assert (info.hits, info.misses, info.currsize) == (1, 1, 1)
+
+
+def test_spec_cache_clear():
+    spec = parser.parse("B, C")
+    parser.spec_cache.clear()
+    assert parser.spec_cache.info().currsize == 0
+    assert parser.parse("B, C") is not spec
+
+
+def test_spec_cache_resize():
+    parser.spec_cache.resize(0)
+    assert parser.parse("B, C") is not parser.parse("B, C")
+    assert len(parser.spec_cache) == 0
+
+
+def test_lru_eviction():
+    cache: LRUCache[str, int] = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "a" in cache and "c" in cache and "b" not in cache
+    assert cache.info().evictions == 1
+
+
+def _random_expr(rng, depth=0):
+    choice = rng.randrange(4 if depth < 3 else 2)
+    if choice == 0:
+        return rng.choice(["1", "2", "3.0", "16", ".5e1", "1e2"])
+    elif choice == 1:
+        return rng.choice(["A", "b", "_c", "H2", "width"])
+    elif choice == 2:
+        op = rng.choice(["+", "-", "*", "/"])
+        return f"{_random_expr(rng, depth + 1)} {op} {_random_expr(rng, depth + 1)}"
+    else:
+        return f"({_random_expr(rng, depth + 1)})"
+
+
+def _random_dim(rng):
+    choice = rng.randrange(6)
+    if choice == 0:
+        return rng.choice(["*", "...", "?", "N?"])
+    elif choice == 1:
+        return f"D={_random_expr(rng)}"
+    return _random_expr(rng)
+
+
+def _random_template(rng):
+    template = ",".join(_random_dim(rng) for _ in range(rng.randint(1, 5)))
+    if rng.random() < 0.3:
+        # corrupt the template
+        i = rng.randrange(len(template) + 1)
+        template = (
+            template[:i]
+            + rng.choice(["(", ")", ",", "=", "?", "$", "* ", "1"])
+            + template[i:]
+        )
+    return template
+
+
+def test_fast_parser_agrees_with_lark():
+    from shapeguard import lark_parser
+
+    rng = random.Random(0)
+    for _ in range(2000):
+        template = _random_template(rng)
+        try:
+            expected = lark_parser.parse(template)
+        except Exception as e:
+            with pytest.raises(type(e)):
+                parser.parse_uncached(template)
+            assert parser.is_syntax_error(e) or isinstance(e, ShapeGuardError)
+        else:
+            actual = parser.parse_uncached(template)
+            assert actual == expected
+            assert hash(actual) == hash(expected)
+            assert repr(actual) == repr(expected)
+            assert [type(e) for e in actual.entries] == [
+                type(e) for e in expected.entries
+            ]
@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+import torch
+from shapeguard import sg
+from shapeguard.exception import ShapeGuardError, UnderspecifiedShapeError
+from shapeguard.pool import BufferPool
+
+
+@pytest.fixture(autouse=True)
+def reset_singletons():
+    sg.reset()
+
+
+def test_empty_and_zeros():
+    sg(np.ones((2, 3)), "B, C")
+    x = sg.zeros("B, C*2")
+    assert isinstance(x, np.ndarray)
+    assert x.shape == (2, 6) and x.dtype == np.float32
+    assert not x.any()
+
+    t = sg.empty("B, 1, C", dtype="int64", backend="torch")
+    assert isinstance(t, torch.Tensor)
+    assert tuple(t.shape) == (2, 1, 3) and t.dtype == torch.int64
+
+    with pytest.raises(UnderspecifiedShapeError):
+        sg.empty("B, T")
+    with pytest.raises(UnderspecifiedShapeError):
+        sg.empty("B, *")
+    with pytest.raises(ShapeGuardError):
+        sg.empty("B", backend="jax")
+
+    # without a pool, release does nothing
+    sg.release(x)
+
+
+@pytest.mark.parametrize(
+    "dtype", [np.float32, np.dtype("float32"), "float32", torch.float32]
+)
+def test_torch_dtypes(dtype):
+    sg(np.ones(2), "B")
+    t = sg.zeros("B", dtype=dtype, backend="torch")
+    assert t.dtype == torch.float32
+
+    sg.enable_pool(min_bytes=0)
+    t = sg.empty("B", dtype=dtype, backend="torch")
+    sg.release(t)
+    assert sg.empty("B", dtype=torch.float32, backend="torch") is t
+
+
+def test_unknown_torch_dtype():
+    sg(np.ones(2), "B")
+    with pytest.raises(ShapeGuardError):
+        sg.empty("B", dtype=object, backend="torch")
+    with pytest.raises(ShapeGuardError):
+        sg.empty("B", dtype="Tensor", backend="torch")
+
+
+@pytest.mark.parametrize("backend", ["numpy", "torch"])
+def test_pool_reuses_buffers(backend):
+    sg.enable_pool(min_bytes=0)
+    sg(np.ones((4, 5)), "B, C")
+    x = sg.empty("B, C", backend=backend)
+    x[:] = 1
+    sg.release(x)
+
+    y = sg.zeros("B, C", backend=backend)
+    assert y is x
+    assert not y.any()
+    # another dtype is another key
+    z = sg.empty("B, C", dtype="float64", backend=backend)
+    assert z is not x
+
+    with sg.borrow("B, C", backend=backend) as w:
+        assert w is not y
+    with sg.borrow("B, C", backend=backend) as w2:
+        assert w2 is w
+
+    stats = sg.pool_stats()
+    assert (stats.hits, stats.misses, stats.releases) == (2, 3, 3)
+    assert stats.hit_rate == 0.4
+    assert stats.free_bytes == 4 * 5 * 4
+
+
+def test_release_checks_ownership():
+    sg.enable_pool(min_bytes=0)
+    x = sg.empty("2, 3")
+    sg.release(x)
+    with pytest.raises(ShapeGuardError):
+        sg.release(x)
+    with pytest.raises(ShapeGuardError):
+        sg.release(np.empty((2, 3), dtype=np.float32))
+    sg.disable_pool()
+    with pytest.raises(RuntimeError):
+        sg.pool_stats()
+
+
+def test_eviction():
+    pool = BufferPool(max_bytes=90, min_bytes=0)
+    a = pool.acquire((10,), "int32")
+    b = pool.acquire((5,), "int32")
+    c = pool.acquire((10,), "int32")
+    big = pool.acquire((30,), "int32")
+    pool.release(a)
+    pool.release(b)
+    pool.release(big)  # larger than max_bytes, dropped
+    assert pool.stats().free_bytes == 60
+    pool.release(c)  # evicts b, (5,) being the least recently used key
+    stats = pool.stats()
+    assert stats.free_bytes == 80 and stats.evictions == 2
+
+    assert pool.acquire((10,), "int32") is c
+    assert pool.acquire((10,), "int32") is a
+    assert pool.acquire((5,), "int32") is not b
+    pool.clear()
+    assert pool.stats().free_bytes == 0
+
+
+def test_small_buffers_bypass_the_pool():
+    pool = BufferPool(min_bytes=64)
+    small = pool.acquire((10,), "int32")
+    pool.release(small)
+    pool.release(small)  # not tracked, so no error either
+    assert pool.acquire((10,), "int32") is not small
+
+    large = pool.acquire((16,), "int32")
+    pool.release(large)
+    assert pool.acquire((16,), "int32") is large
+    stats = pool.stats()
+    assert (stats.unpooled, stats.hits, stats.misses) == (2, 1, 1)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import torch
+from shapeguard import ReshapeCopyError, ShapeError, ShapeGuard, sg
+from shapeguard.exception import ShapeGuardError
+from shapeguard.rearrange import compile_pattern, plan_cache
+
+
+@pytest.fixture(autouse=True)
+def reset_singletons():
+    sg.reset()
+
+
+@pytest.mark.parametrize("module", [np, torch])
+def test_rearrange(module):
+    x = module.zeros((2, 3, 4, 5))
+    x[1, 2, 3, 4] = 1
+    y = sg.rearrange(x, "B, C, H, W -> B, H*W, C")
+    assert tuple(y.shape) == (2, 20, 3)
+    assert y[1, 19, 2] == 1
+    assert sg.get().dims == {"B": 2, "C": 3, "H": 4, "W": 5}
+
+    z = sg.rearrange(y, "B, H*W, C -> B, C, H, W")
+    assert (z == x).all()
+    assert tuple(sg.rearrange(x, "B, ... -> ..., 1, B").shape) == (3, 4, 5, 1, 2)
+
+
+def test_views_and_copies():
+    x = np.zeros((2, 3, 4))
+    # transposes and splits are views
+    assert np.shares_memory(sg.rearrange(x, "A, B, C -> C, A, B", strict=True), x)
+    split = sg.rearrange(x.reshape(6, 4), "A*B, C -> B, A, C", strict=True)
+    assert split.shape == (3, 2, 4) and np.shares_memory(split, x)
+    # merging non-adjacent axes copies once
+    with pytest.raises(ReshapeCopyError):
+        sg.rearrange(x, "A, B, C -> B, A*C", strict=True)
+    y = sg.rearrange(x, "A, B, C -> B, A*C")
+    assert y.shape == (3, 8) and not np.shares_memory(y, x)
+
+
+def test_split_needs_known_dims():
+    guard = ShapeGuard()
+    with pytest.raises(ShapeGuardError, match='Unknown dimension "H"'):
+        guard.rearrange(np.zeros((2, 12)), "B, H*W -> B, H, W")
+    guard.dims["W"] = 4
+    assert guard.rearrange(np.zeros((2, 12)), "B, H*W -> B, H, W").shape == (2, 3, 4)
+
+
+def test_plans_are_cached():
+    plan_cache.clear()
+    sg.rearrange(np.zeros((2, 3)), "A, B -> B, A")
+    sg.rearrange(np.zeros((2, 3)), "A, B -> B, A")
+    assert plan_cache.info().hits == 1
+    # nothing to do
+    plan = compile_pattern("A, B -> A, B", 2)
+    assert not plan.split and plan.permutation is None and plan.groups is None
+
+
+def test_invalid_patterns():
+    with pytest.raises(ShapeError):
+        sg.rearrange(np.zeros((2, 3)), "A, B, C -> A, B, C")
+    with pytest.raises(ShapeGuardError, match="same names"):
+        sg.rearrange(np.zeros((2, 3)), "A, B -> A")
+    with pytest.raises(ShapeGuardError, match="only names"):
+        sg.rearrange(np.zeros((2, 3)), "A, B -> A, B+1")
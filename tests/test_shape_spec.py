@@ -0,0 +1,59 @@
+import pytest
+from shapeguard import ShapeError, ShapeGuard
+from shapeguard.parser import parse
+from shapeguard.solver import ASSIGN, DIRECT, INVERT
+
+
+def test_infer_chained_expressions():
+    spec = parse("A, D=B*2, A+C, E=D/2")
+    assert spec.infer([1, 2, 3, 1]) == {"A": 1, "B": 1, "C": 2, "D": 2, "E": 1}
+
+
+def test_solve_order():
+    spec = parse("A, D=B*2, A+C, E=D/2")
+    order = spec.solve_order({})
+    assert [(s.name, s.kind) for s in order.steps] == [
+        ("A", DIRECT),
+        ("B", INVERT),
+        ("C", INVERT),
+        ("D", INVERT),
+        ("E", ASSIGN),
+    ]
+    assert order.unresolved == {}
+    assert spec.solve_order({"A": 3}) is spec.solve_order({"A": 1, "Z": 2})
+
+
+def test_solve_order_unresolved():
+    order = parse("A, B*C").solve_order({})
+    assert [s.name for s in order.steps] == ["A"]
+    assert order.unresolved == {"B": (1,), "C": (1,)}
+    assert "B cannot be inferred" in order.explain()
+
+
+def test_dynamic_entries_defer_to_other_sources():
+    spec = parse("B?, B")
+    assert spec.infer([None, 6]) == {"B": 6}
+    assert [(s.index, s.kind) for s in spec.solve_order({}, (0,)).steps] == [
+        (1, DIRECT)
+    ]
+
+    guard = ShapeGuard()
+    guard.guard_shape([None, 6], "B?, B")
+    assert guard.dims == {"B": 6}
+    with pytest.raises(ShapeError):
+        guard.guard_shape([7], "B")
+
+
+def test_inverted_division():
+    guard = ShapeGuard()
+    guard.guard_shape([2, 8, 3], "8/K, K*2, 10-M")
+    assert guard.dims == {"K": 4, "M": 7}
+
+
+@pytest.mark.parametrize(
+    "template, shape",
+    [("A*B, B", [6, 0]), ("N/K, K", [2, 0]), ("B?, 12/B", [None, 0])],
+)
+def test_zero_divisor_is_a_mismatch(template, shape):
+    with pytest.raises(ShapeError):
+        ShapeGuard().guard_shape(shape, template)
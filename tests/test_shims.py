@@ -0,0 +1,73 @@
+import subprocess
+import sys
+
+import pytest
+from shapeguard import ShapeGuard, register_shim
+from shapeguard.exception import ShapeGuardShimError
+from shapeguard.shims import get_shim
+from shapeguard.shims.shim import TensorShim
+
+
+class Box:
+    def __init__(self, *dims):
+        self.dims = dims
+
+
+class SubBox(Box):
+    pass
+
+
+class BoxShim(TensorShim[Box]):
+    def get_shape(self):
+        return list(self.tensor.dims)
+
+
+def test_register_shim():
+    register_shim(f"{__name__}.Box", BoxShim)
+    assert ShapeGuard().matches(Box(1, 2), "1, 2")
+    assert get_shim(SubBox(3)).get_shape() == [3]
+
+
+def test_register_shim_lazily():
+    register_shim(f"{__name__}.Box", f"{__name__}:BoxShim")
+    assert isinstance(get_shim(Box(1)), BoxShim)
+
+
+def test_unknown_type():
+    with pytest.raises(ShapeGuardShimError):
+        get_shim(object())
+
+
+def test_import_is_lazy():
+    modules = "{'jax', 'lark', 'numpy', 'tensorflow', 'torch'}"
+    code = f"import sys, shapeguard; print(sorted(set(sys.modules) & {modules}))"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    assert out.stdout.strip() == "[]"
+
+
+class LazyArray:
+    def __init__(self, *shape):
+        self.shape = shape
+
+    def __array__(self, *args, **kwargs):
+        raise AssertionError("materialized")
+
+
+class Interfaced:
+    __array_interface__ = {"shape": (2, 3), "typestr": "<f4", "version": 3}
+
+
+def test_shape_protocol():
+    guard = ShapeGuard()
+    guard.guard(LazyArray(10**12, 3), "N, 3")
+    assert guard.dims == {"N": 10**12}
+    # dask uses NaN for unknown chunk sizes
+    assert get_shim(LazyArray(float("nan"), 3)).get_shape() == [None, 3]
+    assert get_shim(Interfaced()).get_shape() == [2, 3]
+
+
+def test_h5py_dataset(tmp_path):
+    h5py = pytest.importorskip("h5py")
+    with h5py.File(tmp_path / "data.h5", "w") as f:
+        dataset = f.create_dataset("x", shape=(1000, 4), dtype="f4")
+        assert ShapeGuard().matches(dataset, "N, 4")
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+from shapeguard import ShapeError, ShapeGuard, sg
+
+
+@pytest.fixture(autouse=True)
+def stats_enabled():
+    sg.reset()
+    sg.enable_stats()
+    yield
+    sg.disable_stats()
+
+
+def test_stats_per_site_and_template():
+    for _ in range(3):
+        sg([1, 2], "A,B")
+    with pytest.raises(ShapeError):
+        sg([1, 2], "A,3")
+
+    report = sg.stats()
+    assert report.templates["A,B"].calls == 3
+    assert report.templates["A,3"].failures == 1
+    assert sum(s.calls for s in report.sites.values()) == 4
+    assert all(s.max_ns > 0 for s in report.sites.values())
+    assert json.loads(report.to_json())["templates"]["A,B"]["calls"] == 3
+
+
+def test_stats_shapeguard_guard():
+    ShapeGuard().guard([1, 2], "A,B")
+    assert sg.stats().templates["A,B"].calls == 1
+
+
+def test_stats_site_cache_hits():
+    sg.enable_site_cache()
+    try:
+        for _ in range(4):
+            sg([1, 2], "A,B")
+    finally:
+        sg.disable_site_cache()
+    assert sg.stats().templates["A,B"].cache_hit_rate == 0.75
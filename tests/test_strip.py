@@ -0,0 +1,114 @@
+import sys
+import textwrap
+
+import pytest
+from shapeguard import strip_modules
+
+GUARDED = """
+from shapeguard import ShapeGuard, sg
+
+def f(x):
+    sg(x, "B, C")
+    y = sg(x * 2, "B, C")
+    ShapeGuard().guard(y, "B, C")
+    guard.guard(y, "B, C")
+    sg.get().guard(y, "B, C")
+    return y
+
+def only_guards(x):
+    sg(x, "B, C")
+
+def control_flow(x):
+    try:
+        sg(x, "B, C")
+    finally:
+        sg(x, "B, C")
+    if x:
+        sg(x, "B, C")
+    else:
+        sg(x, "B, C")
+    for _ in range(2):
+        sg(x, "B, C")
+    while not x:
+        sg(x, "B, C")
+    try:
+        sg(x, "B, C")
+    except ValueError:
+        sg(x, "B, C")
+    with open(__file__):
+        sg(x, "B, C")
+    return x
+
+guard = ShapeGuard()
+"""
+
+UNGUARDED = """
+def f(x):
+    y = x * 2
+    return y
+
+def only_guards(x):
+    pass
+"""
+
+UNRELATED = """
+from shapeguard import ShapeGuard
+
+class Ruler:
+    def guard(self, a, b):
+        return a + b
+
+def sg(a, b):
+    return a * b
+
+def f(x):
+    r = Ruler()
+    total = r.guard(x, 1)
+    return total + sg(x, 3) + Ruler().guard(x, 1)
+
+def g(guard, x):
+    return guard.guard(x, 1)
+
+ShapeGuard = Ruler
+"""
+
+
+@pytest.fixture
+def modules(tmp_path, monkeypatch):
+    package = tmp_path / "strip_pkg"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "guarded.py").write_text(textwrap.dedent(GUARDED))
+    (package / "unguarded.py").write_text(textwrap.dedent(UNGUARDED))
+    (package / "unrelated.py").write_text(textwrap.dedent(UNRELATED))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield
+    for name in [m for m in sys.modules if m.startswith("strip_pkg")]:
+        del sys.modules[name]
+
+
+def test_strip_modules(modules):
+    strip_modules(["strip_pkg"])
+    from strip_pkg import guarded, unguarded
+
+    assert guarded.f(1) == 2
+    assert guarded.f.__code__.co_code == unguarded.f.__code__.co_code
+    assert (
+        guarded.only_guards.__code__.co_code == unguarded.only_guards.__code__.co_code
+    )
+
+
+def test_strip_leaves_valid_blocks(modules):
+    strip_modules(["strip_pkg"])
+    from strip_pkg import guarded
+
+    assert guarded.control_flow(1) == 1
+    assert "sg" not in guarded.control_flow.__code__.co_names
+
+
+def test_strip_only_guards(modules):
+    strip_modules(["strip_pkg"])
+    from strip_pkg import unrelated
+
+    assert unrelated.f(2) == 3 + 6 + 3
+    assert unrelated.g(unrelated.Ruler(), 2) == 3
@@ -0,0 +1,72 @@
+import pytest
+from shapeguard import ShapeError, ShapeGuard, sg
+
+tf = pytest.importorskip("tensorflow")
+
+
+@pytest.fixture(autouse=True)
+def reset_singletons():
+    sg.reset()
+
+
+def traced(fn):
+    traces = []
+
+    @tf.function(
+        input_signature=[tf.TensorSpec([None, 4]), tf.TensorSpec([None, None])]
+    )
+    def wrapper(x, y):
+        traces.append(1)
+        return fn(x, y)
+
+    return wrapper, traces
+
+
+def test_static_dims_checked_once():
+    def fn(x, y):
+        sg(x, "N, D")
+        sg([y], ["N, 2*D"])
+        return tf.reduce_sum(x) + tf.reduce_sum(y)
+
+    f, traces = traced(fn)
+    f(tf.ones((3, 4)), tf.ones((3, 8)))
+    f(tf.ones((5, 4)), tf.ones((5, 8)))
+    assert len(traces) == 1
+    # only static dims are inferred
+    assert sg.get().dims == {"D": 4}
+
+
+def test_dynamic_dims_are_asserted_in_graph():
+    def fn(x, y):
+        sg(x, "N, D")
+        sg(y, "N, 2*D")
+        return y
+
+    f, _ = traced(fn)
+    with pytest.raises(tf.errors.InvalidArgumentError, match="dim 1 should be"):
+        f(tf.ones((5, 4)), tf.ones((5, 9)))
+    with pytest.raises(tf.errors.InvalidArgumentError, match="dim 0 should be N"):
+        f(tf.ones((5, 4)), tf.ones((4, 8)))
+
+
+def test_static_mismatch_at_trace_time():
+    f, _ = traced(lambda x, y: ShapeGuard().guard(x, "N, 5"))
+    with pytest.raises(ShapeError):
+        f(tf.ones((3, 4)), tf.ones((3, 8)))
+
+
+def test_dynamic_names_are_local_to_forks():
+    @tf.function(input_signature=[tf.TensorSpec([None]), tf.TensorSpec([None])])
+    def f(x, y):
+        with sg.fork():
+            sg(x, "n")
+        with sg.fork():
+            sg(y, "n")
+        sg(x, "N")
+        with sg.fork():
+            sg(y, "N")
+        return x
+
+    with pytest.raises(tf.errors.InvalidArgumentError, match="dim 0 should be N"):
+        f(tf.ones(3), tf.ones(5))
+    f(tf.ones(3), tf.ones(3))